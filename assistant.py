@@ -1,15 +1,30 @@
+import asyncio
+import itertools
 import json
 import logging
 import os
 from datetime import date, datetime
-from typing import Callable, Optional
+from typing import Callable, Iterator, Optional
 
 from config import settings
+from context_window import ContextWindow
 from prompts import PARSE_DELETE_QUESTION_WITH_GPT_PROMPT
 from prompts import PARSE_QUESTION_WITH_GPT_PROMPT
+from prompts import PARSE_INTENT_WITH_PAYLOAD_WITH_GPT_PROMPT
 from prompts import PARSE_TASK_WITH_GPT_PROMPT
-from storege import ensure_file_exists, save_json_file, load_json_file, log_deleted_message, log_deleted_task
-from gpt_client import ask_gpt
+from storage_backends import JsonUserStorage, SQLiteUserStorage, UserStorage, get_database
+from storege import get_write_coalescer
+from task_matcher import match_delete_target
+from task_listing import TaskListing, is_next_page_request, parse_date_range
+from task_store import TaskStore
+from gpt_client import ask_gpt, ask_gpt_async, ask_gpt_stream, collect_stream
+from gpt_resilience import UNAVAILABLE_REPLY, GPTUnavailable, raise_if_unavailable
+from hebrew_time import extract_task
+from intent_batcher import get_intent_batcher
+from intent_classifier import KNOWN_INTENTS, IntentClassifier
+from json_stream import iter_json_array
+from metrics import stage_timer
+from reminder_scheduler import get_reminder_scheduler
 
 # Enable debug logging
 DEBUG_MODE = True
@@ -29,15 +44,29 @@ logging.getLogger("httpcore").setLevel(logging.WARNING)
 # client = OpenAI(api_key=settings.openai_api_key)
 # BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-FILE_TASKS_NAME = str(settings.data_dir / settings.lead_template)  # os.path.join(BASE_DIR, "data", "todo_list_{name}.json")
-FILE_MESSAGES_NAME = str(settings.data_dir / settings.chat_template)  # os.path.join(BASE_DIR, "data", "chat_log_{name}.json")
+FILE_TASKS_NAME = str(settings.data_dir / settings.todo_template)  # os.path.join(BASE_DIR, "data", "todo_list_{name}.json")
+FILE_MESSAGES_NAME = str(settings.data_dir / settings.chat_template)  # os.path.join(BASE_DIR, "data", "chat_log_{name}.jsonl")
 
+# Methods a pending confirmation may run, stored by name so the state can be serialized
+CONFIRMABLE_ACTIONS = frozenset({"delete_task", "clear_all_tasks", "reset_all"})
 WELCOME_MESSAGE = "היי! התחלת שיחה עם {name} - העוזר האישי שלך. מה ברצונך?"
 TODAY = date.today().isoformat()  # Current date for temporal context
+FALLBACK_TASK_PROMPT = (
+    "החזר רק JSON תקין! לדוגמה: "
+    '[{"description": "לשלם חשבון", "time": "03/04/2025 18:00"}]'
+    f" היום זה {TODAY}."
+)
+
+# Shared by all sessions so the hit/miss counters reflect the whole process
+intent_classifier = IntentClassifier.from_file(
+    str(settings.data_dir / settings.intent_model_file),
+    threshold=settings.intent_confidence_threshold,
+)
 
 
 class PersonalAssistant:
-    def __init__(self, name: str, todo_list=None, messages=None, confirm_callback=None, settings=settings):
+    def __init__(self, name: str, todo_list=None, messages=None, confirm_callback=None, settings=settings,
+                 storage: UserStorage | None = None, persisted_messages: int = 0):
         """
         Initializes the PersonalAssistant instance.
 
@@ -45,34 +74,180 @@ class PersonalAssistant:
         @param todo_list: Optional initial task list.
         @param messages: Optional chat history.
         @param confirm_callback: Optional callback for yes/no confirmations.
+        @param storage: Optional storage backend, defaults to the one configured in settings.
+        @param persisted_messages: How many of `messages` are already in storage (set by load_state).
         """
         self._name = name
         self._confirm_callback = confirm_callback
         self._awaiting_confirmation = None
+        self._listing: TaskListing | None = None  # the task list being paged with "עוד"
         self._todo_file = FILE_TASKS_NAME.format(name=name)
         self._chat_file = FILE_MESSAGES_NAME.format(name=name)
         self._settings = settings
+        self._storage = storage if storage is not None else self.open_storage(name, settings)
 
-        ensure_file_exists(self._todo_file)
-        ensure_file_exists(self._chat_file)
+        if isinstance(self._storage, JsonUserStorage):
+            self._storage.ensure_files()
 
-        self._todo_list = todo_list if todo_list is not None else []
+        self._todo_list = TaskStore(todo_list or ())
         self._messages = messages if messages is not None else [{
             "role": "system",
             "content": "אתה עוזר אישי חכם. תזכור את מה שהמשתמש אומר וענה בצורה ברורה ונעימה."
         }]
+        # self._messages[:self._persisted_messages] are already in the append-only chat log
+        self._persisted_messages = persisted_messages if messages is not None else 0
+        # Older turns are folded into a rolling summary, the full history is only in storage
+        self._context = ContextWindow(max_tokens=settings.context_max_tokens,
+                                      summary_max_tokens=settings.context_summary_max_tokens)
+        self._summary = ""
+        self._trim_context()
+
+    @staticmethod
+    def open_storage(name: str, settings=settings) -> UserStorage:
+        """Returns the user's storage for the configured backend ("json" or "sqlite")."""
+        if settings.storage_backend == "sqlite":
+            return SQLiteUserStorage(get_database(str(settings.data_dir / settings.sqlite_file)), name)
+        return JsonUserStorage(name, FILE_TASKS_NAME.format(name=name), FILE_MESSAGES_NAME.format(name=name),
+                               coalescer=get_write_coalescer())
 
     def personal_welcome_message(self) -> str:
         """Returns a welcome message personalized with the assistant's name."""
         return WELCOME_MESSAGE.format(name=self._name)
 
     def parse_question_intent_with_gpt(self, question: str) -> str:
-        """Uses GPT to classify the user's intent from the input question."""
-        response = ask_gpt(system_prompt=PARSE_QUESTION_WITH_GPT_PROMPT, user_input=question)
+        """
+        Classifies the user's intent from the input question.
+        Trivial commands are resolved by the local classifier, GPT is used only when it is not confident.
+        """
+        intent = self.resolve_intent_locally(question)
+        if intent:
+            return intent
+        # Concurrent conversations share one batched GPT call, a message it did not answer is asked alone
+        batcher = get_intent_batcher()
+        response = batcher.classify(question) if batcher is not None else None
+        if response is None and self._settings.gpt_streaming:
+            # Stops reading as soon as a complete intent name has arrived
+            response = collect_stream(ask_gpt_stream(system_prompt=PARSE_QUESTION_WITH_GPT_PROMPT,
+                                                     user_input=question, call_site="intent"), stop_at=KNOWN_INTENTS)
+        elif response is None:
+            response = ask_gpt(system_prompt=PARSE_QUESTION_WITH_GPT_PROMPT, user_input=question, call_site="intent")
+        if DEBUG_MODE:
+            logging.debug(response)
+        return response
+
+    async def parse_question_intent_with_gpt_async(self, question: str) -> str:
+        """Async variant of parse_question_intent_with_gpt."""
+        intent = self.resolve_intent_locally(question)
+        if intent:
+            return intent
+        batcher = get_intent_batcher()
+        response = await batcher.classify_async(question) if batcher is not None else None
+        if response is None:
+            response = await ask_gpt_async(system_prompt=PARSE_QUESTION_WITH_GPT_PROMPT, user_input=question,
+                                           call_site="intent")
         if DEBUG_MODE:
             logging.debug(response)
         return response
 
+    def resolve_intent_locally(self, question: str) -> str | None:
+        """Returns the intent from the local classifier, or None when GPT is needed."""
+        if not self._settings.intent_fast_path:
+            return None
+        intent = intent_classifier.resolve(question)
+        if intent and DEBUG_MODE:
+            logging.debug(f"intent (local): {intent}")
+        return intent
+
+    def parse_question_with_payload_with_gpt(self, question: str) -> tuple[str, list | dict | None]:
+        """
+        Uses a single GPT call to classify the intent and extract its payload.
+
+        @param question: The user's message as a string.
+        @return: (intent, payload) – the tasks list for "שמור", a {"query"} dict naming the task for
+                 "מחק משימה", otherwise None. A non-intent message returns GPT's reply as the intent.
+        """
+        response = ask_gpt(system_prompt=self._intent_with_payload_prompt(), user_input=question, cacheable=False,
+                           call_site="intent_payload")
+        return self._parse_intent_with_payload_response(response)
+
+    async def parse_question_with_payload_with_gpt_async(self, question: str) -> tuple[str, list | dict | None]:
+        """Async variant of parse_question_with_payload_with_gpt."""
+        response = await ask_gpt_async(system_prompt=self._intent_with_payload_prompt(), user_input=question,
+                                       cacheable=False, call_site="intent_payload")
+        return self._parse_intent_with_payload_response(response)
+
+    def _intent_with_payload_prompt(self) -> str:
+        # No task list here: the prompt stays the same size however many tasks the user has,
+        # the delete target is matched locally from the "delete_query" words
+        return PARSE_INTENT_WITH_PAYLOAD_WITH_GPT_PROMPT.format(today=TODAY)
+
+    @staticmethod
+    def _parse_intent_with_payload_response(response: str) -> tuple[str, list | dict | None]:
+        """Splits the combined GPT JSON into (intent, payload)."""
+        try:
+            parsed = json.loads(response)
+            assert isinstance(parsed, dict)
+        except (json.JSONDecodeError, AssertionError):
+            if DEBUG_MODE:
+                logging.debug("❌ JSON משולב לא תקין – חוזר לסיווג בלבד")
+            return response, None
+
+        intent = parsed.get("intent")
+        if not intent:
+            return parsed.get("reply") or "", None
+        if DEBUG_MODE:
+            logging.debug(f"intent (combined): {intent}")
+
+        payload = None
+        if intent == "שמור":
+            tasks = parsed.get("tasks")
+            if isinstance(tasks, dict):
+                tasks = [tasks]
+            if isinstance(tasks, list) and tasks and all(
+                    isinstance(task, dict) and "description" in task and "time" in task for task in tasks):
+                payload = tasks
+        elif intent == "מחק משימה":
+            query = parsed.get("delete_query")
+            if isinstance(query, (str, int)) and str(query).strip():
+                payload = {"query": str(query).strip()}
+        # A missing/invalid payload leaves the handler to make its own GPT call
+        return intent, payload
+
+    def parse_question_intent_and_payload(self, question: str) -> tuple[str, list | dict | None]:
+        """Returns the intent and, in combined mode, the payload already extracted for its handler."""
+        with stage_timer("intent"):
+            return self._parse_question_intent_and_payload(question)
+
+    def _parse_question_intent_and_payload(self, question: str) -> tuple[str, list | dict | None]:
+        if not self._settings.combined_intent_parsing:
+            return self.parse_question_intent_with_gpt(question), None
+        intent = self.resolve_intent_locally(question)
+        if intent:
+            return intent, None
+        return self._resolve_delete_query(*self.parse_question_with_payload_with_gpt(question))
+
+    async def parse_question_intent_and_payload_async(self, question: str) -> tuple[str, list | dict | None]:
+        """Async variant of parse_question_intent_and_payload."""
+        with stage_timer("intent"):
+            return await self._parse_question_intent_and_payload_async(question)
+
+    async def _parse_question_intent_and_payload_async(self, question: str) -> tuple[str, list | dict | None]:
+        if not self._settings.combined_intent_parsing:
+            return await self.parse_question_intent_with_gpt_async(question), None
+        intent = self.resolve_intent_locally(question)
+        if intent:
+            return intent, None
+        return self._resolve_delete_query(*await self.parse_question_with_payload_with_gpt_async(question))
+
+    def _resolve_delete_query(self, intent: str, payload: list | dict | None) -> tuple[str, list | dict | None]:
+        """
+        Turns the combined call's {"query"} into a {"index", "description"} target when it matches one task
+        locally; otherwise the handler resolves the whole question (shortlist GPT call when ambiguous).
+        """
+        if isinstance(payload, dict) and "query" in payload:
+            payload = self._match_delete_target(payload["query"])[0]
+        return intent, payload
+
     def dispatch_command(self, intent: str) -> Callable[..., str] | None:
         """Returns the appropriate handler function based on the detected intent."""
         intent_handlers = {
@@ -103,13 +278,14 @@ class PersonalAssistant:
         if self._awaiting_confirmation:
             answer = question.strip().lower()
             if answer == "כן":
-                func, args = self._awaiting_confirmation
+                action, args = self._awaiting_confirmation
                 self._awaiting_confirmation = None
-                if args:
-                    response_text = func(*args)
+                if action not in CONFIRMABLE_ACTIONS:
+                    logging.error(f"❌ פעולה לא מוכרת ממתינה לאישור: {action}")
+                    response_text = "❌ לא ניתן לבצע את הפעולה."
                 else:
-                    response_text = func()
-                if func != self.reset_all:
+                    response_text = getattr(self, action)(*(args or ()))
+                if action != "reset_all":
                     self.keep_chat_history(question, response_text)
                 return response_text
 
@@ -121,60 +297,103 @@ class PersonalAssistant:
             else:
                 return "ענה בבקשה 'כן' או 'לא' כדי שאוכל להמשיך."
 
+        elif self._listing is not None and is_next_page_request(question):
+            response_text = self._next_tasks_page()
+            self.keep_chat_history(question, response_text)
+            return response_text
+
         elif question.lower() == "exit":
             self.save_state()
             return "להתראות!"
 
         elif question == "בקרה":
             # logging.debug(self._messages)
-            return str(self._messages)  # "📊 היסטוריית השיחה הודפסה ללוג."
+            return str(self.context_messages())  # "📊 היסטוריית השיחה הודפסה ללוג."
 
         else:
-            intent = self.parse_question_intent_with_gpt(question)
-            handler = self.dispatch_command(intent)
-            if handler:
-                try:
+            intent, payload = self.parse_question_intent_and_payload(question)
+            return self._handle_intent(question, intent, payload)
+
+    async def process_user_input_async(self, question: str) -> str:
+        """
+        Async counterpart of process_user_input for the async webhook.
+
+        GPT calls are awaited on the event loop; handlers, which mutate state and write to disk,
+        run in a worker thread so the loop keeps serving other conversations.
+
+        @param question: The user's message as a string.
+        @return: A string response from the assistant.
+        """
+        if (self._awaiting_confirmation or question.lower() == "exit" or question == "בקרה"
+                or (self._listing is not None and is_next_page_request(question))):
+            return await asyncio.to_thread(self.process_user_input, question)
+
+        intent, payload = await self.parse_question_intent_and_payload_async(question)
+        if payload is None:
+            try:
+                payload = await self._prefetch_payload_async(intent, question)
+            except GPTUnavailable:
+                intent = UNAVAILABLE_REPLY  # answered and recorded like an outage during classification
+        return await asyncio.to_thread(self._handle_intent, question, intent, payload)
+
+    async def _prefetch_payload_async(self, intent: str, question: str) -> list | dict | None:
+        """
+        Runs the handler's GPT parsing ahead of time so the handler itself never blocks on GPT.
+        An empty payload makes the handler answer with its usual "not understood" message.
+        """
+        if intent == "שמור":
+            tasks = self.parse_save_question_locally(question)
+            if tasks:
+                return tasks
+            try:
+                return await self.parse_save_question_with_gpt_async(question)
+            except GPTUnavailable:
+                raise
+            except Exception:
+                return []
+        if intent == "מחק משימה":
+            return await self.resolve_delete_target_async(question) or {}
+        return None
+
+    def _handle_intent(self, question: str, intent: str, payload: list | dict | None) -> str:
+        """Routes a classified message to its handler and records the exchange."""
+        self._listing = None  # "עוד" only continues a listing that was the last reply
+        handler = self.dispatch_command(intent)
+        if handler:
+            try:
+                if payload is not None:
+                    response = handler(question, payload)
+                else:
                     response = handler(question)
-                    return response
-                except TypeError:
-                    response = handler()
-                    return response
-                finally:
-                    self.keep_chat_history(question, response)
+                return response
+            except TypeError:
+                response = handler()
+                return response
+            except GPTUnavailable:
+                response = UNAVAILABLE_REPLY
+                return response
+            finally:
+                self.keep_chat_history(question, response)
 
-            else:
-                self.keep_chat_history(question, intent)
-                return intent
+        else:
+            self.keep_chat_history(question, intent)
+            return intent
 
     def parse_save_question_with_gpt(self, question: str) -> list:
         """Uses GPT to extract task information from the user's input."""
         prompt = PARSE_TASK_WITH_GPT_PROMPT.format(today=TODAY)
-        response = ask_gpt(system_prompt=prompt, user_input=question)
+        response = ask_gpt(system_prompt=prompt, user_input=question, cacheable=False, call_site="save")
         try:
-            tasks = json.loads(response)  # Parse JSON string to Python object
-            if isinstance(tasks, dict):
-                tasks = [tasks]  # Ensure it's always a list
-            assert isinstance(tasks, list)  # Validate format of each task
-            for task in tasks:
-                assert "description" in task and "time" in task
-            return tasks
+            return self._parse_tasks_response(response)
 
         except json.JSONDecodeError:
             if DEBUG_MODE:
                 logging.debug("❌ JSON לא תקין – מנסה ניסוח מחודש...")
             # Retry once with a simpler prompt
-            fallback_prompt = (
-                f"היום זה {TODAY}. החזר רק JSON תקין! לדוגמה: "
-                '[{"description": "לשלם חשבון", "time": "03/04/2025 18:00"}]'
-            )
-            retry_response = ask_gpt(system_prompt=fallback_prompt, user_input=question)
+            retry_response = ask_gpt(system_prompt=FALLBACK_TASK_PROMPT, user_input=question, cacheable=False,
+                                     call_site="save_retry")
             try:
-                tasks = json.loads(retry_response)
-                if isinstance(tasks, dict):
-                    tasks = [tasks]
-                for task in tasks:
-                    assert "description" in task and "time" in task
-                return tasks
+                return self._parse_tasks_response(retry_response)
             except Exception as e:
                 if DEBUG_MODE:
                     logging.exception("❌ גם הניסיון השני נכשל – שגיאה:")
@@ -189,19 +408,107 @@ class PersonalAssistant:
                 logging.debug("שגיאה לא צפויה:")
             raise
 
-    def save_question(self, question: str) -> str:
-        """Handles task saving based on user input and returns a success/failure message."""
+    def stream_save_question_with_gpt(self, question: str) -> Iterator[dict]:
+        """
+        Streaming variant of parse_save_question_with_gpt: yields every task as soon as GPT closes its
+        JSON object. When the stream holds no valid task, the fallback prompt is tried once as a whole.
+        """
+        prompt = PARSE_TASK_WITH_GPT_PROMPT.format(today=TODAY)
+        chunks = ask_gpt_stream(system_prompt=prompt, user_input=question, cacheable=False, call_site="save")
+        first = next(chunks, "")
+        if first == UNAVAILABLE_REPLY:  # the stream could not be opened
+            chunks.close()
+            raise GPTUnavailable()
+        yielded = 0
+        try:
+            for task in iter_json_array(itertools.chain([first], chunks)):
+                if isinstance(task, dict) and "description" in task and "time" in task:
+                    yielded += 1
+                    yield task
+                elif DEBUG_MODE:
+                    logging.debug(f"הפלט לא כולל description ו-time כנדרש: {task}")
+        except json.JSONDecodeError:
+            if DEBUG_MODE:
+                logging.debug("❌ JSON לא תקין באמצע הזרם")
+        finally:
+            chunks.close()
+        if yielded:
+            return
+        if DEBUG_MODE:
+            logging.debug("❌ לא התקבלו משימות מהזרם – מנסה ניסוח מחודש...")
+        retry_response = ask_gpt(system_prompt=FALLBACK_TASK_PROMPT, user_input=question, cacheable=False,
+                                 call_site="save_retry")
+        yield from self._parse_tasks_response(retry_response)
+
+    def parse_save_question_locally(self, question: str) -> list | None:
+        """
+        Extracts a single task with a common Hebrew time expression ("מחר ב־9", "בעוד יומיים") without GPT.
+        Returns None when the message needs GPT.
+        """
+        if not self._settings.local_time_parsing:
+            return None
+        task = extract_task(question)
+        if task is None:
+            return None
+        if DEBUG_MODE:
+            logging.debug(f"task (local): {task}")
+        return [task]
+
+    async def parse_save_question_with_gpt_async(self, question: str) -> list:
+        """Async variant of parse_save_question_with_gpt, with the same single JSON retry."""
+        prompt = PARSE_TASK_WITH_GPT_PROMPT.format(today=TODAY)
+        response = await ask_gpt_async(system_prompt=prompt, user_input=question, cacheable=False, call_site="save")
+        try:
+            return self._parse_tasks_response(response)
+        except json.JSONDecodeError:
+            if DEBUG_MODE:
+                logging.debug("❌ JSON לא תקין – מנסה ניסוח מחודש...")
+            retry_response = await ask_gpt_async(system_prompt=FALLBACK_TASK_PROMPT, user_input=question,
+                                                 cacheable=False, call_site="save_retry")
+            return self._parse_tasks_response(retry_response)
+
+    @staticmethod
+    def _parse_tasks_response(response: str) -> list:
+        """
+        Parses GPT's task JSON, raises JSONDecodeError/AssertionError when it is not usable and
+        GPTUnavailable for the canned outage reply.
+        """
+        tasks = json.loads(raise_if_unavailable(response))  # Parse JSON string to Python object
+        if isinstance(tasks, dict):
+            tasks = [tasks]  # Ensure it's always a list
+        assert isinstance(tasks, list)  # Validate format of each task
+        for task in tasks:
+            assert "description" in task and "time" in task
+        return tasks
+
+    def save_question(self, question: str, tasks: list | None = None) -> str:
+        """
+        Handles task saving based on user input and returns a success/failure message.
+
+        @param question: The user's message as a string.
+        @param tasks: Tasks already extracted by the combined intent call, parsed with GPT when None.
+        """
         try:
-            task = self.parse_save_question_with_gpt(question)
+            if tasks is None:
+                tasks = self.parse_save_question_locally(question)
+            if tasks is None and self._settings.gpt_streaming:
+                return self._save_streamed_tasks(question)
+            if tasks is None:
+                tasks = self.parse_save_question_with_gpt(question)
+            task = tasks
             if task:
                 self._todo_list.extend(task)
-                save_json_file(self._todo_file, self._todo_list)
+                with stage_timer("storage_save"):
+                    self._storage.add_tasks(task, self._todo_list)
+                self._schedule_reminders(task)
                 response_text = f"{len(task)} משימות נשמרו בהצלחה. איך עוד אפשר לעזור?"
                 # self.keep_chat_history(question, response_text)
                 return response_text
             else:
                 raise Exception("No tasks returned from GPT")
 
+        except GPTUnavailable:
+            raise  # answered by _handle_intent
         except Exception as e:
             response_text = "לא הצלחתי להבין את המשימה. נסה לנסח שוב."
             # self.keep_chat_history(question, response_text)
@@ -209,45 +516,127 @@ class PersonalAssistant:
                 logging.debug(f"שגיאה: {e}")
             return response_text
 
-    def show_tasks_question(self) -> str:
-        """Returns a string of all tasks currently saved."""
-        if not self._todo_list:
-            return "אין משימות כרגע."
-        show_str = ""
-        for i, task in enumerate(self._todo_list, 1):
-            desc = task.get("description", "ללא תיאור")
-            time = task.get("time")
-            if time:
-                show_str += f"{i}. {desc} ({time})\n"
-            else:
-                show_str += f"{i}. {desc}\n"
-        return show_str
-
-    def parse_delete_task_question_with_gpt(self, question: str) -> dict | None:
-        """Uses GPT to determine which task the user wants to delete."""
-        task_list_json = json.dumps(self._todo_list, ensure_ascii=False, indent=2)
-        prompt = PARSE_DELETE_QUESTION_WITH_GPT_PROMPT.format(task_list=task_list_json)
+    def _save_streamed_tasks(self, question: str) -> str:
+        """Saves every task as soon as it is streamed, so a long list is persisted while GPT still writes it."""
+        saved = 0
+        try:
+            for task in self.stream_save_question_with_gpt(question):
+                self._todo_list.append(task)
+                with stage_timer("storage_save"):
+                    self._storage.add_tasks([task], self._todo_list)
+                self._schedule_reminders([task])
+                saved += 1
+        except Exception as e:
+            if not saved:
+                raise
+            if DEBUG_MODE:
+                logging.debug(f"הזרם נקטע אחרי {saved} משימות: {e}")
+        if not saved:
+            raise Exception("No tasks returned from GPT")
+        return f"{saved} משימות נשמרו בהצלחה. איך עוד אפשר לעזור?"
+
+    def _schedule_reminders(self, tasks: list):
+        """Hands newly saved tasks with a due time to the reminder scheduler, when it runs."""
+        scheduler = get_reminder_scheduler()
+        if scheduler is not None:
+            scheduler.schedule_many(self._name, tasks)
+
+    def show_tasks_question(self, question: str | None = None) -> str:
+        """
+        Returns the first page of the saved tasks, filtered by a date range in the question
+        ("הצג משימות מחר", "משימות מ-01/05 עד 10/05"). "עוד" continues with the next page.
+        """
+        date_range = parse_date_range(question) if question else None
+        self._listing = TaskListing(date_range)
+        return self._next_tasks_page()
+
+    def _next_tasks_page(self) -> str:
+        text, more = self._listing.render_page(self._todo_list, page_size=self._settings.task_page_size,
+                                               max_chars=self._settings.task_page_max_chars)
+        if not more:
+            self._listing = None
+        return text
+
+    def resolve_delete_target(self, question: str) -> dict | None:
+        """
+        Finds the task the user wants to delete: explicit numbers and clear description matches are
+        resolved locally, GPT only sees a shortlist of candidates when the match is ambiguous.
+        """
+        target, shortlist = self._match_delete_target(question)
+        if target is not None or not shortlist:
+            return target
+        return self.parse_delete_task_question_with_gpt(question, shortlist)
+
+    async def resolve_delete_target_async(self, question: str) -> dict | None:
+        """Async variant of resolve_delete_target."""
+        target, shortlist = self._match_delete_target(question)
+        if target is not None or not shortlist:
+            return target
+        return await self.parse_delete_task_question_with_gpt_async(question, shortlist)
+
+    def _match_delete_target(self, question: str) -> tuple[dict | None, list]:
+        target, shortlist = match_delete_target(question, self._todo_list,
+                                                threshold=self._settings.delete_match_threshold,
+                                                shortlist_size=self._settings.delete_shortlist_size)
+        if target is not None and DEBUG_MODE:
+            logging.debug(f"delete target (local): {target}")
+        return target, shortlist
+
+    def parse_delete_task_question_with_gpt(self, question: str, shortlist: list | None = None) -> dict | None:
+        """
+        Uses GPT to determine which task the user wants to delete.
 
-        response = ask_gpt(system_prompt=prompt, user_input=question)
+        @param shortlist: (position, Task) candidates to show GPT, the whole list when None.
+        """
+        shortlist = self._delete_candidates(shortlist)
+        response = ask_gpt(system_prompt=self._delete_prompt(shortlist), user_input=question, cacheable=False,
+                           call_site="delete")
+        return self._parse_delete_response(response, shortlist)
+
+    async def parse_delete_task_question_with_gpt_async(self, question: str,
+                                                        shortlist: list | None = None) -> dict | None:
+        """Async variant of parse_delete_task_question_with_gpt."""
+        shortlist = self._delete_candidates(shortlist)
+        response = await ask_gpt_async(system_prompt=self._delete_prompt(shortlist), user_input=question,
+                                       cacheable=False, call_site="delete")
+        return self._parse_delete_response(response, shortlist)
+
+    def _delete_candidates(self, shortlist: list | None) -> list:
+        return shortlist if shortlist is not None else list(enumerate(self._todo_list))
+
+    @staticmethod
+    def _delete_prompt(shortlist: list) -> str:
+        candidates = [{"index": position + 1, **task.to_dict()} for position, task in shortlist]
+        task_list_json = json.dumps(candidates, ensure_ascii=False, indent=2)
+        return PARSE_DELETE_QUESTION_WITH_GPT_PROMPT.format(task_list=task_list_json)
+
+    @staticmethod
+    def _parse_delete_response(response: str, shortlist: list) -> dict | None:
+        raise_if_unavailable(response)
         try:
             task_parsed = json.loads(response)
             if not task_parsed:
                 raise
             if not ("index" in task_parsed and "description" in task_parsed):
                 raise
+            if task_parsed["index"] not in {position + 1 for position, _ in shortlist}:
+                raise
             return task_parsed
 
         except Exception as e:
             if DEBUG_MODE:
-                logging.exception("❌ לא הצלחתי להבין את בקשת המחיקה.", e)
+                logging.exception(f"❌ לא הצלחתי להבין את בקשת המחיקה: {e}")
             return None
 
     def delete_task(self, index: int, desc: str, original_question: str) -> str:
         """Prepares task deletion by asking for confirmation from the user."""
         try:
             task = self._todo_list.pop(index - 1)
-            log_deleted_task(self._name, task)
-            save_json_file(self._todo_file, self._todo_list)
+            with stage_timer("storage_save"):
+                self._storage.delete_task(index - 1, task, self._todo_list)
+            scheduler = get_reminder_scheduler()
+            if scheduler is not None:
+                scheduler.cancel(self._name, task)
             response = f"המשימה '{desc}' נמחקה."
         except IndexError:
             logging.error("אינדקס לא חוקי")
@@ -259,47 +648,56 @@ class PersonalAssistant:
         # self.keep_chat_history(original_question, response)
         return response
 
-    def ensure_delete_intent(self, question: str) -> str:
-        """Executes confirmed deletion of a task by index."""
+    def ensure_delete_intent(self, question: str, target: dict | None = None) -> str:
+        """
+        Executes confirmed deletion of a task by index.
+
+        @param question: The user's message as a string.
+        @param target: {"index", "description"} already extracted by the combined intent call, parsed with GPT when None.
+        """
         try:
-            task = self.parse_delete_task_question_with_gpt(question)
+            task = target if target is not None else self.resolve_delete_target(question)
             index = task["index"]
             desc = task["description"]
-            self._awaiting_confirmation = (self.delete_task, (index, desc, question))
+            self._awaiting_confirmation = ("delete_task", (index, desc, question))
             response_text = f'האם למחוק את המשימה: "{desc}" (#{index})? [כן/לא]'
             # self.keep_chat_history(question, response_text)
             return response_text
+        except GPTUnavailable:
+            raise  # answered by _handle_intent
         except Exception:
             response_text = "❌ לא הצלחתי להבין מה למחוק."
             # self.keep_chat_history(question, response_text)
             return response_text
 
-    def clear_all_tasks(self):
+    def clear_all_tasks(self, original_question: str | None = None):
         """Clears all saved tasks."""
-        save_json_file(self._todo_file, self._todo_list)
         self._todo_list.clear()
+        self._storage.clear_tasks()
+        scheduler = get_reminder_scheduler()
+        if scheduler is not None:
+            scheduler.cancel_user(self._name)
         response_text = "רשימת המשימות נמחקה, איך עוד אפשר לעזור?."
         # self.keep_chat_history(question, response_text)
         return response_text
 
     def ensure_delete_all_tasks_intent(self, original_question: str):
         """Executes confirmed deletion all task."""
-        self._awaiting_confirmation = (self.clear_all_tasks, None)
+        self._awaiting_confirmation = ("clear_all_tasks", ())
         response_text = "האם למחוק את כל המשימות? [כן/לא]"
         # self.keep_chat_history(original_question, response_text)
         return response_text
 
     def clear_messages(self) -> str:
-        """Clears the assistant's message history."""
-        entry = {
-            "deleted_at": datetime.now().isoformat(timespec="seconds"),
-            "task": self._messages
-        }
-        log_deleted_message(self._name, entry=entry)
+        """Clears the assistant's message history, the whole stored log is moved to the deleted messages log."""
+        self._persist_new_messages()
+        self._storage.archive_messages(datetime.now().isoformat(timespec="seconds"))
         self._messages.clear()
+        self._persisted_messages = 0
+        self._summary = ""
         return "היסטוריית השיחות נמחקה"
 
-    def reset_all(self) -> str:
+    def reset_all(self, original_question: str | None = None) -> str:
         """Performs a full reset of tasks and messages."""
         self.clear_all_tasks()
         self.clear_messages()
@@ -307,11 +705,12 @@ class PersonalAssistant:
             "role": "system",
             "content": "אתה עוזר אישי חכם. תזכור את מה שהמשתמש אומר וענה בצורה ברורה ונעימה."
         })
+        self._persist_new_messages()
         return self.personal_welcome_message()
 
     def ensure_reset_intent(self, original_question: str):
         """Executes confirmed reset"""
-        self._awaiting_confirmation = (self.reset_all, None)
+        self._awaiting_confirmation = ("reset_all", ())
         response_text = "האם ברצונך לאפס הכל ולמחוק את המשמיות ואת היסטוריית השיחה? [כן/לא]"
         # self.keep_chat_history(original_question, response_text)
         return response_text
@@ -320,28 +719,81 @@ class PersonalAssistant:
         """Appends the latest exchange to the assistant's memory."""
         self._messages.append({"role": "user", "content": question})
         self._messages.append({"role": "assistant", "content": f"{response}"})
+        self._persist_new_messages()
+        self._trim_context()
+
+    def context_messages(self) -> list:
+        """Returns the bounded conversation context: system message, rolling summary and recent turns."""
+        if not self._summary:
+            return list(self._messages)
+        summary = {"role": "system", "content": self._summary}
+        if self._messages and self._messages[0].get("role") == "system":
+            return [self._messages[0], summary] + self._messages[1:]
+        return [summary] + self._messages
+
+    def _trim_context(self):
+        """Folds the oldest persisted turns into the summary while the history is over the token budget."""
+        removed, self._summary = self._context.trim(self._messages, self._summary,
+                                                    foldable=self._persisted_messages)
+        self._persisted_messages -= removed
+
+    def _persist_new_messages(self):
+        """Appends the messages not yet in the chat log – only the new ones, never the whole history."""
+        with stage_timer("storage_save"):
+            if self._persisted_messages > len(self._messages):  # history was replaced in memory
+                self._storage.replace_messages(self._messages)
+            elif self._persisted_messages < len(self._messages):
+                self._storage.append_messages(self._messages[self._persisted_messages:])
+        self._persisted_messages = len(self._messages)
+
+    def export_state(self) -> dict:
+        """
+        The conversation state that is not in storage, as JSON-serializable data.
+        Lets another worker process continue the conversation (e.g. answer a pending confirmation).
+        """
+        pending = None
+        if self._awaiting_confirmation:
+            action, args = self._awaiting_confirmation
+            pending = [action, list(args or ())]
+        listing = self._listing.to_dict() if self._listing is not None else None
+        return {"awaiting_confirmation": pending, "summary": self._summary, "listing": listing}
+
+    def restore_state(self, state: dict | None):
+        """Applies a state produced by export_state(), None leaves the assistant as loaded."""
+        if not state:
+            return
+        pending = state.get("awaiting_confirmation")
+        self._awaiting_confirmation = (pending[0], tuple(pending[1])) if pending else None
+        self._summary = state.get("summary") or self._summary
+        listing = state.get("listing")
+        self._listing = TaskListing.from_dict(listing) if listing else None
 
     @classmethod
     def load_state(cls, name: str, confirm_callback=None) -> "PersonalAssistant":
         """
         Loads a saved PersonalAssistant instance by name.
-        Read tasks and messages from files if they exist, otherwise initializes them with default values.
+        Read tasks and messages from storage if they exist, otherwise initializes them with default values.
         """
-        todo_file = FILE_TASKS_NAME.format(name=name)
-        chat_file = FILE_MESSAGES_NAME.format(name=name)
-        if os.path.exists(todo_file):
-            todo_list = load_json_file(todo_file)
-        else:
-            todo_list = []
+        with stage_timer("storage_load"):
+            storage = cls.open_storage(name)
+            todo_list = storage.load_tasks()
+            # Only the tail needed for context is read; None makes __init__ enter system to messages
+            messages = storage.load_messages(limit=settings.chat_context_messages)
 
-        if os.path.exists(chat_file):
-            messages = load_json_file(chat_file)
-        else:
-            messages = None  # Makes to __init__ enter system to messages
+        return cls(name=name, todo_list=todo_list, messages=messages, confirm_callback=confirm_callback,
+                   storage=storage, persisted_messages=len(messages) if messages else 0)
 
-        return cls(name=name, todo_list=todo_list, messages=messages, confirm_callback=confirm_callback)
+    @classmethod
+    async def load_state_async(cls, name: str, confirm_callback=None) -> "PersonalAssistant":
+        """Async variant of load_state, the file reads run off the event loop."""
+        return await asyncio.to_thread(cls.load_state, name, confirm_callback)
 
     def save_state(self):
         """Saves current task list and message history to disk."""
-        save_json_file(self._todo_file, self._todo_list)
-        save_json_file(self._chat_file, self._messages)
+        with stage_timer("storage_save"):
+            self._storage.save_tasks(self._todo_list.to_dicts())
+        self._persist_new_messages()
+
+    async def save_state_async(self):
+        """Async variant of save_state, the writes run off the event loop."""
+        await asyncio.to_thread(self.save_state)
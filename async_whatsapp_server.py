@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+
+from aiohttp import web
+from twilio.twiml.messaging_response import MessagingResponse
+from assistant import PersonalAssistant
+from config import settings
+from idempotency import get_idempotency_store
+from metrics import add_stats_collector, registry as metrics, render_metrics, stage_timer, webhook_requests
+from reminder_scheduler import start_configured_reminders
+from session_store import build_session_manager
+from storege import flush_pending_writes
+
+# Async counterpart of whatsapp_server: one process serves many in-flight conversations,
+# GPT calls are awaited instead of holding a worker thread.
+
+# A single event loop serves every conversation, so sessions stay resident even when
+# session_state_backend is set for the threaded server's workers
+user_sessions = build_session_manager(settings, loader=lambda name: PersonalAssistant.load_state(name=name),
+                                      shared=False)
+add_stats_collector("sessions", user_sessions.metrics)
+# name -> [lock, messages in flight]; a user's lock only exists while one of their messages is in flight
+_session_locks: dict[str, list] = {}
+
+
+async def root(request: web.Request) -> web.Response:
+    return web.Response(text="🟢 OK")
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Prometheus scrape target, 404 unless settings.metrics_enabled."""
+    text = render_metrics()
+    if text is None:
+        raise web.HTTPNotFound()
+    return web.Response(text=text, content_type="text/plain")
+
+
+async def pin_session(from_number: str) -> PersonalAssistant:
+    """
+    Returns the user's assistant pinned in the session store (never evicted until unpin),
+    rehydrating it from disk in a worker thread when it is not resident.
+    """
+    if from_number in user_sessions:
+        return user_sessions.pin(from_number)
+    return await asyncio.to_thread(user_sessions.pin, from_number)
+
+
+async def process_message(from_number: str, incoming_msg: str) -> str:
+    """
+    Runs a message through the user's assistant. Messages of the same user are handled one at a time,
+    different users run concurrently. The session stays pinned while the message waits and runs.
+    """
+    entry = _session_locks.setdefault(from_number, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        assistant = await pin_session(from_number)
+        try:
+            async with entry[0]:
+                return await assistant.process_user_input_async(incoming_msg)
+        finally:
+            user_sessions.unpin(from_number)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _session_locks[from_number]
+
+
+async def whatsapp_webhook(request: web.Request) -> web.Response:
+    metrics.inc(webhook_requests, server="aiohttp")
+    with stage_timer("webhook"):
+        return await _handle_webhook(request)
+
+
+async def _handle_webhook(request: web.Request) -> web.Response:
+    values = await request.post() if request.method == "POST" else request.query
+    incoming_msg = values.get("Body", "").strip()
+    from_number = values.get("From", "").replace("whatsapp", "")
+    logging.info(f"📩 הודעה מ-{from_number}: {incoming_msg}")
+
+    # Twilio retries slow webhooks with the same MessageSid, a retry must not save the tasks again
+    deliveries = get_idempotency_store()
+    if deliveries is not None:
+        response_text = await deliveries.run_once_async(values.get("MessageSid"),
+                                                        lambda: process_message(from_number, incoming_msg))
+    else:
+        response_text = await process_message(from_number, incoming_msg)
+
+    twiml = MessagingResponse()
+    if response_text is None:
+        logging.info(f"🔁 הודעה {values.get('MessageSid')} עדיין בעיבוד")
+        return web.Response(text=str(twiml), content_type="application/xml")
+    twiml.message(response_text)
+    logging.info(response_text)
+    return web.Response(text=str(twiml), content_type="application/xml")
+
+
+async def _start_reminders(application: web.Application):
+    start_configured_reminders()
+
+
+async def _flush_sessions(application: web.Application):
+    await asyncio.to_thread(user_sessions.flush_all)
+    await asyncio.to_thread(flush_pending_writes)
+
+
+def create_app() -> web.Application:
+    application = web.Application()
+    application.on_startup.append(_start_reminders)
+    application.on_shutdown.append(_flush_sessions)
+    application.router.add_get("/", root)
+    application.router.add_get("/metrics", metrics_endpoint)
+    application.router.add_get("/whatsapp", whatsapp_webhook)
+    application.router.add_post("/whatsapp", whatsapp_webhook)
+    return application
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", 4000))
+    web.run_app(app, host="0.0.0.0", port=port)
@@ -0,0 +1,73 @@
+import logging
+import queue
+import threading
+import zlib
+from typing import Callable
+
+from message_sender import MessageSender
+
+ERROR_REPLY = "אירעה שגיאה בעיבוד ההודעה. נסה שוב בעוד רגע."
+_STOP = object()
+
+
+class WebhookWorkerPool:
+    """
+    Processes webhook messages in background threads and replies through a MessageSender.
+
+    Every user is pinned to one worker queue (by a hash of the number), so messages of the same user
+    are handled in order and never concurrently, while different users run in parallel.
+    """
+
+    def __init__(self, process_message: Callable[[str, str], str], sender: MessageSender,
+                 workers: int = 4, max_queue_size: int = 1000):
+        """
+        @param process_message: Called as process_message(from_number, text) and returns the reply text.
+        @param sender: Used to deliver the reply.
+        @param workers: Number of worker threads.
+        @param max_queue_size: Per-worker queue bound, submit() raises queue.Full beyond it.
+        """
+        self._process_message = process_message
+        self._sender = sender
+        self._queues = [queue.Queue(maxsize=max_queue_size) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"webhook-worker-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, reply_to: str, from_number: str, text: str):
+        """Enqueues a message without waiting for it to be processed."""
+        index = zlib.crc32(from_number.encode("utf-8")) % len(self._queues)
+        self._queues[index].put_nowait((reply_to, from_number, text))
+
+    def _run(self, work_queue: queue.Queue):
+        while True:
+            item = work_queue.get()
+            try:
+                if item is _STOP:
+                    return
+                reply_to, from_number, text = item
+                try:
+                    response_text = self._process_message(from_number, text)
+                except Exception:
+                    logging.exception(f"❌ שגיאה בעיבוד הודעה מ-{from_number}")
+                    response_text = ERROR_REPLY
+                try:
+                    self._sender.send(reply_to, response_text)
+                except Exception:
+                    logging.exception(f"❌ שליחת התשובה אל {reply_to} נכשלה")
+            finally:
+                work_queue.task_done()
+
+    def join(self):
+        """Blocks until every queued message has been processed."""
+        for work_queue in self._queues:
+            work_queue.join()
+
+    def stop(self, timeout: float | None = None):
+        """Drains the queues and stops the workers."""
+        for work_queue in self._queues:
+            work_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
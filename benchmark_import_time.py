@@ -0,0 +1,70 @@
+"""
+Measures the cold-start import time of the entry points in fresh interpreters.
+
+Run with:
+    python benchmark_import_time.py [--runs 5] [--modules whatsapp_server main]
+
+For every module it reports the median import time and whether the import pulled in the OpenAI
+SDK; with the lazy gpt_client it should not, the SDK and its HTTP pool load on the first GPT call.
+--eager adds "import openai" before the module, which is what the import used to cost.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["whatsapp_server", "async_whatsapp_server", "main"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{prelude}
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "openai_loaded": "openai" in sys.modules}}))
+"""
+
+
+def measure(module: str, runs: int = 5, eager: bool = False) -> dict:
+    """
+    Imports a module in `runs` fresh interpreters.
+
+    @param eager: Also import the OpenAI SDK up front, as the module did before the clients became lazy.
+    @return: {"module", "median_ms", "min_ms", "openai_loaded"}
+    """
+    code = _PROBE.format(module=module, prelude="import openai" if eager else "")
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)  # importing must not need the key
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples, openai_loaded = [], False
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=here, env=env, capture_output=True, text=True,
+                             check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["seconds"] * 1000)
+        openai_loaded = openai_loaded or result["openai_loaded"]
+    return {"module": module, "median_ms": statistics.median(samples), "min_ms": min(samples),
+            "openai_loaded": openai_loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time of the entry points")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--eager", action="store_true", help="compare with importing the OpenAI SDK up front")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        lazy = measure(module, args.runs)
+        line = (f"{module:24} {lazy['median_ms']:7.1f}ms (min {lazy['min_ms']:.1f}ms)"
+                f"  openai נטען: {'כן' if lazy['openai_loaded'] else 'לא'}")
+        if args.eager:
+            eager = measure(module, args.runs, eager=True)
+            line += f"  | עם openai: {eager['median_ms']:7.1f}ms, חיסכון {eager['median_ms'] - lazy['median_ms']:.1f}ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
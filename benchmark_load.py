@@ -0,0 +1,381 @@
+"""
+Offline load test of the WhatsApp webhook with a fake LLM and a fake Twilio.
+
+Run with:
+    python benchmark_load.py [--users 2000] [--messages 3] [--concurrency 32]
+                             [--latency lognormal:0.05:0.5] [--mode sync|background]
+                             [--baseline tests/load_baseline.json] [--tolerance 0.25] [--save-baseline]
+                             [--check-timing]
+
+Thousands of simulated phone numbers send a Hebrew message mix to whatsapp_server.app over HTTP.
+GPT is the local fake OpenAI server from tests/, answering every prompt plausibly after a delay drawn
+from --latency ("fixed:S", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA", in seconds). In background
+mode the webhook acks at once and a message counts as done when its reply reaches the fake Twilio
+sender. The report has p50/p95/p99 latency, messages/sec and the per-stage breakdown from metrics.py.
+
+The run fails (exit status 1) when it regresses against the baseline beyond --tolerance. By default only
+numbers that do not depend on the machine are compared: GPT calls per message and errors. --check-timing
+also compares latency and throughput, scaled by a CPU calibration run stored with each report, so a
+baseline recorded on other hardware is still a fair reference.
+No real OpenAI or Twilio call is made and the data files go to a temporary directory.
+"""
+import argparse
+import atexit
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from typing import Callable, Optional
+from urllib.parse import urlencode
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, "tests", "load_baseline.json")
+
+TASKS = [
+    "לקנות חלב", "להתקשר לאמא", "פגישה עם דנה", "לשלם חשבון חשמל", "לאסוף את הילדים", "תור לרופא שיניים",
+    "לשלוח מייל לבוס", "להחזיר ספר לספרייה", "לתקן את האופניים", "להזמין שולחן במסעדה",
+]
+
+# (weight, template) – simple saves with a time are parsed locally, the rest need GPT
+MESSAGE_MIX = [
+    (30, "מחר ב-{hour} {task}"),
+    (15, "תזכיר לי {task} ו{other}"),
+    (20, "הצג משימות"),
+    (10, "מחק 1"),
+    (15, "מה שלומך היום?"),
+    (10, "צריך {task}"),
+]
+
+
+def make_message(rng: random.Random) -> str:
+    """Draws a message from MESSAGE_MIX."""
+    template = rng.choices([template for _, template in MESSAGE_MIX], weights=[w for w, _ in MESSAGE_MIX])[0]
+    task, other = rng.sample(TASKS, 2)
+    return template.format(task=task, other=other, hour=rng.randint(8, 20))
+
+
+class LatencyModel:
+    """Fake GPT latency: "fixed:S", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA" (seconds)."""
+
+    def __init__(self, spec: str):
+        kind, *params = spec.split(":")
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"unknown latency spec {spec!r}")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(param) for param in params]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+def _tasks_from(text: str) -> list[dict]:
+    for prefix in ("תזכיר לי ", "צריך "):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    return [{"description": part.strip(), "time": None} for part in text.split(" ו") if part.strip()]
+
+
+def _guess_intent(text: str) -> Optional[str]:
+    if "מחק" in text:
+        return "מחק משימה"
+    if "הצג" in text:
+        return "הצג משימות"
+    if any(word in text for word in ("תזכיר", "צריך", "מחר")):
+        return "שמור"
+    return None
+
+
+def fake_llm_reply(system_prompt: str, user_input: str) -> str:
+    """A plausible reply for each of the assistant's prompts, recognised by their opening words."""
+    prompt = system_prompt.lstrip()
+    if prompt.startswith(("אתה מקבל טקסט של משימות", "החזר רק JSON")):
+        return json.dumps(_tasks_from(user_input), ensure_ascii=False)
+    if prompt.startswith("אתה מקבל טקסט מהמשתמש, ועליך"):
+        intent = _guess_intent(user_input)
+        return json.dumps({
+            "intent": intent,
+            "tasks": _tasks_from(user_input) if intent == "שמור" else None,
+            "delete_query": "1" if intent == "מחק משימה" else None,
+            "reply": None if intent else "אני כאן כדי לעזור!",
+        }, ensure_ascii=False)
+    if prompt.startswith("המשתמש ביקש למחוק משימה"):
+        return json.dumps({"index": 1, "description": ""})
+    if prompt.startswith("אתה מקבל רשימת הודעות"):
+        return json.dumps([{"id": item["id"], "intent": _guess_intent(item["text"])}
+                           for item in json.loads(user_input)], ensure_ascii=False)
+    return _guess_intent(user_input) or "אני כאן כדי לעזור!"
+
+
+def make_responder(latency: LatencyModel, seed: int = 0) -> Callable[[dict], dict]:
+    """FakeOpenAIServer responder: fake_llm_reply after a delay drawn from the latency model."""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def respond(body: dict) -> dict:
+        messages = body.get("messages", [])
+        system = messages[0]["content"] if messages else ""
+        user = messages[-1]["content"] if messages else ""
+        with lock:
+            delay = latency.sample(rng)
+        return {"content": fake_llm_reply(system, user), "delay": delay}
+
+    return respond
+
+
+def _recording_sender():
+    from message_sender import FakeMessageSender
+
+    class RecordingSender(FakeMessageSender):
+        """Fake Twilio that lets a simulated user wait for the n-th reply to its number."""
+
+        def __init__(self):
+            super().__init__()
+            self._arrived = threading.Condition()
+            self._counts: dict[str, int] = {}
+
+        def send(self, to: str, body: str):
+            super().send(to, body)
+            with self._arrived:
+                self._counts[to] = self._counts.get(to, 0) + 1
+                self._arrived.notify_all()
+
+        def wait_for(self, to: str, count: int, timeout: float) -> bool:
+            with self._arrived:
+                return self._arrived.wait_for(lambda: self._counts.get(to, 0) >= count, timeout)
+
+    return RecordingSender()
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of unsorted samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _breakdown(before: dict, after: dict) -> dict:
+    breakdown = {}
+    for key, (count, total) in sorted(after.items()):
+        count -= before.get(key, (0, 0.0))[0]
+        total -= before.get(key, (0, 0.0))[1]
+        if count:
+            breakdown[key[0]] = {"count": count, "avg_ms": round(total / count * 1000, 2)}
+    return breakdown
+
+
+def run_load(users: int = 2000, messages_per_user: int = 3, concurrency: int = 32, mode: str = "sync",
+             seed: int = 1, phone_prefix: str = "+97250") -> dict:
+    """
+    Drives whatsapp_server.app over HTTP and returns the report.
+    GPT must already point at a fake server (main() sets OPENAI_BASE_URL before the imports).
+
+    @param mode: "sync" measures the webhook response, "background" the time until the fake Twilio
+                 sender got the reply.
+    """
+    import metrics
+    import whatsapp_server as ws
+    from background_worker import WebhookWorkerPool
+    from werkzeug.serving import make_server
+
+    metrics.registry.enabled = True
+    stages_before = metrics.stage_seconds.snapshot()
+    gpt_before = metrics.gpt_request_seconds.snapshot()
+
+    sender = _recording_sender() if mode == "background" else None
+    previous = ws.settings.webhook_background_processing, ws.worker_pool
+    if sender is not None:
+        ws.settings.webhook_background_processing = True
+        ws.worker_pool = WebhookWorkerPool(ws.process_message, sender, workers=ws.settings.webhook_workers,
+                                           max_queue_size=users * messages_per_user)
+
+    httpd = make_server("127.0.0.1", 0, ws.app, threaded=True)
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    server_thread.start()
+
+    run_id = uuid.uuid4().hex[:8]
+
+    def simulate(user_index: int) -> list[tuple[float, bool]]:
+        rng = random.Random(seed * 1_000_003 + user_index)
+        reply_to = f"whatsapp:{phone_prefix}{user_index:07d}"
+        connection = HTTPConnection("127.0.0.1", httpd.server_port, timeout=60)
+        results = []
+        for sent in range(1, messages_per_user + 1):
+            message_sid = f"SM{run_id}{user_index:07d}{sent:04d}"  # unique, so the idempotency store is exercised
+            body = urlencode({"Body": make_message(rng), "From": reply_to, "MessageSid": message_sid})
+            started = time.perf_counter()
+            try:
+                connection.request("POST", "/whatsapp", body, {"Content-Type": "application/x-www-form-urlencoded"})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+                if ok and sender is not None:
+                    ok = sender.wait_for(reply_to, sent, timeout=60)
+            except OSError:
+                connection.close()
+                ok = False
+            results.append((time.perf_counter() - started, ok))
+        connection.close()
+        return results
+
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for results in pool.map(simulate, range(users)):
+                for seconds, ok in results:
+                    latencies.append(seconds)
+                    errors += not ok
+        duration = time.perf_counter() - started
+    finally:
+        httpd.shutdown()
+        if sender is not None:
+            ws.worker_pool.stop(5)
+        ws.settings.webhook_background_processing, ws.worker_pool = previous
+
+    return {
+        "config": {"users": users, "messages_per_user": messages_per_user, "concurrency": concurrency,
+                   "mode": mode},
+        "messages": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "messages_per_sec": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 2)
+                       for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))},
+        "stages_ms": _breakdown(stages_before, metrics.stage_seconds.snapshot()),
+        "gpt_ms": _breakdown(gpt_before, metrics.gpt_request_seconds.snapshot()),
+    }
+
+
+def calibrate(rounds: int = 5) -> float:
+    """
+    Milliseconds of a fixed CPU-bound workload (JSON round trips and sorting, no application code),
+    the best of `rounds`. The ratio between two machines scales the timings of their reports.
+    """
+    payload = [{"id": index, "text": TASKS[index % len(TASKS)] * 3} for index in range(2000)]
+    best = math.inf
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(5):
+            json.loads(json.dumps(payload, ensure_ascii=False))
+            sorted(json.dumps(item, ensure_ascii=False) for item in payload)
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 3)
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float = 0.25,
+                        check_timing: bool = False) -> list[str]:
+    """
+    Returns the regressions of report against baseline: more than `tolerance` more GPT calls per message,
+    or more errors. With check_timing also p95/p99 latency more than `tolerance` higher or throughput
+    more than `tolerance` lower, after scaling the baseline by the ratio of the calibration runs.
+    """
+    regressions = []
+    current, reference = report["gpt_requests_per_message"], baseline["gpt_requests_per_message"]
+    if current > reference * (1 + tolerance):
+        regressions.append(f"GPT calls per message: {current:.3f} > {reference:.3f} (+{tolerance:.0%})")
+    if report["errors"] > baseline["errors"]:
+        regressions.append(f"errors: {report['errors']} > {baseline['errors']}")
+    if not check_timing:
+        return regressions
+
+    scale = report["calibration_ms"] / baseline["calibration_ms"]  # above 1 on a slower machine
+    for name in ("p95", "p99"):
+        current, reference = report["latency_ms"][name], baseline["latency_ms"][name] * scale
+        if current > reference * (1 + tolerance):
+            regressions.append(f"latency {name}: {current:.1f}ms > {reference:.1f}ms (+{tolerance:.0%})")
+    current, reference = report["messages_per_sec"], baseline["messages_per_sec"] / scale
+    if current < reference * (1 - tolerance):
+        regressions.append(f"throughput: {current:.1f} msg/s < {reference:.1f} msg/s (-{tolerance:.0%})")
+    return regressions
+
+
+def _print_report(report: dict):
+    latency = report["latency_ms"]
+    print(f"{report['messages']} הודעות מ-{report['config']['users']} משתמשים ({report['config']['mode']}), "
+          f"{report['errors']} שגיאות, {report['messages_per_sec']:.1f} הודעות/שנייה")
+    print(f"latency: p50 {latency['p50']:.1f}ms  p95 {latency['p95']:.1f}ms  p99 {latency['p99']:.1f}ms  "
+          f"max {latency['max']:.1f}ms")
+    print(f"GPT calls per message: {report['gpt_requests_per_message']:.3f}, calibration {report['calibration_ms']:.1f}ms")
+    for title, section in (("stage", report["stages_ms"]), ("gpt", report["gpt_ms"])):
+        for name, values in section.items():
+            print(f"  {title:5} {name:16} {values['count']:7d} × {values['avg_ms']:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the WhatsApp webhook")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=3, help="messages per user, sent one after the other")
+    parser.add_argument("--concurrency", type=int, default=32, help="users talking at the same time")
+    parser.add_argument("--latency", default="lognormal:0.05:0.5", help="fake GPT latency distribution")
+    parser.add_argument("--mode", choices=["sync", "background"], default="sync")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--check-timing", action="store_true",
+                        help="also fail on calibrated latency/throughput regressions")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(HERE, "tests"))
+    from fake_openai_server import FakeOpenAIServer
+
+    fake_llm = FakeOpenAIServer(responder=make_responder(LatencyModel(args.latency), args.seed),
+                                record_requests=False).start()
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Must be set before config is imported by run_load
+        os.environ.update({"DATA_DIR": data_dir, "OPENAI_API_KEY": "fake-key", "OPENAI_BASE_URL": fake_llm.base_url})
+        logging.disable(logging.INFO)  # the assistant's debug logging would dominate the timings
+        try:
+            report = run_load(args.users, args.messages, args.concurrency, args.mode, args.seed)
+            import whatsapp_server
+            from storege import flush_pending_writes
+
+            whatsapp_server.user_sessions.flush_all()
+            flush_pending_writes()
+            atexit.unregister(whatsapp_server.user_sessions.flush_all)  # the data directory is removed below
+        finally:
+            fake_llm.stop()
+    report["config"]["latency"] = args.latency
+    report["gpt_requests"] = fake_llm.request_count
+    report["gpt_requests_per_message"] = round(fake_llm.request_count / max(report["messages"], 1), 4)
+    report["calibration_ms"] = calibrate()
+    _print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"baseline נשמר ב-{args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("אין baseline להשוואה – הרץ עם --save-baseline")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["config"] != report["config"]:
+        print(f"⚠️ הגדרות ה-baseline שונות: {baseline['config']}")
+    regressions = compare_to_baseline(report, baseline, args.tolerance, check_timing=args.check_timing)
+    for regression in regressions:
+        print(f"❌ רגרסיה – {regression}")
+    if regressions:
+        sys.exit(1)
+    print("✅ אין רגרסיה מול ה-baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Compares the local Hebrew time parser with the GPT save path on a labelled corpus.
+
+Run with:
+    python benchmark_time_parser.py [--corpus tests/hebrew_time_corpus.jsonl] [--repeat 1000] [--gpt]
+
+Each corpus line is {"text", "now", "tasks", "local"}: the message, the reference time, the tasks
+GPT should return, and whether the local parser is expected to handle it. --gpt also runs every
+message through the GPT save prompt (needs OPENAI_API_KEY and makes real calls).
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+from hebrew_time import extract_task
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "hebrew_time_corpus.jsonl")
+
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate_local(corpus: list[dict], repeat: int = 1000) -> dict:
+    """
+    Runs the local parser on the corpus.
+
+    @return: coverage (share of messages handled locally), accuracy and false positives on the handled
+             ones, and the average parse time in microseconds.
+    """
+    handled = correct = false_positives = 0
+    for case in corpus:
+        task = extract_task(case["text"], datetime.fromisoformat(case["now"]))
+        if task is None:
+            continue
+        handled += 1
+        if not case["local"]:
+            false_positives += 1
+        elif task == case["tasks"][0]:
+            correct += 1
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in corpus:
+            extract_task(case["text"], datetime.fromisoformat(case["now"]))
+    elapsed = time.perf_counter() - start
+    return {
+        "cases": len(corpus),
+        "coverage": handled / len(corpus) if corpus else 0.0,
+        "accuracy": correct / handled if handled else 0.0,
+        "false_positives": false_positives,
+        "avg_us": elapsed / (repeat * len(corpus)) * 1e6 if corpus and repeat else 0.0,
+    }
+
+
+def evaluate_gpt(corpus: list[dict]) -> dict:
+    """Runs the GPT save prompt on the corpus, with TODAY set to each case's reference date."""
+    from gpt_client import ask_gpt
+    from prompts import PARSE_TASK_WITH_GPT_PROMPT
+
+    correct_times = 0
+    latencies = []
+    for case in corpus:
+        prompt = PARSE_TASK_WITH_GPT_PROMPT.format(today=case["now"][:10])
+        start = time.perf_counter()
+        response = ask_gpt(system_prompt=prompt, user_input=case["text"], cacheable=False,
+                           call_site="benchmark")
+        latencies.append(time.perf_counter() - start)
+        try:
+            tasks = json.loads(response)
+            tasks = [tasks] if isinstance(tasks, dict) else tasks
+            times = [task.get("time") for task in tasks]
+        except (json.JSONDecodeError, AttributeError):
+            times = None
+        if times == [task["time"] for task in case["tasks"]]:
+            correct_times += 1
+    return {
+        "cases": len(corpus),
+        "time_accuracy": correct_times / len(corpus) if corpus else 0.0,
+        "avg_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local Hebrew time parser against GPT")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--gpt", action="store_true", help="also run the GPT path (real API calls)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    local = evaluate_local(corpus, repeat=args.repeat)
+    print(f"local: {local['cases']} הודעות, כיסוי {local['coverage']:.0%}, דיוק {local['accuracy']:.0%}, "
+          f"{local['false_positives']} טעויות בהודעות שצריכות GPT, {local['avg_us']:.1f}µs להודעה")
+    if args.gpt:
+        gpt = evaluate_gpt(corpus)
+        print(f"gpt:   {gpt['cases']} הודעות, דיוק זמנים {gpt['time_accuracy']:.0%}, {gpt['avg_ms']:.0f}ms להודעה")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,21 +8,106 @@ BASE_DIR = Path(__file__).resolve().parent
 
 class Settings(BaseSettings):
     # --- API keys ---
-    openai_api_key: str = Field(..., env="OPENAI_API_KEY")
+    openai_api_key: str | None = Field(None, env="OPENAI_API_KEY")  # checked on the first GPT call
     twilio_account_sid: str | None = Field(None, env="TWILIO_ACCOUNT_SID")
     twilio_auth_token: str | None = Field(None, env="TWILIO_AUTH_TOKEN")
+    twilio_whatsapp_from: str | None = Field(None, env="TWILIO_WHATSAPP_FROM")
+    openai_base_url: str | None = Field(None, env="OPENAI_BASE_URL")  # e.g. a local fake server in tests
 
     # --- Paths ---
     data_dir: Path = BASE_DIR / "data"
     todo_template: str = "todo_list_{name}.json"
-    chat_template: str = "chat_log_{name}.json"
+    chat_template: str = "chat_log_{name}.jsonl"
     log_todo_template: str = "deleted_tasks_{name}.jsonl"
     log_chat_file: str = "deleted_messages_{name}.jsonl"
 
+    # --- Storage ---
+    storage_backend: str = "json"  # "json" (file per user) or "sqlite"
+    sqlite_file: str = "assistant.sqlite3"
+    storage_fsync: bool = False  # fsync JSON files before the atomic rename
+    write_coalesce_ms: int = 0  # >0 batches JSON task writes per user within this window
+    chat_context_messages: int = 50  # chat log tail loaded by load_state
+    context_max_tokens: int = 2000  # in-memory chat history budget, older turns are summarized
+    context_summary_max_tokens: int = 300
+
     # --- Bot params ---
     gpt_model: str = "gpt-4o"
     temperature: float = 0.3
 
+    # --- Webhook ---
+    webhook_background_processing: bool = False  # ack Twilio at once, reply later via the REST API
+    webhook_workers: int = 4
+
+    # --- Webhook idempotency (Twilio MessageSid) ---
+    idempotency_backend: str | None = "memory"  # "memory", "sqlite" (shared by worker processes) or None
+    idempotency_file: str = "webhook_deliveries.sqlite3"
+    idempotency_ttl_seconds: int = 3600
+    idempotency_max_entries: int = 100_000
+
+    # --- Session store ---
+    session_max_resident: int = 10_000
+    session_idle_ttl_seconds: int = 3600
+    session_memory_budget_mb: float | None = 256
+    # Conversation state (pending confirmation, summary) shared by worker processes: "memory", "redis" or None
+    session_state_backend: str | None = None
+    redis_url: str = "redis://localhost:6379/0"
+    session_state_ttl_seconds: int = 86_400
+
+    # --- Task listing ---
+    task_page_size: int = 20
+    task_page_max_chars: int = 1500  # WhatsApp caps a message at 1600 characters
+
+    # --- Reminders ---
+    reminders_enabled: bool = False  # send a WhatsApp message when a task comes due (needs Twilio settings)
+    reminder_lead_minutes: int = 0
+    reminder_load_batch_size: int = 1000
+    reminder_resync_seconds: float = 0  # >0 reloads all stored tasks this often, only in `python reminder_scheduler.py`
+    reminder_leader_lease_seconds: float = 30  # with SESSION_STATE_BACKEND=redis one worker sends the reminders
+
+    # --- GPT HTTP client ---
+    gpt_max_connections: int = 100
+    gpt_max_keepalive_connections: int = 20
+    gpt_keepalive_expiry_seconds: float = 30
+    gpt_http2: bool = True
+    gpt_streaming: bool = True  # stream save/intent replies and act on each task or intent as it arrives
+
+    # --- GPT resilience ---
+    gpt_deadline_seconds: float = 30  # whole ask_gpt call, retries included
+    gpt_attempt_timeout_seconds: float = 15
+    gpt_max_attempts: int = 4
+    gpt_retry_base_delay: float = 0.5  # jittered exponential backoff
+    gpt_retry_max_delay: float = 8
+    gpt_breaker_failures: int = 5  # consecutive failures that open the circuit breaker
+    gpt_breaker_reset_seconds: float = 30
+    gpt_hedge: bool = False  # duplicate slow requests after the p95 latency
+    gpt_hedge_percentile: float = 0.95
+
+    # --- GPT response cache ---
+    gpt_cache_backend: str | None = "memory"  # "memory", "sqlite" or None
+    gpt_cache_file: str = "gpt_cache.sqlite3"
+    gpt_cache_ttl_seconds: int = 3600
+    gpt_cache_max_entries: int = 10_000
+
+    # --- Local intent fast path ---
+    intent_fast_path: bool = True
+    intent_confidence_threshold: float = 0.85
+    intent_model_file: str = "intent_model.json"
+    combined_intent_parsing: bool = True  # intent + save/delete payload in a single GPT call
+
+    # --- Local time parser ---
+    local_time_parsing: bool = True  # simple saves with a common time expression skip GPT
+
+    # --- Intent batching (only used when combined_intent_parsing is off) ---
+    intent_batch_window_ms: int = 10  # >0 batches intent calls that arrive while another one is in flight
+    intent_batch_max_size: int = 16
+
+    # --- Metrics ---
+    metrics_enabled: bool = False  # stage timers and the /metrics route; off costs one flag check per stage
+
+    # --- Local delete matcher ---
+    delete_match_threshold: float = 0.6  # n-gram similarity needed to pick a task without GPT
+    delete_shortlist_size: int = 5  # candidates sent to GPT when the match is ambiguous
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,84 @@
+import re
+from typing import Callable
+
+SUMMARY_HEADER = "סיכום השיחה עד כה:"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local estimate of the number of model tokens in a text, no tokenizer download needed.
+
+    Every punctuation mark counts as one token and every word as one token per 3 characters,
+    which is close to what BPE tokenizers produce for Hebrew and a slight over-estimate for English.
+    """
+    return sum((len(token) + 2) // 3 for token in _TOKEN_RE.findall(text))
+
+
+def message_tokens(message: dict, counter: Callable[[str], int] = count_tokens) -> int:
+    """Tokens of one chat message, including the per-message overhead of the chat format."""
+    return counter(str(message.get("content", ""))) + 4
+
+
+class ContextWindow:
+    """
+    Keeps the in-memory chat history of a session under a token budget.
+
+    When the history goes over max_tokens, the oldest turns are folded into a short rolling summary
+    (one line per message, each line cut to line_chars) and dropped from memory. The summary itself is
+    capped at summary_max_tokens by forgetting its oldest lines. The full history stays in storage.
+    """
+
+    def __init__(self, max_tokens: int = 2000, summary_max_tokens: int = 300, line_chars: int = 80,
+                 counter: Callable[[str], int] = count_tokens):
+        """
+        @param max_tokens: Budget for the messages kept in memory, the system message and summary excluded.
+        @param summary_max_tokens: Budget for the rolling summary.
+        @param line_chars: Maximum characters kept from each folded message.
+        """
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self._line_chars = line_chars
+        self._counter = counter
+
+    def trim(self, messages: list, summary: str, foldable: int) -> tuple[int, str]:
+        """
+        Removes the oldest messages (after a leading system message) until the rest fits the budget.
+
+        @param messages: History to trim in place.
+        @param summary: Current rolling summary ("" when there is none).
+        @param foldable: Only messages before this index may be removed, e.g. the ones already in storage.
+        @return: (number of removed messages, updated summary)
+        """
+        start = 1 if messages and messages[0].get("role") == "system" else 0
+        sizes = [message_tokens(message, self._counter) for message in messages[start:]]
+        total = sum(sizes)
+        end = start
+        while total > self.max_tokens and end < foldable and end < len(messages) - 2:
+            total -= sizes[end - start]
+            end += 1
+        if end == start:
+            return 0, summary
+
+        lines = summary.split("\n")[1:] if summary else []
+        lines.extend(self._summary_line(message) for message in messages[start:end])
+        del messages[start:end]
+        return end - start, self._bounded_summary(lines)
+
+    def _summary_line(self, message: dict) -> str:
+        speaker = "משתמש" if message.get("role") == "user" else "עוזר"
+        text = " ".join(str(message.get("content", "")).split())
+        if len(text) > self._line_chars:
+            text = text[:self._line_chars - 1] + "…"
+        return f"- {speaker}: {text}"
+
+    def _bounded_summary(self, lines: list) -> str:
+        sizes = [self._counter(line) + 1 for line in lines]
+        budget = self.summary_max_tokens - self._counter(SUMMARY_HEADER)
+        total = sum(sizes)
+        first = 0
+        while total > budget and first < len(lines):
+            total -= sizes[first]
+            first += 1
+        return "\n".join([SUMMARY_HEADER] + lines[first:]) if lines[first:] else ""
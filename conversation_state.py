@@ -0,0 +1,281 @@
+import json
+import logging
+import select
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+from urllib.parse import urlparse
+
+STATE_KEY = "assistant:state:{name}"
+LOCK_KEY = "assistant:lock:{name}"
+
+# A lease is only renewed or released by its holder, checked and changed in one atomic step
+RENEW_LEASE_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                      "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end")
+RELEASE_LEASE_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                        "return redis.call('del', KEYS[1]) else return 0 end")
+
+
+class StateLockTimeout(Exception):
+    """Raised when another worker holds the user's lock for longer than the lock timeout."""
+
+
+class ConversationStateStore:
+    """
+    Shared store of the conversation state that is not in UserStorage (pending confirmation,
+    rolling summary), plus a per-user lock so one user's messages never run on two workers at once.
+    """
+
+    def get(self, name: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set(self, name: str, state: dict):
+        raise NotImplementedError
+
+    def delete(self, name: str):
+        raise NotImplementedError
+
+    def lock(self, name: str):
+        """Context manager holding the user's lock, raises StateLockTimeout when it cannot be taken."""
+        raise NotImplementedError
+
+
+class InMemoryStateStore(ConversationStateStore):
+    """Process-local store, for a single worker and for tests. States are kept as JSON like in Redis."""
+
+    def __init__(self):
+        self._states: dict[str, str] = {}
+        self._locks: dict[str, list] = {}  # name -> [lock, holders and waiters], dropped when unused
+        self._guard = threading.Lock()
+
+    def get(self, name: str) -> Optional[dict]:
+        data = self._states.get(name)
+        return json.loads(data) if data is not None else None
+
+    def set(self, name: str, state: dict):
+        self._states[name] = json.dumps(state, ensure_ascii=False)
+
+    def delete(self, name: str):
+        self._states.pop(name, None)
+
+    @contextmanager
+    def lock(self, name: str, timeout: float = 30):
+        with self._guard:
+            entry = self._locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            if not entry[0].acquire(timeout=timeout):
+                raise StateLockTimeout(name)
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[name]
+
+
+class RedisError(Exception):
+    """An error reply from the Redis server."""
+
+
+class RespClient:
+    """
+    Minimal Redis client speaking RESP over one socket, enough for GET/SET/DEL.
+    Commands are serialized with a lock. A connection the server closed while idle is reopened before
+    sending; a command is sent again only when it failed before it was fully written, since a command
+    that reached the server (SET NX, a lease script) may already have been applied.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, password: Optional[str] = None,
+                 timeout: float = 5):
+        self._address = (host, port)
+        self._db = db
+        self._password = password
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._written = False  # whether the current command was fully sent
+
+    @classmethod
+    def from_url(cls, url: str, timeout: float = 5) -> "RespClient":
+        """redis://[:password@]host[:port][/db]"""
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password, timeout)
+
+    def execute(self, *args):
+        with self._lock:
+            if self._sock is not None and self._peer_closed():
+                self._close()
+            try:
+                return self._roundtrip(args)
+            except (OSError, ConnectionError):
+                self._close()
+                if self._written:
+                    raise
+                return self._roundtrip(args)
+
+    def _roundtrip(self, args: tuple):
+        self._written = False
+        if self._sock is None:
+            self._connect()
+        self._sock.sendall(self._encode(args))
+        self._written = True
+        return self._read_reply()
+
+    def _peer_closed(self) -> bool:
+        """An idle connection the server closed (timeout, restart) is readable at EOF."""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            return bool(readable) and self._sock.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def _connect(self):
+        self._sock = socket.create_connection(self._address, timeout=self._timeout)
+        self._reader = self._sock.makefile("rb")
+        if self._password:
+            self._sock.sendall(self._encode(("AUTH", self._password)))
+            self._read_reply()
+        if self._db:
+            self._sock.sendall(self._encode(("SELECT", self._db)))
+            self._read_reply()
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = self._reader = None
+
+    @staticmethod
+    def _encode(args: tuple) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class RedisStateStore(ConversationStateStore):
+    """
+    State store on a Redis-compatible server, shared by all worker processes and instances.
+
+    States expire after `ttl_seconds` without activity. The lock is a key set with NX and a
+    lease (lock_ttl_seconds), so a crashed worker cannot block a user forever. While the lock is held
+    a thread renews the lease every third of it, so a slow message (a GPT outage with retries) does not
+    lose the lock; renewing and releasing check the holder's token in one script.
+    """
+
+    def __init__(self, client: RespClient, ttl_seconds: int = 86_400, lock_ttl_seconds: float = 60,
+                 poll_seconds: float = 0.02):
+        self._client = client
+        self.ttl_seconds = ttl_seconds
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.poll_seconds = poll_seconds
+
+    def get(self, name: str) -> Optional[dict]:
+        data = self._client.execute("GET", STATE_KEY.format(name=name))
+        return json.loads(data) if data is not None else None
+
+    def set(self, name: str, state: dict):
+        self._client.execute("SET", STATE_KEY.format(name=name), json.dumps(state, ensure_ascii=False),
+                             "EX", self.ttl_seconds)
+
+    def delete(self, name: str):
+        self._client.execute("DEL", STATE_KEY.format(name=name))
+
+    @contextmanager
+    def lock(self, name: str, timeout: float = 30):
+        key = LOCK_KEY.format(name=name)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self.try_lease(key, token, self.lock_ttl_seconds):
+            if time.monotonic() >= deadline:
+                raise StateLockTimeout(name)
+            time.sleep(self.poll_seconds)
+        stop = threading.Event()
+        keeper = threading.Thread(target=self._keep_lease, args=(key, token, stop), name="state-lock-lease",
+                                  daemon=True)
+        keeper.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            keeper.join()
+            self.release_lease(key, token)
+
+    def try_lease(self, key: str, token: str, seconds: float) -> bool:
+        """Takes the lease on `key` for `seconds` unless another holder has it."""
+        return self._client.execute("SET", key, token, "NX", "PX", int(seconds * 1000)) is not None
+
+    def renew_lease(self, key: str, token: str, seconds: float) -> bool:
+        """Extends our lease, False when it expired and may now belong to someone else."""
+        return bool(self._client.execute("EVAL", RENEW_LEASE_SCRIPT, 1, key, token, int(seconds * 1000)))
+
+    def release_lease(self, key: str, token: str):
+        """Deletes the lease only while it is still ours."""
+        self._client.execute("EVAL", RELEASE_LEASE_SCRIPT, 1, key, token)
+
+    def push(self, key: str, value: str):
+        """Appends to the list at `key`, a queue shared by all workers."""
+        self._client.execute("RPUSH", key, value)
+
+    def pop_many(self, key: str, count: int) -> list[str]:
+        """Removes and returns up to `count` values from the front of the list at `key`."""
+        values = self._client.execute("LPOP", key, count)
+        return [value.decode("utf-8") for value in values or ()]
+
+    def _keep_lease(self, key: str, token: str, stop: threading.Event):
+        while not stop.wait(self.lock_ttl_seconds / 3):
+            try:
+                if not self.renew_lease(key, token, self.lock_ttl_seconds):
+                    logging.warning(f"⚠️ הנעילה {key} פגה לפני סוף העיבוד")
+                    return
+            except (OSError, ConnectionError, RedisError):
+                logging.exception(f"❌ חידוש הנעילה {key} נכשל")
+
+
+def build_state_store(settings) -> Optional[ConversationStateStore]:
+    """Creates the configured shared state store, None keeps sessions resident in this process."""
+    backend = settings.session_state_backend
+    if backend is None:
+        return None
+    if backend == "memory":
+        return InMemoryStateStore()
+    if backend == "redis":
+        return RedisStateStore(RespClient.from_url(settings.redis_url), ttl_seconds=settings.session_state_ttl_seconds)
+    raise ValueError(f"unknown session_state_backend {backend!r}")
@@ -0,0 +1,155 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def normalize_user_input(user_input: str) -> str:
+    """Collapses whitespace and case so trivially different messages share a cache entry."""
+    return re.sub(r"\s+", " ", user_input.strip()).lower()
+
+
+def make_cache_key(model: str, temperature: float, system_prompt: str, user_input: str) -> str:
+    """Builds the cache key from (model, temperature, system prompt hash, normalized user input)."""
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    raw = "\x1f".join([model, f"{temperature:.3f}", prompt_hash, normalize_user_input(user_input)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Interface for ask_gpt response caches."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, response: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _count(self, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+class LRUResponseCache(ResponseCache):
+    """In-memory LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 3600):
+        super().__init__()
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return self._count(None)
+            expires_at, response = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return self._count(None)
+            self._entries.move_to_end(key)
+            return self._count(response)
+
+    def set(self, key: str, response: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """Persistent cache shared between processes, entries expire after ttl_seconds."""
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str, ttl_seconds: float = 3600, max_entries: int = 100_000):
+        super().__init__()
+        self._writes = 0
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS gpt_cache ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS gpt_cache_expires ON gpt_cache(expires_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM gpt_cache WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return self._count(row[0] if row else None)
+
+    def set(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO gpt_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, response, now + self._ttl),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        """Drops expired entries and the oldest ones above max_entries. Runs every PRUNE_EVERY writes."""
+        self._conn.execute("DELETE FROM gpt_cache WHERE expires_at < ?", (now,))
+        self._conn.execute(
+            "DELETE FROM gpt_cache WHERE key IN ("
+            " SELECT key FROM gpt_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self._max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM gpt_cache")
+
+    def close(self):
+        self._conn.close()
+
+
+def build_response_cache(backend: Optional[str], path: str = "", max_entries: int = 10_000,
+                         ttl_seconds: float = 3600) -> Optional[ResponseCache]:
+    """
+    Creates the configured cache backend.
+
+    @param backend: "memory", "sqlite" or None to disable caching.
+    @param path: SQLite file, used by the "sqlite" backend only.
+    """
+    if not backend:
+        return None
+    if backend == "memory":
+        return LRUResponseCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend == "sqlite":
+        return SQLiteResponseCache(path, ttl_seconds=ttl_seconds, max_entries=max_entries)
+    raise ValueError(f"Unknown GPT cache backend: {backend}")
@@ -1,16 +1,97 @@
+import logging
 import os
 import re
-from openai import OpenAI
-from openai.types.chat import ChatCompletion
+import threading
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator
 
 from config import settings
+from gpt_cache import build_response_cache, make_cache_key
+from gpt_resilience import UNAVAILABLE_REPLY, CircuitOpenError, DeadlineExceeded, build_resilient_caller, is_retryable
+from gpt_usage import UsageTracker
+from metrics import gpt_request_seconds, gpt_requests, registry as metrics
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+    from openai.types.chat import ChatCompletion
 
 
 DEBUG_MODE = True
 
 # Set your OpenAI API key
 # OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=settings.openai_api_key)
+# The OpenAI clients (and the openai/httpx imports) are created on the first GPT call, so importing
+# this module is cheap and needs no API key. One pooled client of each kind is shared by the process.
+_client: "OpenAI | None" = None
+_async_client: "AsyncOpenAI | None" = None
+_client_lock = threading.Lock()
+resilience = build_resilient_caller(settings)
+usage = UsageTracker()  # tokens (prompt/completion/cached) and latency per call site
+
+response_cache = build_response_cache(
+    settings.gpt_cache_backend,
+    path=str(settings.data_dir / settings.gpt_cache_file),
+    max_entries=settings.gpt_cache_max_entries,
+    ttl_seconds=settings.gpt_cache_ttl_seconds,
+)
+
+
+def _http_client_options() -> dict:
+    """Keep-alive pool limits and HTTP/2 (when the h2 package is installed) for the shared HTTP clients."""
+    import httpx
+
+    http2 = settings.gpt_http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logging.warning("⚠️ החבילה h2 לא מותקנת – ממשיך עם HTTP/1.1")
+            http2 = False
+    return {
+        "limits": httpx.Limits(max_connections=settings.gpt_max_connections,
+                               max_keepalive_connections=settings.gpt_max_keepalive_connections,
+                               keepalive_expiry=settings.gpt_keepalive_expiry_seconds),
+        "http2": http2,
+    }
+
+
+def _client_options() -> dict:
+    if not settings.openai_api_key:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    # Retries are done by `resilience`, so the SDK's own retries are turned off
+    return {"api_key": settings.openai_api_key, "base_url": settings.openai_base_url, "max_retries": 0}
+
+
+def get_client() -> "OpenAI":
+    """Returns the process-wide OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import DefaultHttpxClient, OpenAI
+                _client = OpenAI(http_client=DefaultHttpxClient(**_http_client_options()), **_client_options())
+    return _client
+
+
+def get_async_client() -> "AsyncOpenAI":
+    """Returns the process-wide AsyncOpenAI client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                _async_client = AsyncOpenAI(http_client=DefaultAsyncHttpxClient(**_http_client_options()),
+                                            **_client_options())
+    return _async_client
+
+
+def __getattr__(name: str):
+    # gpt_client.client / gpt_client.async_client still work, built lazily
+    if name == "client":
+        return get_client()
+    if name == "async_client":
+        return get_async_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def clean_gpt_response(text_response: str) -> str:
@@ -19,14 +100,192 @@ def clean_gpt_response(text_response: str) -> str:
     return text_response
 
 
-def ask_gpt(system_prompt: str, user_input: str, model="gpt-4o", temperature=0.3) -> str:
-    messages = [
+def _cache_lookup(system_prompt: str, user_input: str, model: str, temperature: float,
+                  cacheable: bool, call_site: str) -> tuple[str | None, str | None]:
+    """Returns (cache_key, cached_response); the key is None when the call must bypass the cache."""
+    if not cacheable or response_cache is None:
+        return None, None
+    cache_key = make_cache_key(model, temperature, system_prompt, user_input)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        usage.record_cache_hit(call_site)
+        metrics.inc(gpt_requests, call_site=call_site, outcome="cache_hit")
+    return cache_key, cached
+
+
+def _build_messages(system_prompt: str, user_input: str) -> list[dict]:
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_input},
     ]
-    response: ChatCompletion = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature
-    )
-    return clean_gpt_response(response.choices[0].message.content.strip())
+
+
+def _finish_response(response: "ChatCompletion", cache_key: str | None) -> str:
+    text_response = clean_gpt_response(response.choices[0].message.content.strip())
+    if cache_key is not None:
+        response_cache.set(cache_key, text_response)
+    return text_response
+
+
+def _record_call(call_site: str, started: float, response_usage=None, outcome: str = "ok"):
+    """Records a finished GPT call in `usage` and in the metrics registry."""
+    elapsed = time.monotonic() - started
+    if outcome == "ok":
+        usage.record(call_site, response_usage, elapsed)
+    metrics.observe(gpt_request_seconds, elapsed, call_site=call_site)
+    metrics.inc(gpt_requests, call_site=call_site, outcome=outcome)
+
+
+def _unavailable(error: Exception) -> str:
+    """Canned reply for a GPT outage; errors that are not about availability are raised again."""
+    if isinstance(error, CircuitOpenError):
+        logging.warning("⚡ מפסק GPT פתוח – מחזיר תשובה מוכנה")
+    elif isinstance(error, DeadlineExceeded) or is_retryable(error):
+        logging.error(f"❌ GPT לא זמין: {error.__class__.__name__}")
+    else:
+        raise error
+    return UNAVAILABLE_REPLY
+
+
+def ask_gpt(system_prompt: str, user_input: str, model="gpt-4o", temperature=0.3, cacheable=True,
+            call_site: str = "other") -> str:
+    """
+    Sends a single system+user exchange to GPT and returns the cleaned reply.
+    Timeouts, 429 and 5xx are retried within the configured deadline; when GPT stays unavailable
+    (or the circuit breaker is open) a canned Hebrew reply is returned instead of raising.
+
+    @param cacheable: Pass False when the system prompt embeds volatile data ({today}, {task_list}),
+                      so the response cache is bypassed.
+    @param call_site: Name under which the token usage and latency are recorded in `usage`.
+    """
+    cache_key, cached = _cache_lookup(system_prompt, user_input, model, temperature, cacheable, call_site)
+    if cached is not None:
+        return cached
+
+    messages = _build_messages(system_prompt, user_input)
+    started = time.monotonic()
+    try:
+        client = get_client()
+        response: "ChatCompletion" = resilience.call(lambda timeout: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=timeout,
+        ))
+    except Exception as error:
+        _record_call(call_site, started, outcome="error")
+        return _unavailable(error)
+    _record_call(call_site, started, response.usage)
+    return _finish_response(response, cache_key)
+
+
+async def ask_gpt_async(system_prompt: str, user_input: str, model="gpt-4o", temperature=0.3,
+                        cacheable=True, call_site: str = "other") -> str:
+    """Async variant of ask_gpt built on AsyncOpenAI – does not block the event loop while GPT runs."""
+    cache_key, cached = _cache_lookup(system_prompt, user_input, model, temperature, cacheable, call_site)
+    if cached is not None:
+        return cached
+
+    messages = _build_messages(system_prompt, user_input)
+    started = time.monotonic()
+    try:
+        async_client = get_async_client()
+        response: "ChatCompletion" = await resilience.call_async(lambda timeout: async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=timeout,
+        ))
+    except Exception as error:
+        _record_call(call_site, started, outcome="error")
+        return _unavailable(error)
+    _record_call(call_site, started, response.usage)
+    return _finish_response(response, cache_key)
+
+
+def ask_gpt_stream(system_prompt: str, user_input: str, model="gpt-4o", temperature=0.3,
+                   cacheable=True, call_site: str = "other") -> Iterator[str]:
+    """
+    Streaming variant of ask_gpt: yields the reply text as GPT produces it, so callers can act on
+    the first complete part (a task object, an intent) before the whole completion arrives.
+    Only opening the stream is retried; a cached reply is yielded as a single chunk, and the reply
+    is cached only when the stream was read to the end.
+
+    Reading is bounded by gpt_deadline_seconds as well. A stream that breaks or runs past the deadline
+    counts as a failed call for the circuit breaker: before the first chunk the canned reply is yielded
+    instead, after it the reply just ends where the stream broke.
+    """
+    cache_key, cached = _cache_lookup(system_prompt, user_input, model, temperature, cacheable, call_site)
+    if cached is not None:
+        yield cached
+        return
+
+    messages = _build_messages(system_prompt, user_input)
+    started = time.monotonic()
+    try:
+        client = get_client()
+        stream = resilience.call(lambda timeout: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=timeout,
+            stream=True,
+            stream_options={"include_usage": True},  # the last chunk carries the token usage
+        ), discard=lambda losing_stream: losing_stream.close(), defer_success=True)
+    except Exception as error:
+        _record_call(call_site, started, outcome="error")
+        yield _unavailable(error)
+        return
+
+    parts = []
+    stream_usage = None
+    failure = None
+    deadline = started + resilience.deadline_seconds
+    try:
+        for chunk in stream:
+            if time.monotonic() > deadline:
+                raise DeadlineExceeded()
+            stream_usage = chunk.usage or stream_usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception as error:
+        failure = error
+    finally:
+        stream.close()
+        if failure is None:
+            resilience.breaker.record_success()
+        # A stream closed early by the caller has no usage chunk, only its call and latency are counted
+        _record_call(call_site, started, stream_usage, outcome="ok" if failure is None else "error")
+    if failure is not None:
+        if isinstance(failure, DeadlineExceeded) or is_retryable(failure):
+            resilience.breaker.record_failure()
+            if parts:
+                logging.error(f"❌ זרם GPT נקטע באמצע: {failure.__class__.__name__}")
+                return
+        else:
+            resilience.breaker.record_success()  # the upstream answered, the reply itself was bad
+        yield _unavailable(failure)
+        return
+    if cache_key is not None:
+        response_cache.set(cache_key, clean_gpt_response("".join(parts).strip()))
+
+
+def collect_stream(chunks: Iterable[str], stop_at: Iterable[str] = ()) -> str:
+    """
+    Joins a streamed reply into the same cleaned text ask_gpt returns.
+
+    @param stop_at: Complete replies (e.g. the intent names) that end the read as soon as the text
+                    so far equals one of them and no longer one could still follow.
+    """
+    stop_at = tuple(stop_at)
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        current = text.strip()
+        if current in stop_at and not any(other != current and other.startswith(current) for other in stop_at):
+            if hasattr(chunks, "close"):
+                chunks.close()  # drops the HTTP stream, the rest of the reply is not needed
+            return current
+    return clean_gpt_response(text.strip())
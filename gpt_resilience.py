@@ -0,0 +1,344 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Returned to the user instead of an exception when GPT is unavailable
+UNAVAILABLE_REPLY = "⚠️ השירות עמוס כרגע ולא הצלחתי לענות. נסה שוב בעוד כמה דקות."
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling GPT while the circuit breaker is open."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call could not finish within its deadline, retries included."""
+
+
+class GPTUnavailable(Exception):
+    """Raised by reply parsers that got UNAVAILABLE_REPLY, so no fallback prompt is sent to a GPT that is down."""
+
+
+def raise_if_unavailable(response: str) -> str:
+    """Returns the reply unchanged, raises GPTUnavailable when it is the canned outage reply."""
+    if response == UNAVAILABLE_REPLY:
+        raise GPTUnavailable()
+    return response
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Timeouts, connection errors, 429 and 5xx are worth retrying; 4xx client errors are not.
+    A stream that breaks while it is read raises the raw httpx error, which counts as a connection error.
+    """
+    import httpx
+    import openai  # only needed once a call failed, keeps this module cheap to import
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """The Retry-After header of a 429/503 response, if the server sent one."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RetryPolicy:
+    """Jittered exponential backoff ("full jitter"): attempt n waits a random time in [0, base * 2^n]."""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 8.0,
+                 rng: Callable[[float, float], float] = random.uniform):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng
+
+    def delay(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        @param attempt: 0 for the wait after the first failed attempt.
+        @param error: The failure, its Retry-After header is honoured when present.
+        """
+        server_delay = retry_after_seconds(error) if error is not None else None
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return self._rng(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_seconds`.
+    Then a single trial call is let through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """True when a call may go out now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logging.warning(f"⚡ מפסק GPT נפתח אחרי {self._failures} כשלונות")
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._trial_running = False
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies, used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class ResilientCaller:
+    """
+    Runs GPT calls with a per-call deadline, retries, a circuit breaker and optional hedging.
+
+    The wrapped function receives the timeout left for that attempt. With hedging on, a duplicate
+    request is sent when the first one is slower than the hedge percentile of recent latencies
+    (once min_hedge_samples are known), and whichever finishes first wins.
+    """
+
+    def __init__(self, policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None,
+                 deadline_seconds: float = 30, attempt_timeout_seconds: float = 15,
+                 hedge: bool = False, hedge_percentile: float = 0.95, min_hedge_samples: int = 20,
+                 tracker: Optional[LatencyTracker] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        @param deadline_seconds: Budget for the whole call, retries and waits included.
+        @param attempt_timeout_seconds: Timeout of a single HTTP request.
+        @param hedge: Send a duplicate request after the hedge percentile latency.
+        """
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.tracker = tracker or LatencyTracker()
+        self.deadline_seconds = deadline_seconds
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_samples = min_hedge_samples
+        self.hedged_requests = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before sending a duplicate request, None when hedging is off or not calibrated."""
+        if not self.hedge or len(self.tracker) < self.min_hedge_samples:
+            return None
+        return self.tracker.percentile(self.hedge_percentile)
+
+    def call(self, fn: Callable[[float], T], discard: Optional[Callable[[T], None]] = None,
+             defer_success: bool = False) -> T:
+        """
+        Calls fn(timeout) until it succeeds, fails with a non-retryable error, or the deadline passes.
+
+        @param discard: Called with the result of a hedged request that lost the race, e.g. to close a stream.
+        @param defer_success: The result is a stream, the caller reports success to the breaker once it was read.
+        """
+        deadline = self._clock() + self.deadline_seconds
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            if not self.breaker.allow():
+                raise CircuitOpenError()
+            started = self._clock()
+            try:
+                result = self._hedged(fn, timeout, discard)
+            except Exception as error:
+                if not is_retryable(error):
+                    self.breaker.record_success()  # the upstream answered, the request itself was bad
+                    raise
+                self.breaker.record_failure()
+                if attempt + 1 >= self.policy.max_attempts:
+                    raise
+                wait_seconds = self.policy.delay(attempt, error)
+                if self._clock() + wait_seconds >= deadline:
+                    raise DeadlineExceeded() from error
+                logging.warning(f"🔁 קריאת GPT נכשלה ({error.__class__.__name__}), ניסיון נוסף בעוד {wait_seconds:.2f}s")
+                self._sleep(wait_seconds)
+                attempt += 1
+                continue
+            if not defer_success:
+                self.breaker.record_success()
+            self.tracker.record(self._clock() - started)
+            return result
+
+    async def call_async(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """Async variant of call, the backoff waits do not block the event loop."""
+        deadline = self._clock() + self.deadline_seconds
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            if not self.breaker.allow():
+                raise CircuitOpenError()
+            started = self._clock()
+            try:
+                result = await self._hedged_async(fn, timeout)
+            except Exception as error:
+                if not is_retryable(error):
+                    self.breaker.record_success()  # the upstream answered, the request itself was bad
+                    raise
+                self.breaker.record_failure()
+                if attempt + 1 >= self.policy.max_attempts:
+                    raise
+                wait_seconds = self.policy.delay(attempt, error)
+                if self._clock() + wait_seconds >= deadline:
+                    raise DeadlineExceeded() from error
+                logging.warning(f"🔁 קריאת GPT נכשלה ({error.__class__.__name__}), ניסיון נוסף בעוד {wait_seconds:.2f}s")
+                await asyncio.sleep(wait_seconds)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            self.tracker.record(self._clock() - started)
+            return result
+
+    def _attempt_timeout(self, deadline: float) -> float:
+        remaining = deadline - self._clock()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return min(self.attempt_timeout_seconds, remaining)
+
+    def _hedged(self, fn: Callable[[float], T], timeout: float, discard: Optional[Callable[[T], None]] = None) -> T:
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return fn(timeout)
+        executor = self._get_executor()
+        primary = executor.submit(fn, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        self.hedged_requests += 1
+        backup = executor.submit(fn, timeout - delay)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # the slower request finishes in the background and its result is handed to discard
+                    if discard is not None:
+                        for loser in pending:
+                            loser.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _hedged_async(self, fn: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return await fn(timeout)
+        primary = asyncio.ensure_future(fn(timeout))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        self.hedged_requests += 1
+        pending = {primary, asyncio.ensure_future(fn(timeout - delay))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gpt-hedge")
+            return self._executor
+
+    def stats(self) -> dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "hedged_requests": self.hedged_requests,
+            "latency_p95": self.tracker.percentile(0.95),
+        }
+
+
+def build_resilient_caller(settings) -> ResilientCaller:
+    """Creates the ResilientCaller configured in settings."""
+    return ResilientCaller(
+        policy=RetryPolicy(max_attempts=settings.gpt_max_attempts, base_delay=settings.gpt_retry_base_delay,
+                           max_delay=settings.gpt_retry_max_delay),
+        breaker=CircuitBreaker(failure_threshold=settings.gpt_breaker_failures,
+                               reset_seconds=settings.gpt_breaker_reset_seconds),
+        deadline_seconds=settings.gpt_deadline_seconds,
+        attempt_timeout_seconds=settings.gpt_attempt_timeout_seconds,
+        hedge=settings.gpt_hedge,
+        hedge_percentile=settings.gpt_hedge_percentile,
+    )
@@ -0,0 +1,60 @@
+import threading
+from collections import defaultdict
+from typing import Optional
+
+
+def _tokens(obj, name: str) -> int:
+    value = getattr(obj, name, None)
+    return value if isinstance(value, int) else 0
+
+
+class UsageTracker:
+    """
+    Token usage and latency of GPT calls, per call site ("intent", "save", "delete", ...).
+
+    cached_tokens is the part of the prompt the provider served from its prefix cache, so
+    cached_ratio shows whether the static-prefix prompt layout pays off. Replies served by the
+    local response cache are counted apart, they cost no tokens.
+    """
+
+    _FIELDS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "latency_seconds", "local_cache_hits")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sites: dict[str, dict[str, float]] = defaultdict(lambda: dict.fromkeys(self._FIELDS, 0))
+
+    def record(self, call_site: str, usage=None, latency_seconds: float = 0.0):
+        """
+        @param usage: The response's `usage` object (CompletionUsage), None when the API sent none.
+        """
+        prompt = _tokens(usage, "prompt_tokens")
+        completion = _tokens(usage, "completion_tokens")
+        cached = _tokens(getattr(usage, "prompt_tokens_details", None), "cached_tokens")
+        with self._lock:
+            site = self._sites[call_site]
+            site["calls"] += 1
+            site["prompt_tokens"] += prompt
+            site["completion_tokens"] += completion
+            site["cached_tokens"] += cached
+            site["latency_seconds"] += latency_seconds
+
+    def record_cache_hit(self, call_site: str):
+        with self._lock:
+            self._sites[call_site]["local_cache_hits"] += 1
+
+    def stats(self, call_site: Optional[str] = None) -> dict:
+        """Totals per call site with the cached prompt share and the average latency."""
+        with self._lock:
+            sites = {name: dict(values) for name, values in self._sites.items()
+                     if call_site is None or name == call_site}
+        for values in sites.values():
+            calls = values.pop("calls")
+            latency = values.pop("latency_seconds")
+            values["calls"] = calls
+            values["cached_ratio"] = values["cached_tokens"] / values["prompt_tokens"] if values["prompt_tokens"] else 0.0
+            values["avg_latency_ms"] = latency / calls * 1000 if calls else 0.0
+        return sites if call_site is None else sites.get(call_site, {})
+
+    def reset(self):
+        with self._lock:
+            self._sites.clear()
@@ -0,0 +1,260 @@
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+# Rule-based parser for the Hebrew time expressions users write most often ("מחר ב־9", "בעוד יומיים",
+# "ביום ראשון בערב", "ב-15:00", "12/05"). Anything it is not sure about returns None so the caller
+# can fall back to GPT.
+
+TIME_FORMAT = "%d/%m/%Y %H:%M"
+DEFAULT_HOUR = 9  # a day without an hour ("מחר") is saved for the morning
+
+_DASH = "[-־‑–]"
+
+WEEKDAYS = {"ראשון": 6, "שני": 0, "שלישי": 1, "רביעי": 2, "חמישי": 3, "שישי": 4, "שבת": 5}
+WEEKDAY_LETTERS = {"א": 6, "ב": 0, "ג": 1, "ד": 2, "ה": 3, "ו": 4}
+NUMBER_WORDS = {"אחד": 1, "אחת": 1, "שני": 2, "שתי": 2, "שניים": 2, "שתיים": 2, "שלוש": 3, "שלושה": 3,
+                "ארבע": 4, "ארבעה": 4, "חמש": 5, "חמישה": 5, "שש": 6, "שישה": 6, "שבע": 7, "שבעה": 7,
+                "שמונה": 8, "תשע": 9, "תשעה": 9, "עשר": 10, "עשרה": 10}
+
+MONTHS = {"ינואר": 1, "פברואר": 2, "מרץ": 3, "מרס": 3, "אפריל": 4, "מאי": 5, "יוני": 6, "יולי": 7, "אוגוסט": 8,
+          "ספטמבר": 9, "אוקטובר": 10, "נובמבר": 11, "דצמבר": 12}
+
+# (name, hour used when no hour is given)
+PARTS_OF_DAY = {"בוקר": 9, "צהריים": 13, "צהרים": 13, "אחה\"צ": 16, "אחהצ": 16, "אחר הצהריים": 16,
+                "אחרי הצהריים": 16, "ערב": 20, "לילה": 22}
+
+_WORD_END = r"(?!\w)"
+_WORD_START = r"(?<![\wא-ת])ו?"  # "וביום ראשון" still counts as a second day
+_NUMBER = r"(\d+|" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True)) + ")"
+
+_DAY_RULES = [
+    (re.compile(_WORD_START + r"(?:ל|ב)?מחרתיים" + _WORD_END), "day_after_tomorrow"),
+    (re.compile(_WORD_START + r"(?:ל|ב)?מחר" + _WORD_END), "tomorrow"),
+    (re.compile(_WORD_START + r"(?:ב|ל)?היום" + _WORD_END), "today"),
+    (re.compile(_WORD_START + r"בעוד (יומיים|שבועיים|יום|שבוע|חודש|" + _NUMBER + r" (?:ימים|שבועות))" + _WORD_END),
+     "in_days"),
+    (re.compile(_WORD_START + r"(?:ב|ל)?יום (ראשון|שני|שלישי|רביעי|חמישי|שישי|שבת)(?: (?:הבא|הקרוב))?" + _WORD_END),
+     "weekday"),
+    (re.compile(_WORD_START + r"(?:ב|ל)?יום ([אבגדהו])['׳]" + r"(?: (?:הבא|הקרוב))?"), "weekday_letter"),
+    (re.compile(_WORD_START + r"(?:ב|ל)?שבת(?: (?:הבאה|הקרובה))?" + _WORD_END), "saturday"),
+    (re.compile(r"(?<![\d/.])(?:ו?(?:ב|ל)" + _DASH + r"?)?(\d{1,2})[/.](\d{1,2})(?:[/.](\d{4}|\d{2}))?(?![\d/.])"),
+     "date"),
+    # "ב-1 לחודש", "ב-10 לחודש הבא", "ב-5 במאי": a day of the month, not an hour
+    (re.compile(r"(?<![\d/.])(?:ו?(?:ב|ל)" + _DASH + r"?)?(\d{1,2}) (?:ל|ב)?(חודש(?: הבא)?|"
+                + "|".join(MONTHS) + ")" + _WORD_END), "day_of_month"),
+]
+_PARTS_OF_DAY = "|".join(re.escape(p) for p in sorted(PARTS_OF_DAY, key=len, reverse=True))
+# A bare "ב-5" is only an hour at the end of the text or before a part of day or a day ("ב-5 בערב",
+# "ב-9 מחר"); before anything else it may be a price or an amount ("ב-5 שקלים"), which is left for GPT
+_BARE_HOUR_END = (r"(?=\s*[.!?]*\s*$|\s+(?:ב|לפנות |אחרי )?(?:" + _PARTS_OF_DAY + ")" + _WORD_END
+                  + r"|\s+ו?(?:ב|ל)?(?:מחרתיים|מחר|היום|שבת|עוד|יום (?:" + "|".join(WEEKDAYS) + r"|[אבגדהו]['׳]))"
+                  + _WORD_END
+                  + r"|\s+(?:ו?(?:ב|ל)" + _DASH + r"?)?\d{1,2}[/.]\d)")
+
+_RELATIVE_RULE = re.compile(
+    _WORD_START + r"בעוד (חצי שעה|רבע שעה|שעה|שעתיים|" + _NUMBER + r" (?:שעות|דקות))" + _WORD_END
+)
+_HOUR_RULES = [
+    re.compile(_WORD_START + r"בשעה " + _DASH + r"?\s?(\d{1,2})(?::(\d{2}))?(?![\d/.:])"),
+    re.compile(_WORD_START + r"(?:ב|עד )" + _DASH + r"?\s?(\d{1,2})(?::(\d{2})(?![\d/.:])|(?![\d/.:])"
+               + _BARE_HOUR_END + ")"),
+    re.compile(r"(?<![\d/.:])(\d{1,2}):(\d{2})(?![\d/.:])"),
+]
+# A "ב-5" none of the rules took (a price, an amount, or an hour followed by the task) is left for GPT
+_UNRESOLVED_NUMBER = re.compile(_WORD_START + r"(?:ב|עד )" + _DASH + r"?\s?\d{1,2}(?![\d/.:])")
+_PART_OF_DAY_RULE = re.compile(_WORD_START + r"(?:ב|לפנות |אחרי )?(" + _PARTS_OF_DAY + ")" + _WORD_END)
+
+_SAVE_PREFIX = re.compile(
+    r"^(?:שמור|תשמור|שמרי|הוסף|תוסיף|תוסיפי|רשום|תרשום|תרשמי|תזכיר|תזכירי)(?!\w)(?: לי)?\s*:?\s*"
+)
+_FILLER_WORDS = {"ב", "ל", "עד", "את", "ש", "בשעה", "ה", "לי"}
+_MULTI_TASK = re.compile(r"[,\n;]| וגם | ואז | ואחר כך ")
+
+
+class ParsedTime:
+    __slots__ = ("when", "spans")
+
+    def __init__(self, when: datetime, spans: list[tuple[int, int]]):
+        self.when = when
+        self.spans = spans  # (start, end) of every matched expression in the text
+
+    def format(self) -> str:
+        return self.when.strftime(TIME_FORMAT)
+
+
+def _number(token: str) -> int:
+    return int(token) if token.isdigit() else NUMBER_WORDS[token]
+
+
+def _next_weekday(today: date, weekday: int) -> date:
+    """The next given weekday after today ("יום ראשון" said on a Sunday means next week)."""
+    days = (weekday - today.weekday()) % 7
+    return today + timedelta(days=days or 7)
+
+
+def _find_all(rule: re.Pattern, text: str, taken: list) -> list[re.Match]:
+    found = []
+    for match in rule.finditer(text):
+        if not any(start < match.end() and match.start() < end for start, end in taken):
+            found.append(match)
+    return found
+
+
+def _resolve_day(kind: str, match: re.Match, today: date) -> Optional[date]:
+    if kind == "today":
+        return today
+    if kind == "tomorrow":
+        return today + timedelta(days=1)
+    if kind == "day_after_tomorrow":
+        return today + timedelta(days=2)
+    if kind == "in_days":
+        amount = match.group(1)
+        fixed = {"יום": 1, "יומיים": 2, "שבוע": 7, "שבועיים": 14, "חודש": 30}
+        if amount in fixed:
+            return today + timedelta(days=fixed[amount])
+        days = _number(match.group(2))
+        return today + timedelta(days=days * 7 if "שבועות" in amount else days)
+    if kind == "weekday":
+        return _next_weekday(today, WEEKDAYS[match.group(1)])
+    if kind == "weekday_letter":
+        return _next_weekday(today, WEEKDAY_LETTERS[match.group(1)])
+    if kind == "saturday":
+        return _next_weekday(today, WEEKDAYS["שבת"])
+    if kind == "date":
+        day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        try:
+            if year:
+                return date(int(year) + (2000 if len(year) == 2 else 0), month, day)
+            resolved = date(today.year, month, day)
+            return resolved if resolved >= today else date(today.year + 1, month, day)
+        except ValueError:
+            return None
+    if kind == "day_of_month":
+        day, month = int(match.group(1)), match.group(2)
+        try:
+            if month in MONTHS:
+                resolved = date(today.year, MONTHS[month], day)
+                return resolved if resolved >= today else date(today.year + 1, MONTHS[month], day)
+            next_month = date(today.year + today.month // 12, today.month % 12 + 1, 1)
+            if month.endswith("הבא"):
+                return next_month.replace(day=day)
+            resolved = today.replace(day=day)
+            return resolved if resolved >= today else next_month.replace(day=day)
+        except ValueError:
+            return None
+    return None
+
+
+def _relative_delta(match: re.Match) -> timedelta:
+    amount = match.group(1)
+    fixed = {"חצי שעה": 30, "רבע שעה": 15, "שעה": 60, "שעתיים": 120}
+    if amount in fixed:
+        return timedelta(minutes=fixed[amount])
+    value = _number(match.group(2))
+    return timedelta(hours=value) if amount.endswith("שעות") else timedelta(minutes=value)
+
+
+def _adjust_hour(hour: int, part_of_day: Optional[str]) -> int:
+    """Turns a 12-hour clock hour into 24 hours using the part of day, or "ב-3" → 15:00 when there is none."""
+    if hour >= 12:
+        return hour
+    if part_of_day is None:
+        return hour + 12 if 1 <= hour <= 7 else hour
+    if part_of_day == "לילה":
+        return hour if hour < 5 else hour + 12
+    if PARTS_OF_DAY[part_of_day] >= 13:
+        return hour + 12
+    return hour
+
+
+def parse_hebrew_time(text: str, now: Optional[datetime] = None) -> Optional[ParsedTime]:
+    """
+    Finds one time expression in a Hebrew message and resolves it against `now`.
+
+    @param text: The user's message.
+    @param now: Reference time, defaults to the current time.
+    @return: The resolved time and the matched spans, or None when there is no expression or
+             more than one (e.g. two days), which is left for GPT.
+    """
+    now = now or datetime.now()
+    taken: list[tuple[int, int]] = []
+
+    relative = _find_all(_RELATIVE_RULE, text, taken)
+    taken += [m.span() for m in relative]
+    days = []
+    for rule, kind in _DAY_RULES:
+        for match in _find_all(rule, text, taken):
+            days.append((kind, match))
+            taken.append(match.span())
+    hours = []
+    for rule in _HOUR_RULES:
+        for match in _find_all(rule, text, taken):
+            hours.append(match)
+            taken.append(match.span())
+    parts = _find_all(_PART_OF_DAY_RULE, text, taken)
+    taken += [m.span() for m in parts]
+
+    if _find_all(_UNRESOLVED_NUMBER, text, taken):
+        return None
+    if len(relative) > 1 or len(days) > 1 or len(hours) > 1 or len(parts) > 1:
+        return None
+    if relative:
+        if days or hours or parts:
+            return None
+        return ParsedTime((now + _relative_delta(relative[0])).replace(second=0, microsecond=0), taken)
+    if not (days or hours or parts):
+        return None
+
+    part_of_day = parts[0].group(1) if parts else None
+    if hours:
+        hour, minute = int(hours[0].group(1)), int(hours[0].group(2) or 0)
+        if hour > 23 or minute > 59:
+            return None
+        hour = _adjust_hour(hour, part_of_day)
+    elif part_of_day:
+        hour, minute = PARTS_OF_DAY[part_of_day], 0
+    else:
+        hour, minute = DEFAULT_HOUR, 0
+
+    if days:
+        day = _resolve_day(days[0][0], days[0][1], now.date())
+        if day is None:
+            return None
+        return ParsedTime(datetime.combine(day, datetime.min.time()).replace(hour=hour, minute=minute), taken)
+
+    when = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if when < now:  # "ב-9" after nine o'clock means tomorrow
+        when += timedelta(days=1)
+    return ParsedTime(when, taken)
+
+
+def extract_task(question: str, now: Optional[datetime] = None) -> Optional[dict]:
+    """
+    Builds the {"description", "time"} task of a simple save request, e.g. "תזכיר לי לקנות חלב מחר ב־9".
+
+    Returns None when the message has no time expression, looks like several tasks, or nothing is left
+    for the description – those are sent to GPT.
+    """
+    text = question.strip()
+    if _MULTI_TASK.search(text):
+        return None
+    text = _SAVE_PREFIX.sub("", text, count=1)
+    parsed = parse_hebrew_time(text, now)
+    if parsed is None:
+        return None
+
+    kept, last = [], 0
+    for start, end in sorted(parsed.spans):
+        kept.append(text[last:start])
+        last = end
+    kept.append(text[last:])
+    words = " ".join(kept).split()
+    while words and words[0] in _FILLER_WORDS:
+        words.pop(0)
+    while words and words[-1] in _FILLER_WORDS:
+        words.pop()
+    description = " ".join(words).strip(" .:-־‑")
+    if not description:
+        return None
+    return {"description": description, "time": parsed.format()}
@@ -0,0 +1,229 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from config import settings
+from metrics import registry as metrics, webhook_duplicates
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_deliveries (
+    message_sid TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    response TEXT
+);
+CREATE INDEX IF NOT EXISTS webhook_deliveries_created ON webhook_deliveries(created_at);
+"""
+
+
+class IdempotencyStore:
+    """
+    Remembers the reply to each Twilio MessageSid for `ttl_seconds`, so a retried webhook
+    returns the first reply instead of running the message (GPT calls, task writes) again.
+
+    A delivery is claimed before processing. A retry that arrives while the first delivery is still
+    running waits up to wait_seconds for its reply; a delivery that fails is released so that
+    Twilio's next retry is processed normally.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, wait_seconds: float = 10, poll_seconds: float = 0.05,
+                 clock: Callable[[], float] = time.time):
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        self._clock = clock
+        self.duplicates = 0
+
+    def claim(self, key: str) -> tuple[bool, Optional[str]]:
+        """
+        @return: (True, None) when this delivery must be processed, otherwise (False, reply),
+                 where reply is None while the first delivery is still running.
+        """
+        raise NotImplementedError
+
+    def lookup(self, key: str) -> Optional[str]:
+        """The stored reply, None when unknown or still running."""
+        raise NotImplementedError
+
+    def complete(self, key: str, response: str):
+        raise NotImplementedError
+
+    def release(self, key: str):
+        raise NotImplementedError
+
+    def run_once(self, key: Optional[str], process: Callable[[], str]) -> Optional[str]:
+        """
+        Runs process() for the first delivery of `key` and returns its reply; repeats get the same reply.
+        None means the first delivery is still running after wait_seconds. A missing key always processes.
+        """
+        if not key:
+            return process()
+        is_new, response = self.claim(key)
+        if is_new:
+            return self._process(key, process)
+        self._count_duplicate()
+        deadline = time.monotonic() + self.wait_seconds
+        while response is None and time.monotonic() < deadline:
+            time.sleep(self.poll_seconds)
+            response = self.lookup(key)
+        return response
+
+    async def run_once_async(self, key: Optional[str], process: Callable[[], Awaitable[str]]) -> Optional[str]:
+        """Async variant of run_once, claims are short index lookups and run on the loop."""
+        if not key:
+            return await process()
+        is_new, response = self.claim(key)
+        if is_new:
+            try:
+                response = await process()
+            except BaseException:
+                self.release(key)
+                raise
+            self.complete(key, response)
+            return response
+        self._count_duplicate()
+        deadline = time.monotonic() + self.wait_seconds
+        while response is None and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_seconds)
+            response = self.lookup(key)
+        return response
+
+    def _process(self, key: str, process: Callable[[], str]) -> str:
+        try:
+            response = process()
+        except BaseException:
+            self.release(key)
+            raise
+        self.complete(key, response)
+        return response
+
+    def _count_duplicate(self):
+        self.duplicates += 1
+        metrics.inc(webhook_duplicates)
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """Process-local store, keeps at most max_entries deliveries (oldest dropped first)."""
+
+    def __init__(self, max_entries: int = 100_000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, list] = OrderedDict()  # key -> [created_at, response]
+        self._lock = threading.Lock()
+
+    def claim(self, key: str) -> tuple[bool, Optional[str]]:
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return False, entry[1]
+            self._entries[key] = [now, None]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True, None
+
+    def _expire(self, now: float):
+        """Entries are in insertion order, so expired ones are at the front (lock held)."""
+        while self._entries:
+            created_at = next(iter(self._entries.values()))[0]
+            if now - created_at < self.ttl_seconds:
+                return
+            self._entries.popitem(last=False)
+
+    def lookup(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def complete(self, key: str, response: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] = response
+
+    def release(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """
+    Store in a SQLite (WAL) file, shared by all worker processes on the host.
+    Expired deliveries are pruned every prune_every claims.
+    """
+
+    def __init__(self, path: str, prune_every: int = 1000, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.prune_every = prune_every
+        self._claims = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key: str) -> tuple[bool, Optional[str]]:
+        now = self._clock()
+        with self._connect() as conn:
+            self._claims += 1
+            if self._claims % self.prune_every == 0:
+                conn.execute("DELETE FROM webhook_deliveries WHERE created_at <= ?", (now - self.ttl_seconds,))
+            # Takes over an expired row, otherwise inserts; only one worker's statement changes a row
+            claimed = conn.execute(
+                "INSERT INTO webhook_deliveries (message_sid, created_at, response) VALUES (?, ?, NULL) "
+                "ON CONFLICT(message_sid) DO UPDATE SET created_at = excluded.created_at, response = NULL "
+                "WHERE webhook_deliveries.created_at <= ?",
+                (key, now, now - self.ttl_seconds),
+            ).rowcount
+            if claimed:
+                return True, None
+        return False, self.lookup(key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        row = self._connect().execute("SELECT response FROM webhook_deliveries WHERE message_sid = ?",
+                                      (key,)).fetchone()
+        return row[0] if row else None
+
+    def complete(self, key: str, response: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE webhook_deliveries SET response = ? WHERE message_sid = ?", (response, key))
+
+    def release(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM webhook_deliveries WHERE message_sid = ? AND response IS NULL", (key,))
+
+
+_idempotency_store: Optional[IdempotencyStore] = None
+_idempotency_store_lock = threading.Lock()
+
+
+def get_idempotency_store() -> Optional[IdempotencyStore]:
+    """Returns the process-wide store for settings.idempotency_backend, None when it is disabled."""
+    global _idempotency_store
+    backend = settings.idempotency_backend
+    if backend is None:
+        return None
+    with _idempotency_store_lock:
+        if _idempotency_store is None:
+            options = {"ttl_seconds": settings.idempotency_ttl_seconds}
+            if backend == "sqlite":
+                _idempotency_store = SQLiteIdempotencyStore(str(settings.data_dir / settings.idempotency_file),
+                                                            **options)
+            elif backend == "memory":
+                _idempotency_store = MemoryIdempotencyStore(max_entries=settings.idempotency_max_entries, **options)
+            else:
+                raise ValueError(f"unknown idempotency_backend {backend!r}")
+        return _idempotency_store
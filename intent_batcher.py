@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+import gpt_client
+from config import settings
+from gpt_resilience import UNAVAILABLE_REPLY
+from intent_classifier import KNOWN_INTENTS
+from prompts import PARSE_QUESTION_BATCH_WITH_GPT_PROMPT, PARSE_QUESTION_WITH_GPT_PROMPT
+
+
+class _PendingIntent:
+    __slots__ = ("question", "arrived", "result", "done", "future")
+
+    def __init__(self, question: str):
+        self.question = question
+        self.arrived = time.monotonic()
+        self.result: Optional[str] = None
+        self.done = False
+        self.future: Optional[asyncio.Future] = None
+
+
+def parse_batch_response(response: str, size: int) -> list[Optional[str]]:
+    """
+    Maps GPT's batched JSON back to the messages by "id".
+
+    Only intent labels are taken from the batch. Free text written for one user must never reach another,
+    so a message without a known intent is asked on its own and gets its reply from its own call.
+
+    @return: One entry per message – the intent, or None when that item has no known intent or is
+             missing or malformed and must be asked on its own.
+    """
+    results: list[Optional[str]] = [None] * size
+    try:
+        parsed = json.loads(gpt_client.clean_gpt_response(response.strip()))
+    except json.JSONDecodeError:
+        return results
+    if not isinstance(parsed, list):
+        return results
+    for entry in parsed:
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get("id")
+        if not isinstance(index, int) or not 0 <= index < size:
+            continue
+        intent = entry.get("intent")
+        if intent in KNOWN_INTENTS:
+            results[index] = intent
+    return results
+
+
+class IntentBatcher:
+    """
+    Micro-batches GPT intent classification across concurrent conversations.
+
+    Requests arriving within `window_seconds` of the first pending one are sent as a single
+    multi-item prompt, so the fixed system prompt is paid once per batch instead of once per
+    message. A message that arrives while nothing is queued or in flight does not wait for the window:
+    it is asked on its own right away, and the messages that arrive during that call form the next batch.
+    classify() returns None for a message the batch did not label (a message that is not a command, a
+    malformed or missing item) – the caller then asks GPT for it alone, so such a message costs two calls.
+    When GPT is unavailable (or the circuit breaker is open) every message of the batch gets the canned
+    reply at once, instead of each one trying GPT again.
+
+    The batch prompt only classifies. With combined_intent_parsing (the default) the intent and the
+    payload come from one call per message and the batcher is not used.
+    """
+
+    def __init__(self, window_seconds: float = 0.01, max_batch: int = 16):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._queue: list[_PendingIntent] = []
+        self._async_queue: list[_PendingIntent] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._in_flight = 0  # GPT calls of this batcher that have not returned yet
+        self.batches = 0
+        self.single = 0
+        self.batched_items = 0
+        self.fallbacks = 0
+        self.unavailable = 0
+
+    def classify(self, question: str) -> Optional[str]:
+        """
+        Blocking variant for the threaded webhook: the oldest waiting thread collects the batch,
+        sends it and hands the results to the other threads.
+        """
+        item = _PendingIntent(question)
+        with self._cond:
+            idle = not self._queue and not self._in_flight
+            self._queue.append(item)
+            self._cond.notify_all()
+            while not item.done:
+                if self._queue and self._queue[0] is item:
+                    batch = self._take_batch_locked(item, wait=not idle)
+                    break
+                self._cond.wait()
+            else:
+                return item.result
+
+        try:
+            results = self._ask_batch(batch)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+        with self._cond:
+            for pending, result in zip(batch, results):
+                pending.result, pending.done = result, True
+            self._cond.notify_all()
+        return item.result
+
+    def _take_batch_locked(self, leader: _PendingIntent, wait: bool = True) -> list[_PendingIntent]:
+        deadline = leader.arrived + self.window_seconds if wait else 0
+        while len(self._queue) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        batch = self._queue[:self.max_batch]
+        del self._queue[:self.max_batch]
+        self._in_flight += 1
+        self._cond.notify_all()  # the next waiting thread, if any, leads the next batch
+        return batch
+
+    async def classify_async(self, question: str) -> Optional[str]:
+        """Async variant for the aiohttp webhook, the batch is flushed by a timer on the event loop."""
+        loop = asyncio.get_running_loop()
+        item = _PendingIntent(question)
+        item.future = loop.create_future()
+        idle = not self._async_queue and not self._in_flight
+        self._async_queue.append(item)
+        if idle or len(self._async_queue) >= self.max_batch:
+            self._flush_async()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_seconds, self._flush_async)
+        return await item.future
+
+    def _flush_async(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._async_queue = self._async_queue, []
+        if batch:
+            with self._cond:
+                self._in_flight += 1
+            asyncio.ensure_future(self._send_async(batch))
+
+    async def _send_async(self, batch: list[_PendingIntent]):
+        results: list[Optional[str]] = [None] * len(batch)
+        try:
+            results = await self._ask_batch_async(batch)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+            for pending, result in zip(batch, results):
+                if not pending.future.done():
+                    pending.future.set_result(result)
+
+    def _ask_batch(self, batch: list[_PendingIntent]) -> list[Optional[str]]:
+        if len(batch) == 1:  # nothing to share, the usual single-message prompt
+            self._count_single()
+            return [gpt_client.ask_gpt(system_prompt=PARSE_QUESTION_WITH_GPT_PROMPT, user_input=batch[0].question,
+                                       call_site="intent")]
+        try:
+            response = gpt_client.ask_gpt(system_prompt=PARSE_QUESTION_BATCH_WITH_GPT_PROMPT,
+                                          user_input=self._batch_input(batch), cacheable=False,
+                                          call_site="intent_batch")
+        except Exception:
+            logging.exception("❌ סיווג כוונות מקובץ נכשל")
+            response = ""
+        return self._record(batch, response)
+
+    async def _ask_batch_async(self, batch: list[_PendingIntent]) -> list[Optional[str]]:
+        if len(batch) == 1:
+            self._count_single()
+            return [await gpt_client.ask_gpt_async(system_prompt=PARSE_QUESTION_WITH_GPT_PROMPT,
+                                                   user_input=batch[0].question, call_site="intent")]
+        try:
+            response = await gpt_client.ask_gpt_async(system_prompt=PARSE_QUESTION_BATCH_WITH_GPT_PROMPT,
+                                                      user_input=self._batch_input(batch), cacheable=False,
+                                                      call_site="intent_batch")
+        except Exception:
+            logging.exception("❌ סיווג כוונות מקובץ נכשל")
+            response = ""
+        return self._record(batch, response)
+
+    def _count_single(self):
+        with self._cond:
+            self.single += 1
+
+    @staticmethod
+    def _batch_input(batch: list[_PendingIntent]) -> str:
+        return json.dumps([{"id": index, "text": item.question} for index, item in enumerate(batch)],
+                          ensure_ascii=False)
+
+    def _record(self, batch: list[_PendingIntent], response: str) -> list[Optional[str]]:
+        if response == UNAVAILABLE_REPLY:
+            with self._cond:
+                self.batches += 1
+                self.unavailable += len(batch)
+            return [UNAVAILABLE_REPLY] * len(batch)
+        results = parse_batch_response(response, len(batch))
+        missing = results.count(None)
+        with self._cond:
+            self.batches += 1
+            self.batched_items += len(results) - missing
+            self.fallbacks += missing
+        if missing:
+            logging.warning(f"⚠️ {missing} מתוך {len(results)} כוונות לא חזרו תקינות מהאצווה – נשאלות בנפרד")
+        return results
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"batches": self.batches, "batched_items": self.batched_items, "fallbacks": self.fallbacks,
+                    "unavailable": self.unavailable, "single": self.single}
+
+
+_intent_batcher: Optional[IntentBatcher] = None
+_intent_batcher_lock = threading.Lock()
+
+
+def get_intent_batcher() -> Optional[IntentBatcher]:
+    """Returns the process-wide batcher, or None when settings.intent_batch_window_ms is 0."""
+    global _intent_batcher
+    if settings.intent_batch_window_ms <= 0:
+        return None
+    with _intent_batcher_lock:
+        if _intent_batcher is None:
+            _intent_batcher = IntentBatcher(window_seconds=settings.intent_batch_window_ms / 1000,
+                                            max_batch=settings.intent_batch_max_size)
+        return _intent_batcher
@@ -0,0 +1,170 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Iterable, Optional
+
+# Intents understood by PersonalAssistant.dispatch_command
+INTENT_SAVE = "שמור"
+INTENT_DELETE_TASK = "מחק משימה"
+INTENT_SHOW_TASKS = "הצג משימות"
+INTENT_DELETE_ALL = "מחק כל המשימות"
+INTENT_RESET = "איפוס"
+
+KNOWN_INTENTS = (INTENT_SAVE, INTENT_DELETE_TASK, INTENT_SHOW_TASKS, INTENT_DELETE_ALL, INTENT_RESET)
+
+# (pattern, intent, confidence) – checked in order, the first match wins.
+# "מחק הכל" must be tested before the generic "מחק <משהו>" rule.
+INTENT_RULES = [
+    (r"^(הצג|תציג|הראה|תראה|הראי|תראי)( לי)?( את)?( כל)? ה?משימות( שלי)?$", INTENT_SHOW_TASKS, 1.0),
+    (r"^(מה )?(ה)?משימות( שלי)?$", INTENT_SHOW_TASKS, 0.95),
+    (r"^((הצג|תציג|הראה|תראה|הראי|תראי)( לי)?( את)?( כל)? )?ה?משימות( שלי)? (של |ל|ב|מ|מה|עד )?-?"
+     r"(היום|מחר|השבוע|\d{1,2}[/.]\d{1,2}\S*)( עד -?\d{1,2}[/.]\d{1,2}\S*)?$", INTENT_SHOW_TASKS, 0.95),
+    (r"^(מחק|תמחק|מחקי|נקה|תנקה)( את)? (כל ה?משימות( שלי)?|הכל|הכול)$", INTENT_DELETE_ALL, 1.0),
+    (r"^(איפוס|אפס|תאפס)( את)?( הכל| הכול)?$", INTENT_RESET, 1.0),
+    (r"^(מחק|תמחק|מחקי|הסר|תסיר)( את)?( משימה)?( מספר)? #?\d+$", INTENT_DELETE_TASK, 0.98),
+    (r"^(מחק|תמחק|מחקי|הסר|תסיר) (?!(כל|הכל|הכול|היסטוריה)\b)\S.*$", INTENT_DELETE_TASK, 0.85),
+    (r"^(שמור|תשמור|שמרי|הוסף|תוסיף|תזכיר לי|תזכירי לי|תרשום|רשום)( |:).+$", INTENT_SAVE, 0.9),
+]
+
+_COMPILED_RULES = [(re.compile(pattern), intent, confidence) for pattern, intent, confidence in INTENT_RULES]
+_TOKEN_RE = re.compile(r"[\w#]+")
+
+
+def normalize_text(text: str) -> str:
+    """Lower-cases, trims punctuation at the edges and collapses whitespace."""
+    text = text.strip().lower()
+    text = re.sub(r"[\"'״׳?!.,]+$", "", text)
+    text = text.replace("־", " ").replace("‑", " ")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(normalize_text(text))
+
+
+class IntentModel:
+    """
+    Small multinomial naive-Bayes model over word tokens.
+
+    Stored on disk as JSON so it can be trained offline on logged messages and shipped
+    next to the data files without any extra dependency.
+    """
+
+    def __init__(self, token_counts: dict[str, dict[str, int]], intent_counts: dict[str, int]):
+        self._token_counts = token_counts
+        self._intent_counts = intent_counts
+        self._totals = {intent: sum(counts.values()) for intent, counts in token_counts.items()}
+        self._vocab_size = len({tok for counts in token_counts.values() for tok in counts}) or 1
+        self._docs = sum(intent_counts.values()) or 1
+
+    @classmethod
+    def train(cls, examples: Iterable[tuple[str, str]]) -> "IntentModel":
+        """
+        Builds a model from (text, intent) pairs.
+
+        @param examples: Iterable of (user message, intent) pairs.
+        """
+        token_counts: dict[str, Counter] = {}
+        intent_counts: Counter = Counter()
+        for text, intent in examples:
+            intent_counts[intent] += 1
+            token_counts.setdefault(intent, Counter()).update(tokenize(text))
+        return cls({intent: dict(counts) for intent, counts in token_counts.items()}, dict(intent_counts))
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IntentModel"]:
+        """Loads a model file, returns None if it does not exist."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["token_counts"], data["intent_counts"])
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"token_counts": self._token_counts, "intent_counts": self._intent_counts},
+                      f, ensure_ascii=False, indent=2)
+
+    def predict(self, text: str) -> tuple[Optional[str], float]:
+        """Returns the most probable intent and its posterior probability."""
+        tokens = tokenize(text)
+        if not tokens or not self._intent_counts:
+            return None, 0.0
+        log_scores = {}
+        for intent, doc_count in self._intent_counts.items():
+            counts = self._token_counts.get(intent, {})
+            total = self._totals.get(intent, 0)
+            score = math.log(doc_count / self._docs)
+            for token in tokens:
+                score += math.log((counts.get(token, 0) + 1) / (total + self._vocab_size))
+            log_scores[intent] = score
+        best = max(log_scores, key=log_scores.get)
+        peak = log_scores[best]
+        norm = sum(math.exp(score - peak) for score in log_scores.values())
+        return best, 1.0 / norm
+
+
+class IntentClassifier:
+    """
+    Local intent fast path that runs before the GPT intent call.
+
+    Keyword/regex rules are tried first, then the optional on-disk model. The caller falls back
+    to GPT when the confidence is below the threshold. Hit/miss counters are kept per process so
+    the number of saved LLM calls can be reported.
+    """
+
+    def __init__(self, model: Optional[IntentModel] = None, threshold: float = 0.85):
+        self._model = model
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self._misses = 0
+
+    @classmethod
+    def from_file(cls, model_path: str, threshold: float = 0.85) -> "IntentClassifier":
+        return cls(model=IntentModel.load(model_path), threshold=threshold)
+
+    def classify(self, text: str) -> tuple[Optional[str], float]:
+        """Returns (intent, confidence) without touching the counters."""
+        normalized = normalize_text(text)
+        for pattern, intent, confidence in _COMPILED_RULES:
+            if pattern.match(normalized):
+                return intent, confidence
+        if self._model is not None:
+            intent, confidence = self._model.predict(normalized)
+            if intent in KNOWN_INTENTS:
+                return intent, confidence
+        return None, 0.0
+
+    def resolve(self, text: str) -> Optional[str]:
+        """
+        Returns the intent when it is confident enough, otherwise None.
+        A None result counts as a miss – the caller is expected to ask GPT.
+        """
+        intent, confidence = self.classify(text)
+        with self._lock:
+            if intent is not None and confidence >= self.threshold:
+                self._hits[intent] += 1
+                return intent
+            self._misses += 1
+        return None
+
+    def stats(self) -> dict:
+        """Snapshot of the hit/miss counters."""
+        with self._lock:
+            hits = sum(self._hits.values())
+            total = hits + self._misses
+            return {
+                "local_hits": hits,
+                "gpt_fallbacks": self._misses,
+                "hits_by_intent": dict(self._hits),
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._hits.clear()
+            self._misses = 0
@@ -0,0 +1,72 @@
+import json
+from typing import Iterable, Iterator
+
+
+class JsonArrayStream:
+    """
+    Incremental parser for a JSON array of objects that arrives in chunks, e.g. a streamed GPT reply.
+
+    feed() returns every top-level object as soon as its closing brace arrives, without waiting for the
+    rest of the array. Text before the array (a ```json fence) is skipped, and a reply that is a single
+    object instead of an array yields that object.
+    """
+
+    def __init__(self):
+        self._buffer: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._single = False
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        """Consumes a chunk and returns the objects completed by it, raises JSONDecodeError on a broken object."""
+        items = []
+        for char in chunk:
+            if self.done:
+                break
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                elif char == "{":
+                    self._started = self._single = True
+                    self._depth = 1
+                    self._buffer = [char]
+                continue
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._buffer = [char]
+                elif char == "]":
+                    self.done = True
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(json.loads("".join(self._buffer)))
+                    self._buffer = []
+                    self.done = self._single
+        return items
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator:
+    """Yields the objects of a streamed JSON array one by one; stops reading once the array is closed."""
+    parser = JsonArrayStream()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+        if parser.done:
+            break
@@ -0,0 +1,53 @@
+import logging
+import threading
+from typing import Optional
+
+
+class MessageSender:
+    """Interface for outbound WhatsApp messages (replies sent outside the webhook response)."""
+
+    def send(self, to: str, body: str):
+        raise NotImplementedError
+
+
+class TwilioMessageSender(MessageSender):
+    """Sends messages through the Twilio Messages REST API."""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str, client=None):
+        """
+        @param from_number: The Twilio WhatsApp sender, e.g. "whatsapp:+14155238886".
+        @param client: Optional pre-built twilio.rest.Client.
+        """
+        if client is None:
+            from twilio.rest import Client
+            client = Client(account_sid, auth_token)
+        self._client = client
+        self._from = from_number
+
+    def send(self, to: str, body: str):
+        message = self._client.messages.create(from_=self._from, to=to, body=body)
+        logging.debug(f"📤 נשלחה הודעה {message.sid} אל {to}")
+
+
+class FakeMessageSender(MessageSender):
+    """In-memory sender for tests and local runs – records every message instead of calling Twilio."""
+
+    def __init__(self):
+        self.sent: list[tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def send(self, to: str, body: str):
+        with self._lock:
+            self.sent.append((to, body))
+
+    def messages_to(self, to: str) -> list[str]:
+        with self._lock:
+            return [body for recipient, body in self.sent if recipient == to]
+
+
+def build_message_sender(settings) -> Optional[MessageSender]:
+    """Creates the Twilio sender from settings, or None when credentials are missing."""
+    if not (settings.twilio_account_sid and settings.twilio_auth_token and settings.twilio_whatsapp_from):
+        return None
+    return TwilioMessageSender(settings.twilio_account_sid, settings.twilio_auth_token,
+                               settings.twilio_whatsapp_from)
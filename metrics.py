@@ -0,0 +1,229 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, Optional
+
+from config import settings
+
+# Seconds; GPT calls dominate, storage and local stages sit in the lowest buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_NOOP = nullcontext()
+
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labels))
+        return series[-1] if series else 0
+
+    def snapshot(self) -> dict[tuple, tuple[int, float]]:
+        """(count, sum) per label values, for reports that diff two points in time."""
+        with self._lock:
+            return {key: (series[-1], series[-2]) for key, series in self._series.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                le = _label_text(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _label_text(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms rendered in the Prometheus text format.
+
+    When `enabled` is False (settings.metrics_enabled) timers are a shared no-op context and
+    nothing is recorded, so the instrumentation costs one attribute check per stage.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: list = []
+        self._collectors: list[Callable[[], list[str]]] = []
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], list[str]]):
+        """Registers a function returning exposition lines computed at scrape time (e.g. from stats())."""
+        self._collectors.append(collector)
+
+    def timer(self, histogram: Histogram, **labels):
+        """Context manager observing the elapsed time of its block."""
+        if not self.enabled:
+            return _NOOP
+        return self._timed(histogram, labels)
+
+    @contextmanager
+    def _timed(self, histogram: Histogram, labels: dict):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - started, **labels)
+
+    def inc(self, counter: Counter, amount: float = 1, **labels):
+        if self.enabled:
+            counter.inc(amount, **labels)
+
+    def observe(self, histogram: Histogram, seconds: float, **labels):
+        if self.enabled:
+            histogram.observe(seconds, **labels)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry(enabled=settings.metrics_enabled)
+
+stage_seconds = registry.histogram("assistant_stage_seconds", "Time spent per processing stage", ("stage",))
+gpt_request_seconds = registry.histogram("assistant_gpt_request_seconds",
+                                         "GPT call latency per call site, retries included", ("call_site",))
+gpt_requests = registry.counter("assistant_gpt_requests_total", "GPT calls per call site and outcome",
+                                ("call_site", "outcome"))
+webhook_requests = registry.counter("assistant_webhook_requests_total", "Webhook requests handled", ("server",))
+webhook_duplicates = registry.counter("assistant_webhook_duplicates_total",
+                                      "Webhook retries answered from the MessageSid store")
+
+
+def stage_timer(stage: str):
+    """Times a stage: "webhook", "intent", "storage_load" or "storage_save"."""
+    return registry.timer(stage_seconds, stage=stage)
+
+
+def _gpt_usage_lines() -> list[str]:
+    import gpt_client  # at scrape time only, metrics is imported by gpt_client itself
+
+    name = "assistant_gpt_tokens_total"
+    lines = [f"# HELP {name} GPT tokens per call site and kind", f"# TYPE {name} counter"]
+    for call_site, values in sorted(gpt_client.usage.stats().items()):
+        for kind in ("prompt", "completion", "cached"):
+            lines.append(f"{name}{_label_text(('call_site', 'kind'), (call_site, kind))} {values[kind + '_tokens']}")
+    return lines
+
+
+def stats_lines(prefix: str, stats: Optional[dict]) -> list[str]:
+    """
+    Renders a component's stats() dict as gauges named assistant_<prefix>_<key>.
+    A dict value becomes one labeled sample per key, a string value a sample labeled with it, None is skipped.
+    """
+    lines = []
+    for key, value in sorted((stats or {}).items()):
+        name = f"assistant_{prefix}_{key}"
+        if isinstance(value, dict):
+            samples = [(_label_text(("key",), (label,)), number) for label, number in sorted(value.items())]
+        elif isinstance(value, str):
+            samples = [(_label_text(("value",), (value,)), 1)]
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            samples = [("", value)]
+        else:
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        lines += [f"{name}{labels} {number}" for labels, number in samples]
+    return lines
+
+
+def add_stats_collector(prefix: str, stats: Callable[[], Optional[dict]]):
+    """Exposes stats() of a component (sessions, caches, the breaker) on /metrics, read at scrape time."""
+    registry.add_collector(lambda: stats_lines(prefix, stats()))
+
+
+def _gpt_client_stats_lines() -> list[str]:
+    import gpt_client
+    from assistant import intent_classifier
+    from intent_batcher import get_intent_batcher
+
+    batcher = get_intent_batcher()
+    cache = gpt_client.response_cache
+    return (stats_lines("intent_classifier", intent_classifier.stats())
+            + stats_lines("gpt_cache", cache.stats() if cache is not None else None)
+            + stats_lines("gpt_resilience", gpt_client.resilience.stats())
+            + stats_lines("intent_batcher", batcher.stats() if batcher is not None else None))
+
+
+registry.add_collector(_gpt_usage_lines)
+registry.add_collector(_gpt_client_stats_lines)
+
+
+def render_metrics() -> Optional[str]:
+    """The exposition text for /metrics, None when metrics are disabled."""
+    return registry.render() if registry.enabled else None
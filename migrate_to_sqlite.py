@@ -0,0 +1,105 @@
+"""
+Imports the per-user JSON files from the data directory into the SQLite storage backend.
+
+Run with:
+    python migrate_to_sqlite.py [--data-dir data] [--db data/assistant.sqlite3]
+
+A user's tasks and messages are replaced on every run, so running it again is safe.
+The deletion logs are only imported for users that have none in the database yet.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+
+from storage_backends import SQLiteUserStorage, get_database
+
+TODO_PATTERN = re.compile(r"^todo_list_(?P<name>.+)\.json$")
+CHAT_PATTERN = re.compile(r"^chat_log_(?P<name>.+)\.jsonl?$")
+DELETED_TASKS_PATTERN = re.compile(r"^deleted_tasks_(?P<name>.+)\.jsonl$")
+DELETED_MESSAGES_PATTERN = re.compile(r"^deleted_messages_(?P<name>.+)\.jsonl$")
+
+
+def read_records(path: str) -> list:
+    """Reads a JSON array/object or a JSONL file into a list of records."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if not text.strip():
+        return []
+    try:
+        data = json.loads(text)
+        return data if isinstance(data, list) else [data]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def collect_users(data_dir: str) -> dict[str, dict[str, str]]:
+    """Maps each user name to its files by kind: todo, chat, deleted_tasks, deleted_messages."""
+    users: dict[str, dict[str, str]] = {}
+    patterns = {
+        "todo": TODO_PATTERN,
+        "chat": CHAT_PATTERN,
+        "deleted_tasks": DELETED_TASKS_PATTERN,
+        "deleted_messages": DELETED_MESSAGES_PATTERN,
+    }
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.json*"))):
+        filename = os.path.basename(path)
+        for kind, pattern in patterns.items():
+            match = pattern.match(filename)
+            if match:
+                users.setdefault(match.group("name"), {})[kind] = path
+                break
+    return users
+
+
+def migrate(data_dir: str, db_path: str) -> dict:
+    """Imports every user found in data_dir and returns counters of what was written."""
+    db = get_database(db_path)
+    counts = {"users": 0, "tasks": 0, "messages": 0, "deleted_tasks": 0, "deleted_messages": 0}
+    for name, files in collect_users(data_dir).items():
+        storage = SQLiteUserStorage(db, name)
+        counts["users"] += 1
+        if "todo" in files:
+            tasks = read_records(files["todo"])
+            storage.save_tasks(tasks)
+            counts["tasks"] += len(tasks)
+        if "chat" in files:
+            messages = [m for m in read_records(files["chat"]) if isinstance(m, dict) and "role" in m]
+            storage.replace_messages(messages)
+            counts["messages"] += len(messages)
+
+        conn = db.connect()
+        for kind, table in (("deleted_tasks", "deleted_tasks"), ("deleted_messages", "deleted_messages")):
+            if kind not in files:
+                continue
+            (existing,) = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE user = ?", (name,)).fetchone()
+            if existing:
+                continue
+            records = read_records(files[kind])
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO {table} (user, deleted_at, data) VALUES (?, ?, ?)",
+                    [(name, record.get("deleted_at", "") if isinstance(record, dict) else "",
+                      json.dumps(record, ensure_ascii=False)) for record in records],
+                )
+            counts[kind] += len(records)
+    return counts
+
+
+def main():
+    from config import settings
+
+    parser = argparse.ArgumentParser(description="Import data/*.json and *.jsonl files into SQLite")
+    parser.add_argument("--data-dir", default=str(settings.data_dir))
+    parser.add_argument("--db", default=str(settings.data_dir / settings.sqlite_file))
+    args = parser.parse_args()
+
+    counts = migrate(args.data_dir, args.db)
+    print(f"✅ הועברו {counts['users']} משתמשים: {counts['tasks']} משימות, {counts['messages']} הודעות, "
+          f"{counts['deleted_tasks']} משימות שנמחקו, {counts['deleted_messages']} רשומות היסטוריה שנמחקה")
+    print("הגדר STORAGE_BACKEND=sqlite כדי לעבור לשימוש במסד הנתונים.")
+
+
+if __name__ == "__main__":
+    main()
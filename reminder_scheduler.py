@@ -0,0 +1,420 @@
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from config import settings
+from message_sender import MessageSender
+from task_store import parse_task_time
+
+REMINDER_MESSAGE = "⏰ תזכורת: {description} ({time})"
+LEADER_KEY = "assistant:reminders:leader"
+CHANGES_KEY = "assistant:reminders:changes"
+
+
+def whatsapp_address(user: str) -> str:
+    """The Twilio address of a session name (the webhook keys sessions by From without the "whatsapp" prefix)."""
+    if user.startswith("whatsapp:"):
+        return user
+    if user.startswith(":"):
+        return "whatsapp" + user
+    return "whatsapp:" + user
+
+
+def _task_key(task: dict) -> tuple:
+    return str(task.get("description") or ""), str(task.get("time") or "")
+
+
+class LeaderLease:
+    """
+    Makes one worker process the reminder sender: the leader holds a lease in the shared state store
+    (see RedisStateStore.try_lease) and renews it; when it stops renewing, another process takes over
+    once the lease expires. The other workers publish their reminder changes to a queue in the same
+    store, which the leader applies.
+    """
+
+    def __init__(self, store, key: str = LEADER_KEY, seconds: float = 30, changes_key: str = CHANGES_KEY):
+        self._store = store
+        self._key = key
+        self._changes_key = changes_key
+        self.seconds = seconds
+        self._token = uuid.uuid4().hex
+        self._held = False
+
+    def acquire_or_renew(self) -> bool:
+        """True while this process is the leader."""
+        try:
+            if self._held and self._store.renew_lease(self._key, self._token, self.seconds):
+                return True
+            self._held = self._store.try_lease(self._key, self._token, self.seconds)
+        except Exception:
+            logging.exception("❌ חידוש הובלת התזכורות נכשל")
+            self._held = False
+        return self._held
+
+    def release(self):
+        if self._held:
+            self._held = False
+            self._store.release_lease(self._key, self._token)
+
+    def publish(self, change: dict):
+        """Hands a schedule/cancel of this worker to the leader."""
+        try:
+            self._store.push(self._changes_key, json.dumps(change, ensure_ascii=False))
+        except Exception:
+            logging.exception("❌ העברת שינוי תזכורת לתהליך המוביל נכשלה")
+
+    def changes(self, limit: int = 1000) -> list[dict]:
+        """Takes the next published changes, oldest first."""
+        try:
+            return [json.loads(change) for change in self._store.pop_many(self._changes_key, limit)]
+        except Exception:
+            logging.exception("❌ קריאת שינויי התזכורות נכשלה")
+            return []
+
+
+class ReminderScheduler:
+    """
+    Sends a WhatsApp reminder when a task comes due, for all users of the process.
+
+    Upcoming reminders sit in one min-heap of (fire_at, seq, user, key), so scheduling is O(log n) and
+    the worker thread sleeps until the earliest one instead of polling users. Cancelling only drops the
+    entry from the per-user index; the heap entry is skipped when it comes up (and the heap is rebuilt
+    once most of it is stale). Tasks with the same description and time of one user share one reminder.
+
+    The stored tasks are loaded once, when the worker thread starts; after that the schedule follows the
+    schedule/cancel calls of saves and deletes. With several worker processes, only the holder of the
+    leader lease keeps a schedule and sends: the other workers forward their calls to it through the
+    lease's change queue, and it checks that a task is still stored before sending its reminder.
+    """
+
+    def __init__(self, sender: MessageSender, lead: timedelta = timedelta(0),
+                 clock: Callable[[], datetime] = datetime.now, max_sleep_seconds: float = 60,
+                 source: Optional[Callable[[], Iterable[list[tuple[str, dict]]]]] = None,
+                 still_stored: Optional[Callable[[str, tuple], bool]] = None,
+                 leader: Optional[LeaderLease] = None, resync_seconds: float = 0):
+        """
+        @param sender: Delivers the reminders, e.g. TwilioMessageSender or FakeMessageSender.
+        @param lead: How long before the due time the reminder is sent.
+        @param clock: Current local time, task times are naive local times.
+        @param max_sleep_seconds: Upper bound on one wait, so clock changes are picked up.
+        @param source: Batches of the stored tasks (see storage_backends.iter_stored_tasks), loaded by the
+                       worker thread when it starts or becomes the leader.
+        @param still_stored: still_stored(user, (description, time)) is checked before a reminder is sent.
+        @param leader: Lease that makes one process the sender, None when this is the only process.
+        @param resync_seconds: >0 also reloads `source` this often, for a scheduler that is not told about
+                               every save and delete (a dedicated reminder process).
+        """
+        self._sender = sender
+        self._lead = lead
+        self._clock = clock
+        self._max_sleep = max_sleep_seconds
+        self._source = source
+        self._still_stored = still_stored
+        self._leader = leader
+        self._resync_seconds = resync_seconds
+        self._leading = leader is None
+        self._heap: list[tuple] = []
+        self._pending: dict[str, dict[tuple, datetime]] = {}  # user -> task key -> fire_at
+        self._size = 0
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self.sent = 0
+
+    def schedule(self, user: str, task: dict, now: Optional[datetime] = None) -> bool:
+        """Adds the reminder of a task, False when it has no parseable time or is already past."""
+        due = parse_task_time(task.get("time"))
+        if due is None:
+            return False
+        fire_at = due - self._lead
+        if fire_at < (now or self._clock()):
+            return False
+        if self._forwarded("schedule", user, task):
+            return True
+        key = _task_key(task)
+        with self._condition:
+            user_pending = self._pending.setdefault(user, {})
+            if user_pending.get(key) == fire_at:
+                return True
+            if key not in user_pending:
+                self._size += 1
+            user_pending[key] = fire_at
+            wakes_worker = not self._heap or fire_at < self._heap[0][0]
+            heapq.heappush(self._heap, (fire_at, next(self._seq), user, key))
+            if wakes_worker:
+                self._condition.notify()
+        return True
+
+    def schedule_many(self, user: str, tasks: Iterable[dict]):
+        now = self._clock()
+        for task in tasks:
+            self.schedule(user, task, now)
+
+    def cancel(self, user: str, task: dict):
+        """Drops the reminder of a deleted task."""
+        if self._forwarded("cancel", user, task):
+            return
+        with self._condition:
+            user_pending = self._pending.get(user)
+            if user_pending and user_pending.pop(_task_key(task), None) is not None:
+                self._size -= 1
+                self._compact()
+
+    def cancel_user(self, user: str):
+        """Drops all reminders of a user, e.g. after clearing the task list."""
+        if self._forwarded("cancel_user", user):
+            return
+        with self._condition:
+            self._size -= len(self._pending.pop(user, {}))
+            self._compact()
+
+    def _forwarded(self, operation: str, user: str, task: Optional[dict] = None) -> bool:
+        """True when another process is the leader and the change was published to it instead."""
+        if self._leading:
+            return False
+        self._leader.publish({"operation": operation, "user": user, "task": task})
+        return True
+
+    def apply_changes(self, changes: Iterable[dict]) -> int:
+        """Applies the changes other workers published (see LeaderLease.changes)."""
+        applied = 0
+        for change in changes:
+            operation, user, task = change.get("operation"), change.get("user"), change.get("task")
+            if operation == "schedule" and isinstance(task, dict):
+                self.schedule(user, task)
+            elif operation == "cancel" and isinstance(task, dict):
+                self.cancel(user, task)
+            elif operation == "cancel_user":
+                self.cancel_user(user)
+            else:
+                logging.warning(f"⚠️ שינוי תזכורת לא מוכר: {change}")
+                continue
+            applied += 1
+        return applied
+
+    def load(self, batches: Iterable[list[tuple[str, dict]]]) -> int:
+        """
+        Schedules stored tasks batch by batch (see storage_backends.iter_stored_tasks).
+        Tasks due before now are skipped, so a restart never repeats old reminders.
+        """
+        before = len(self)
+        now = self._clock()
+        for batch in batches:
+            for user, task in batch:
+                self.schedule(user, task, now)
+        return len(self) - before
+
+    def resync(self) -> int:
+        """Replaces the schedule with the stored tasks."""
+        self._clear()
+        loaded = self.load(self._source()) if self._source is not None else 0
+        logging.info(f"⏰ נטענו {loaded} תזכורות")
+        return loaded
+
+    def _compact(self):
+        """Rebuilds the heap without cancelled entries once they are the majority (lock held)."""
+        if len(self._heap) > 64 and len(self._heap) > 2 * self._size:
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+
+    def _is_live(self, entry: tuple) -> bool:
+        fire_at, _, user, key = entry
+        return self._pending.get(user, {}).get(key) == fire_at
+
+    def _pop_due(self, now: datetime) -> list[tuple[str, tuple]]:
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if not self._is_live(entry):
+                    continue
+                _, _, user, key = entry
+                user_pending = self._pending[user]
+                del user_pending[key]
+                if not user_pending:
+                    del self._pending[user]
+                self._size -= 1
+                due.append((user, key))
+        return due
+
+    def run_due(self, now: Optional[datetime] = None) -> int:
+        """Sends every reminder due at `now`, returns how many were sent."""
+        sent = 0
+        for user, (description, time_text) in self._pop_due(now or self._clock()):
+            if self._still_stored is not None and not self._is_still_stored(user, (description, time_text)):
+                continue  # deleted through another worker process
+            try:
+                self._sender.send(whatsapp_address(user), REMINDER_MESSAGE.format(description=description,
+                                                                                  time=time_text))
+                sent += 1
+            except Exception:
+                logging.exception(f"❌ שליחת תזכורת אל {user} נכשלה")
+        self.sent += sent
+        return sent
+
+    def _clear(self):
+        with self._condition:
+            self._heap, self._pending, self._size = [], {}, 0
+
+    def _is_still_stored(self, user: str, key: tuple) -> bool:
+        try:
+            return self._still_stored(user, key)
+        except Exception:
+            logging.exception(f"❌ בדיקת המשימות של {user} נכשלה")
+            return True  # a missed reminder is worse than one for a task deleted a moment ago
+
+    def next_due(self) -> Optional[datetime]:
+        with self._condition:
+            while self._heap and not self._is_live(self._heap[0]):
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def start(self) -> "ReminderScheduler":
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._leader is not None:
+            self._leader.release()
+
+    def _run(self):
+        next_resync = 0.0
+        while True:
+            if self._leader is not None:
+                if not self._leader.acquire_or_renew():
+                    if self._leading:
+                        logging.warning("⏰ תהליך אחר שולח עכשיו את התזכורות")
+                        self._leading = False
+                        self._clear()
+                    with self._condition:
+                        if not self._stopped:
+                            self._condition.wait(self._leader.seconds / 3)
+                        if self._stopped:
+                            return
+                    continue
+                if not self._leading:
+                    self._leading, next_resync = True, 0.0  # a new leader starts from the stored tasks
+            if self._source is not None and next_resync is not None and time.monotonic() >= next_resync:
+                self.resync()
+                next_resync = time.monotonic() + self._resync_seconds if self._resync_seconds > 0 else None
+            if self._leader is not None:
+                self.apply_changes(self._leader.changes())
+
+            with self._condition:  # an RLock, next_due() re-enters it
+                if self._stopped:
+                    return
+                next_due = self.next_due()
+                wait = self._max_sleep
+                if self._leader is not None:
+                    wait = min(wait, self._leader.seconds / 3)
+                if next_resync is not None:
+                    wait = min(wait, max(0.0, next_resync - time.monotonic()))
+                if next_due is not None:
+                    wait = min(wait, max(0.0, (next_due - self._clock()).total_seconds()))
+                if wait > 0:
+                    self._condition.wait(wait)
+                if self._stopped:
+                    return
+            self.run_due()
+
+    def __len__(self) -> int:
+        return self._size
+
+
+_reminder_scheduler: Optional[ReminderScheduler] = None
+_reminder_scheduler_lock = threading.Lock()
+_reminders_configured = False
+
+
+def get_reminder_scheduler() -> Optional[ReminderScheduler]:
+    """Returns the running process-wide scheduler, or None when reminders are off or not started."""
+    return _reminder_scheduler
+
+
+def task_still_stored(user: str, key: tuple) -> bool:
+    """Whether the user's stored tasks still include a task with this (description, time)."""
+    from assistant import PersonalAssistant
+
+    return PersonalAssistant.open_storage(user).has_task(*key)
+
+
+def build_leader_lease() -> Optional[LeaderLease]:
+    """A lease in the shared Redis state store, None when this is the only process (no shared backend)."""
+    if settings.session_state_backend != "redis":
+        return None
+    from conversation_state import build_state_store
+
+    return LeaderLease(build_state_store(settings), seconds=settings.reminder_leader_lease_seconds)
+
+
+def start_reminder_scheduler(sender: MessageSender, leader: Optional[LeaderLease] = None,
+                             resync_seconds: float = 0) -> ReminderScheduler:
+    """
+    Starts the process-wide scheduler; its thread loads the stored tasks of all users once (again when
+    it becomes the leader), then follows the saves and deletes.
+    @param resync_seconds: >0 reloads the stored tasks this often, for a process that does not see the saves.
+    """
+    global _reminder_scheduler
+    from storage_backends import iter_stored_tasks
+
+    with _reminder_scheduler_lock:
+        if _reminder_scheduler is None:
+            scheduler = ReminderScheduler(
+                sender, lead=timedelta(minutes=settings.reminder_lead_minutes),
+                source=lambda: iter_stored_tasks(settings, batch_size=settings.reminder_load_batch_size),
+                still_stored=task_still_stored if leader is not None else None, leader=leader,
+                resync_seconds=resync_seconds,
+            )
+            _reminder_scheduler = scheduler.start()
+        return _reminder_scheduler
+
+
+def start_configured_reminders(dedicated: bool = False) -> Optional[ReminderScheduler]:
+    """
+    Starts reminders when settings.reminders_enabled, using the Twilio sender. Called by the servers when
+    they start serving (never on import), only the first call does anything. With the Redis state backend
+    every worker may call it, the leader lease makes one of them the sender.
+    @param dedicated: A reminder process without the servers, which reloads the stored tasks every
+                      settings.reminder_resync_seconds since it never sees the saves.
+    """
+    global _reminders_configured
+    with _reminder_scheduler_lock:
+        if _reminders_configured:
+            return _reminder_scheduler
+        _reminders_configured = True
+    if not settings.reminders_enabled:
+        return None
+    from message_sender import build_message_sender
+
+    sender = build_message_sender(settings)
+    if sender is None:
+        logging.error("❌ תזכורות דורשות TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN ו-TWILIO_WHATSAPP_FROM")
+        return None
+    scheduler = start_reminder_scheduler(sender, leader=build_leader_lease(),
+                                         resync_seconds=settings.reminder_resync_seconds if dedicated else 0)
+    atexit.register(scheduler.stop)
+    return scheduler
+
+
+if __name__ == "__main__":
+    # A dedicated reminder process, for multi-worker deployments without the Redis state backend
+    logging.basicConfig(level=logging.INFO)
+    if settings.reminder_resync_seconds <= 0:
+        raise SystemExit("❌ תהליך תזכורות נפרד דורש REMINDER_RESYNC_SECONDS חיובי")
+    if start_configured_reminders(dedicated=True) is None:
+        raise SystemExit("❌ התזכורות כבויות (REMINDERS_ENABLED) או שחסרות הגדרות Twilio")
+    threading.Event().wait()
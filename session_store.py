@@ -0,0 +1,309 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+def estimate_session_size(assistant) -> int:
+    """Rough resident size of a session in bytes, based on the text it holds."""
+    size = 512  # object overhead
+    for message in getattr(assistant, "_messages", ()):
+        size += 2 * len(str(message.get("content", ""))) + 200
+    for task in getattr(assistant, "_todo_list", ()):
+        size += 2 * len(str(task.description or "")) + 250
+    return size
+
+
+class _SessionEntry:
+    __slots__ = ("assistant", "last_used", "size", "lock", "active")
+
+    def __init__(self, assistant):
+        self.assistant = assistant
+        self.last_used = 0.0
+        self.size = 0
+        self.lock = threading.Lock()  # serializes the work of one user
+        self.active = 0  # callers currently holding the session, never evicted while > 0
+
+
+class SessionManager:
+    """
+    Bounded store of live PersonalAssistant sessions keyed by phone number.
+
+    Sessions are kept in LRU order and evicted when they have been idle longer than idle_ttl_seconds,
+    when there are more than max_sessions, or when the estimated memory goes over the budget.
+    Evicted sessions are flushed with save_state() and lazily rehydrated through the loader
+    (PersonalAssistant.load_state) on the user's next message.
+
+    session(name) gives exclusive access to one user's assistant, so concurrent messages of the
+    same user run one after the other while different users run in parallel. A session that is
+    being loaded or flushed is never loaded a second time until that finishes.
+    """
+
+    def __init__(self, loader: Callable[[str], object], max_sessions: int = 10_000,
+                 idle_ttl_seconds: float = 3600, memory_budget_bytes: Optional[int] = None,
+                 size_of: Callable[[object], int] = estimate_session_size,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        @param loader: Called with the session name when it is not resident.
+        @param max_sessions: Maximum number of resident sessions.
+        @param idle_ttl_seconds: Sessions untouched for longer are evicted.
+        @param memory_budget_bytes: Optional cap on the estimated size of all resident sessions.
+        """
+        self._loader = loader
+        self._max_sessions = max_sessions
+        self._idle_ttl = idle_ttl_seconds
+        self._memory_budget = memory_budget_bytes
+        self._size_of = size_of
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, _SessionEntry] = OrderedDict()
+        # name -> Event for sessions currently being loaded or flushed
+        self._transitions: dict[str, threading.Event] = {}
+        self._resident_bytes = 0
+        self._evictions = 0
+        self._rehydrations = 0
+        self._rehydrate_seconds_total = 0.0
+        self._rehydrate_seconds_max = 0.0
+
+    def get(self, name: str):
+        """Returns the session, rehydrating it if needed, and marks it as most recently used."""
+        entry = self._acquire(name)
+        self._release(entry)
+        return entry.assistant
+
+    @contextmanager
+    def session(self, name: str):
+        """Yields the user's assistant while holding that user's lock."""
+        entry = self._acquire(name)
+        try:
+            with entry.lock:
+                yield entry.assistant
+        finally:
+            self._release(entry)
+
+    def pin(self, name: str):
+        """
+        Returns the session and keeps it resident until unpin(name), without taking the user's lock.
+        For callers that serialize a user's messages themselves, e.g. with an asyncio.Lock.
+        """
+        return self._acquire(name).assistant
+
+    def unpin(self, name: str):
+        with self._lock:
+            entry = self._sessions[name]  # pinned entries are never evicted
+        self._release(entry)
+
+    def _acquire(self, name: str) -> _SessionEntry:
+        while True:
+            with self._lock:
+                entry = self._sessions.get(name)
+                if entry is not None:
+                    entry.active += 1
+                    self._touch(name, entry)
+                    evicted = self._collect_evictions(keep=name)
+                    break
+                pending = self._transitions.get(name)
+                loading = pending is None
+                if loading:
+                    pending = self._transitions[name] = threading.Event()
+            if not loading:
+                pending.wait()
+                continue
+
+            try:
+                assistant = self._rehydrate(name)
+            except Exception:
+                with self._lock:
+                    del self._transitions[name]
+                pending.set()
+                raise
+            with self._lock:
+                entry = _SessionEntry(assistant)
+                entry.active = 1
+                self._sessions[name] = entry
+                self._touch(name, entry)
+                evicted = self._collect_evictions(keep=name)
+                del self._transitions[name]
+            pending.set()
+            break
+        self._flush(evicted)
+        return entry
+
+    def _release(self, entry: _SessionEntry):
+        with self._lock:
+            entry.active -= 1
+            self._resize(entry)
+
+    def _resize(self, entry: _SessionEntry):
+        size = self._size_of(entry.assistant)
+        self._resident_bytes += size - entry.size
+        entry.size = size
+
+    def _rehydrate(self, name: str):
+        start = time.perf_counter()
+        assistant = self._loader(name)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._rehydrations += 1
+            self._rehydrate_seconds_total += elapsed
+            self._rehydrate_seconds_max = max(self._rehydrate_seconds_max, elapsed)
+        return assistant
+
+    def _touch(self, name: str, entry: _SessionEntry):
+        if not entry.size:
+            self._resize(entry)
+        entry.last_used = self._clock()
+        self._sessions.move_to_end(name)
+
+    def _collect_evictions(self, keep: Optional[str]) -> list:
+        """Pops sessions over the limits (oldest first), must be called with the lock held."""
+        evicted = []
+        now = self._clock()
+        for name, entry in list(self._sessions.items()):
+            over_limit = (len(self._sessions) > self._max_sessions
+                          or (self._memory_budget is not None and self._resident_bytes > self._memory_budget))
+            if not over_limit and now - entry.last_used <= self._idle_ttl:
+                break
+            if name == keep or entry.active:
+                continue
+            del self._sessions[name]
+            self._resident_bytes -= entry.size
+            self._evictions += 1
+            self._transitions[name] = threading.Event()
+            evicted.append((name, entry.assistant))
+        return evicted
+
+    def _flush(self, evicted: list):
+        """Saves evicted sessions, then lets waiting callers rehydrate them."""
+        for name, assistant in evicted:
+            try:
+                assistant.save_state()
+            except Exception:
+                logging.exception(f"❌ שמירת הסשן {name} נכשלה בזמן פינוי")
+            finally:
+                with self._lock:
+                    pending = self._transitions.pop(name)
+                pending.set()
+
+    def evict_idle(self):
+        """Evicts idle sessions without waiting for the next get(), e.g. from a periodic timer."""
+        with self._lock:
+            evicted = self._collect_evictions(keep=None)
+        self._flush(evicted)
+
+    def flush_all(self):
+        """Saves every resident session, used on shutdown."""
+        with self._lock:
+            entries = list(self._sessions.items())
+        for name, entry in entries:
+            with entry.lock:
+                try:
+                    entry.assistant.save_state()
+                except Exception:
+                    logging.exception(f"❌ שמירת הסשן {name} נכשלה")
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "resident_sessions": len(self._sessions),
+                "resident_bytes_estimate": self._resident_bytes,
+                "evictions": self._evictions,
+                "rehydrations": self._rehydrations,
+                "rehydrate_seconds_avg": (self._rehydrate_seconds_total / self._rehydrations
+                                          if self._rehydrations else 0.0),
+                "rehydrate_seconds_max": self._rehydrate_seconds_max,
+            }
+
+
+class SharedSessionManager:
+    """
+    Session manager for several worker processes (e.g. gunicorn -w N) behind one webhook.
+
+    Nothing stays resident between messages: session(name) takes the user's lock in the shared
+    ConversationStateStore, loads the assistant from storage, applies the exported conversation state,
+    and after the message stores the new state. A confirmation asked on one worker can therefore be
+    answered on another. Tasks and messages are written through to storage by the handlers, so the
+    storage itself must be shared too (SQLite or a shared disk, with write_coalesce_ms=0).
+    """
+
+    def __init__(self, loader: Callable[[str], object], state_store, lock_timeout_seconds: float = 30):
+        """
+        @param loader: Called with the session name on every message.
+        @param state_store: ConversationStateStore shared by all workers.
+        @param lock_timeout_seconds: How long a message waits for the same user's message on another worker.
+        """
+        self._loader = loader
+        self._state_store = state_store
+        self._lock_timeout = lock_timeout_seconds
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._load_seconds_total = 0.0
+
+    def get(self, name: str):
+        """Returns a freshly loaded assistant, without holding the user's lock."""
+        assistant = self._load(name)
+        assistant.restore_state(self._state_store.get(name))
+        return assistant
+
+    @contextmanager
+    def session(self, name: str):
+        """Yields the user's assistant while holding that user's lock across all workers."""
+        with self._state_store.lock(name, timeout=self._lock_timeout):
+            assistant = self.get(name)
+            yield assistant
+            self._state_store.set(name, assistant.export_state())
+
+    def _load(self, name: str):
+        start = time.perf_counter()
+        assistant = self._loader(name)
+        with self._lock:
+            self._loads += 1
+            self._load_seconds_total += time.perf_counter() - start
+        return assistant
+
+    def evict_idle(self):
+        """Nothing is resident, expired states are dropped by the store's TTL."""
+
+    def flush_all(self):
+        """Nothing is resident, every session is saved when its message is done."""
+
+    def __contains__(self, name: str) -> bool:
+        return False
+
+    def __len__(self) -> int:
+        return 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "resident_sessions": 0,
+                "rehydrations": self._loads,
+                "rehydrate_seconds_avg": self._load_seconds_total / self._loads if self._loads else 0.0,
+            }
+
+
+def build_session_manager(settings, loader: Callable[[str], object], shared: bool = True):
+    """
+    Creates a SessionManager with the limits from settings, or a SharedSessionManager when
+    settings.session_state_backend is set and `shared` is True.
+    """
+    if shared and settings.session_state_backend:
+        from conversation_state import build_state_store
+
+        return SharedSessionManager(loader, build_state_store(settings))
+    budget_mb = settings.session_memory_budget_mb
+    return SessionManager(
+        loader=loader,
+        max_sessions=settings.session_max_resident,
+        idle_ttl_seconds=settings.session_idle_ttl_seconds,
+        memory_budget_bytes=int(budget_mb * 1024 * 1024) if budget_mb else None,
+    )
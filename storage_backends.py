@@ -0,0 +1,353 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from storege import (WriteCoalescer, append_jsonl_entries, ensure_file_exists, iter_jsonl_file, load_json_file,
+                     log_deleted_message, log_deleted_task, read_jsonl_file, read_jsonl_head, read_jsonl_tail,
+                     save_json_file, save_jsonl_file)
+
+
+class UserStorage:
+    """
+    Persisted state of one user: tasks, chat messages and the deletion logs.
+
+    Mutating calls receive both the change and the whole task list after the change (a TaskStore or
+    a list of dicts). A whole-file backend serializes the list, a row-level backend only applies the
+    change and never touches it, so a change costs O(1) rows there however long the list is.
+    """
+
+    def load_tasks(self) -> list:
+        raise NotImplementedError
+
+    def add_tasks(self, new_tasks: list, tasks):
+        raise NotImplementedError
+
+    def delete_task(self, index: int, task: dict, tasks):
+        """Removes the task at the 0-based index and records it in the deleted tasks log."""
+        raise NotImplementedError
+
+    def clear_tasks(self):
+        raise NotImplementedError
+
+    def has_task(self, description: str, time: str) -> bool:
+        """Whether a stored task has this description and time (the reminder scheduler's task key)."""
+        return any(str(task.get("description") or "") == description and str(task.get("time") or "") == time
+                   for task in self.load_tasks())
+
+    def save_tasks(self, tasks: list):
+        raise NotImplementedError
+
+    def load_messages(self, limit: Optional[int] = None) -> Optional[list]:
+        """
+        Returns the chat history, or None when nothing was saved yet.
+
+        @param limit: Return only the last `limit` messages (plus the leading system message, if any).
+        """
+        raise NotImplementedError
+
+    def append_messages(self, new_messages: list):
+        """Persists new messages at the end of the history."""
+        raise NotImplementedError
+
+    def replace_messages(self, messages: list):
+        """Rewrites the whole history, used when it is cleared."""
+        raise NotImplementedError
+
+    def archive_messages(self, deleted_at: str):
+        """Moves the whole stored history into the deleted messages log and leaves it empty."""
+        raise NotImplementedError
+
+
+def _task_dicts(tasks) -> list:
+    """The dicts of a TaskStore (serialized only here, by the whole-file backend) or of a plain list."""
+    return tasks.to_dicts() if hasattr(tasks, "to_dicts") else tasks
+
+
+class JsonUserStorage(UserStorage):
+    """
+    File per user: todo_list_{name}.json and an append-only chat_log_{name}.jsonl.
+    With a WriteCoalescer, whole-file task writes are batched and reads flush the pending data first.
+    Chat logs in the old single-array JSON format are converted to JSONL the first time they are read.
+    """
+
+    def __init__(self, name: str, todo_file: str, chat_file: str, coalescer: Optional[WriteCoalescer] = None):
+        self._name = name
+        self._todo_file = todo_file
+        self._chat_file = chat_file
+        self._coalescer = coalescer
+        self._chat_log_checked = False  # the legacy format is looked for once per storage object
+
+    def _write(self, path: str, data: list):
+        if self._coalescer is not None:
+            self._coalescer.schedule(path, data)
+        else:
+            save_json_file(path, data)
+
+    def _read(self, path: str):
+        if self._coalescer is not None:
+            self._coalescer.flush(path)
+        return load_json_file(path)
+
+    def ensure_files(self):
+        ensure_file_exists(self._todo_file)
+        if not os.path.exists(self._chat_file):
+            open(self._chat_file, "a", encoding="utf-8").close()
+
+    def load_tasks(self) -> list:
+        if os.path.exists(self._todo_file):
+            return self._read(self._todo_file)
+        return []
+
+    def add_tasks(self, new_tasks: list, tasks):
+        self._write(self._todo_file, _task_dicts(tasks))
+
+    def delete_task(self, index: int, task: dict, tasks):
+        log_deleted_task(self._name, task)
+        self._write(self._todo_file, _task_dicts(tasks))
+
+    def clear_tasks(self):
+        self._write(self._todo_file, [])
+
+    def save_tasks(self, tasks: list):
+        self._write(self._todo_file, tasks)
+
+    def load_messages(self, limit: Optional[int] = None) -> Optional[list]:
+        self._convert_legacy_chat_log()
+        if not os.path.exists(self._chat_file):
+            return None
+        if limit is None:
+            messages = read_jsonl_file(self._chat_file)
+        else:
+            messages = read_jsonl_tail(self._chat_file, limit)
+            if messages and messages[0].get("role") != "system":
+                head = read_jsonl_head(self._chat_file)
+                if head is not None and head.get("role") == "system":
+                    messages.insert(0, head)
+        return messages or None
+
+    def append_messages(self, new_messages: list):
+        self._convert_legacy_chat_log()
+        append_jsonl_entries(self._chat_file, new_messages)
+
+    def replace_messages(self, messages: list):
+        save_jsonl_file(self._chat_file, messages)
+        self._chat_log_checked = True
+
+    def _convert_legacy_chat_log(self):
+        """Rewrites a chat log saved as one JSON array (chat_log_{name}.json) as JSONL."""
+        if self._chat_log_checked:
+            return
+        self._chat_log_checked = True
+        legacy_file = self._chat_file[:-1] if self._chat_file.endswith(".jsonl") else None
+        if legacy_file and not os.path.exists(self._chat_file) and os.path.exists(legacy_file):
+            save_jsonl_file(self._chat_file, load_json_file(legacy_file))
+            os.remove(legacy_file)
+            return
+        if os.path.exists(self._chat_file):
+            with open(self._chat_file, "r", encoding="utf-8") as f:
+                first = f.read(64).lstrip()[:1]
+            if first == "[":
+                save_jsonl_file(self._chat_file, load_json_file(self._chat_file))
+
+    def archive_messages(self, deleted_at: str):
+        self._convert_legacy_chat_log()
+        messages = iter_jsonl_file(self._chat_file) if os.path.exists(self._chat_file) else ()
+        log_deleted_message(self._name, deleted_at, messages)
+        save_jsonl_file(self._chat_file, [])
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    description TEXT,
+    time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_user ON tasks(user, id);
+CREATE INDEX IF NOT EXISTS tasks_user_time ON tasks(user, time);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_user ON messages(user, id);
+
+CREATE TABLE IF NOT EXISTS deleted_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    deleted_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deleted_tasks_user ON deleted_tasks(user, id);
+
+CREATE TABLE IF NOT EXISTS deleted_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    deleted_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deleted_messages_user ON deleted_messages(user, id);
+"""
+
+
+class SQLiteDatabase:
+    """Shared SQLite (WAL) database for all users, with one connection per thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+_databases: dict[str, SQLiteDatabase] = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path: str) -> SQLiteDatabase:
+    """Returns the process-wide SQLiteDatabase for a file, creating the schema on first use."""
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = SQLiteDatabase(path)
+        return _databases[path]
+
+
+def _task_row(name: str, task: dict) -> tuple:
+    return name, task.get("description"), task.get("time"), json.dumps(task, ensure_ascii=False)
+
+
+class SQLiteUserStorage(UserStorage):
+    """One user's view of the shared SQLite database, with row-level inserts and deletes."""
+
+    def __init__(self, db: SQLiteDatabase, name: str):
+        self._db = db
+        self._name = name
+
+    def load_tasks(self) -> list:
+        rows = self._db.connect().execute(
+            "SELECT data FROM tasks WHERE user = ? ORDER BY id", (self._name,)
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def add_tasks(self, new_tasks: list, tasks):
+        with self._db.connect() as conn:
+            conn.executemany("INSERT INTO tasks (user, description, time, data) VALUES (?, ?, ?, ?)",
+                             [_task_row(self._name, task) for task in new_tasks])
+
+    def delete_task(self, index: int, task: dict, tasks):
+        with self._db.connect() as conn:
+            conn.execute(
+                "DELETE FROM tasks WHERE id = ("
+                " SELECT id FROM tasks WHERE user = ? ORDER BY id LIMIT 1 OFFSET ?)",
+                (self._name, index),
+            )
+            conn.execute("INSERT INTO deleted_tasks (user, deleted_at, data) VALUES (?, ?, ?)",
+                         (self._name, _now(), json.dumps(task, ensure_ascii=False)))
+
+    def clear_tasks(self):
+        with self._db.connect() as conn:
+            conn.execute("DELETE FROM tasks WHERE user = ?", (self._name,))
+
+    def has_task(self, description: str, time: str) -> bool:
+        return self._db.connect().execute(
+            "SELECT 1 FROM tasks WHERE user = ? AND time = ? AND COALESCE(description, '') = ? LIMIT 1",
+            (self._name, time, description),
+        ).fetchone() is not None
+
+    def save_tasks(self, tasks: list):
+        with self._db.connect() as conn:
+            conn.execute("DELETE FROM tasks WHERE user = ?", (self._name,))
+            conn.executemany("INSERT INTO tasks (user, description, time, data) VALUES (?, ?, ?, ?)",
+                             [_task_row(self._name, task) for task in tasks])
+
+    def load_messages(self, limit: Optional[int] = None) -> Optional[list]:
+        conn = self._db.connect()
+        if limit is None:
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE user = ? ORDER BY id", (self._name,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE user = ? ORDER BY id DESC LIMIT ?", (self._name, limit)
+            ).fetchall()[::-1]
+            if rows and rows[0][1] != "system":
+                head = conn.execute(
+                    "SELECT id, role, content FROM messages WHERE user = ? ORDER BY id LIMIT 1", (self._name,)
+                ).fetchone()
+                if head[1] == "system":
+                    rows.insert(0, head)
+        if not rows:
+            return None
+        return [{"role": role, "content": content} for _, role, content in rows]
+
+    def append_messages(self, new_messages: list):
+        with self._db.connect() as conn:
+            conn.executemany("INSERT INTO messages (user, role, content) VALUES (?, ?, ?)",
+                             [(self._name, m["role"], str(m["content"])) for m in new_messages])
+
+    def replace_messages(self, messages: list):
+        with self._db.connect() as conn:
+            conn.execute("DELETE FROM messages WHERE user = ?", (self._name,))
+            conn.executemany("INSERT INTO messages (user, role, content) VALUES (?, ?, ?)",
+                             [(self._name, m["role"], str(m["content"])) for m in messages])
+
+    def archive_messages(self, deleted_at: str):
+        # The archive entry is built inside SQLite, the history never passes through Python
+        with self._db.connect() as conn:
+            conn.execute(
+                "INSERT INTO deleted_messages (user, deleted_at, data) "
+                "SELECT ?, ?, json_object('deleted_at', ?, 'task', "
+                "json_group_array(json_object('role', role, 'content', content))) "
+                "FROM (SELECT role, content FROM messages WHERE user = ? ORDER BY id)",
+                (self._name, deleted_at, deleted_at, self._name),
+            )
+            conn.execute("DELETE FROM messages WHERE user = ?", (self._name,))
+
+
+def iter_stored_tasks(settings, batch_size: int = 1000) -> Iterator[list[tuple[str, dict]]]:
+    """
+    Yields the saved tasks of all users as batches of (user, task dict), without loading everything at once.
+    SQLite is paged by row id; with JSON storage every user file is one batch.
+    """
+    if settings.storage_backend == "sqlite":
+        conn = get_database(str(settings.data_dir / settings.sqlite_file)).connect()
+        last_id = 0
+        while True:
+            rows = conn.execute("SELECT id, user, data FROM tasks WHERE id > ? ORDER BY id LIMIT ?",
+                                (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [(user, json.loads(data)) for _, user, data in rows]
+    else:
+        prefix, _, suffix = settings.todo_template.partition("{name}")
+        for path in sorted(Path(settings.data_dir).glob(f"{prefix}*{suffix}")):
+            name = path.name[len(prefix):len(path.name) - len(suffix)]
+            try:
+                tasks = load_json_file(str(path))
+            except (OSError, ValueError):
+                logging.exception(f"❌ קריאת {path} נכשלה")
+                continue
+            if isinstance(tasks, list) and tasks:
+                yield [(name, task) for task in tasks if isinstance(task, dict)]
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
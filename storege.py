@@ -1,21 +1,68 @@
+import asyncio
+import atexit
+import logging
 import os
 import json
+import tempfile
+import threading
+import time
+from typing import Iterable, Iterator
 from config import settings
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-FILE_LOG_DELETED_TASKS_NAME = str(settings.data_dir / settings.log_lead_template)  # os.path.join(BASE_DIR, "data", "deleted_tasks_{name}.jsonl")
-FILE_LOG_DELETED_MESSAGES = str(settings.data_dir / settings.log_chat_template)  # os.path.join(BASE_DIR, "data", "deleted_messages_{name}.jsonl")
+FILE_LOG_DELETED_TASKS_NAME = str(settings.data_dir / settings.log_todo_template)  # os.path.join(BASE_DIR, "data", "deleted_tasks_{name}.jsonl")
+FILE_LOG_DELETED_MESSAGES = str(settings.data_dir / settings.log_chat_file)  # os.path.join(BASE_DIR, "data", "deleted_messages_{name}.jsonl")
 
 
 def ensure_file_exists(file_path: str):
     if not os.path.exists(file_path):
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+        save_json_file(file_path, [])
 
 
-def save_json_file(path: str, data: any):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def save_json_file(path: str, data: any, fsync: bool | None = None):
+    """
+    Atomically replaces the file: the JSON is written to a temp file in the same directory and renamed
+    over the target, so a crash or a concurrent reader never sees a truncated file.
+
+    @param fsync: Flush the data to disk before the rename, defaults to settings.storage_fsync.
+    """
+    _atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2), fsync)
+
+
+def save_jsonl_file(path: str, entries: list, fsync: bool | None = None):
+    """Atomically replaces a JSONL file with the given entries, one JSON object per line."""
+    _atomic_write(path, lambda f: f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in entries), fsync)
+
+
+def _atomic_write(path: str, write, fsync: bool | None):
+    if fsync is None:
+        fsync = settings.storage_fsync
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            write(f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+async def save_json_file_async(path: str, data: any):
+    """Writes the file in a worker thread so the event loop is not blocked."""
+    await asyncio.to_thread(save_json_file, path, data)
 
 
 def load_json_file(path: str) -> dict:
@@ -24,9 +71,30 @@ def load_json_file(path: str) -> dict:
         return data
 
 
+def _starts_new_line(path: str) -> str:
+    """Returns a line break to write first when the file ends mid-line (a torn last write), else ""."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return ""
+            f.seek(-1, os.SEEK_END)
+            return "" if f.read(1) == b"\n" else "\n"
+    except FileNotFoundError:
+        return ""
+
+
 def append_jsonl_file(path: str, entry: dict):
+    prefix = _starts_new_line(path)
     with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.write(prefix + json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def append_jsonl_entries(path: str, entries: list):
+    """Appends several entries with a single write, so a reader never sees half of an exchange."""
+    prefix = _starts_new_line(path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(prefix + "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
 
 
 def log_deleted_task(name: str, task: dict):
@@ -35,12 +103,214 @@ def log_deleted_task(name: str, task: dict):
     append_jsonl_file(path=path, entry=task)
 
 
-def log_deleted_message(name: str, entry: dict):
+def log_deleted_message(name: str, deleted_at: str, messages: Iterable[dict]):
+    """
+    Appends one {"deleted_at", "task": [messages]} line to the user's deleted messages log.
+    The messages are written one by one, so a long history is archived without loading it into memory.
+    """
     path = FILE_LOG_DELETED_MESSAGES.format(name=name)
-    ensure_file_exists(file_path=path)
-    save_json_file(path=path, data=entry)
+    _convert_legacy_deleted_messages(path)
+    prefix = _starts_new_line(path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(prefix + json.dumps({"deleted_at": deleted_at}, ensure_ascii=False)[:-1] + ', "task": [')
+        for number, message in enumerate(messages):
+            f.write(("" if number == 0 else ", ") + json.dumps(message, ensure_ascii=False))
+        f.write("]}\n")
 
 
-def read_jsonl_file(path: str) -> list:
+def _convert_legacy_deleted_messages(path: str):
+    """Older versions overwrote the log with a single indented JSON document, rewrite it as JSONL."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        first_line = f.readline().strip()
+    try:
+        json.loads(first_line or "null")
+        return
+    except json.JSONDecodeError:
+        pass
+    try:
+        data = load_json_file(path)
+    except json.JSONDecodeError:
+        return  # already JSONL with a torn first line, readers skip it
+    save_jsonl_file(path, data if isinstance(data, list) else [data])
+
+
+def iter_jsonl_file(path: str) -> Iterator[dict]:
+    """
+    Yields the entries of a JSONL file one at a time.
+    A line that is not valid JSON (e.g. a write cut by a crash) is logged and skipped.
+    """
     with open(path, "r", encoding="utf-8") as f:
-        return [json.loads(line) for line in f if line.strip()]
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"⚠️ שורה {number} פגומה בקובץ {path} ודולגה")
+
+
+def read_jsonl_file(path: str) -> list:
+    return list(iter_jsonl_file(path))
+
+
+def read_jsonl_tail(path: str, max_entries: int, block_size: int = 8192) -> list:
+    """
+    Returns the last max_entries entries of a JSONL file.
+    Reads backwards from the end in blocks, so the cost depends on the tail size and not on the file size.
+    """
+    if max_entries <= 0:
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        # One extra line break is needed to know the oldest wanted line is complete
+        while position > 0 and data.count(b"\n") <= max_entries:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = [line for line in data.split(b"\n") if line.strip()]
+    if position > 0:
+        lines = lines[1:]  # the first line may be cut in the middle
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:  # a write cut by a crash, the next append starts a new line
+            logging.warning(f"⚠️ שורה פגומה בקובץ {path} דולגה")
+    return entries[-max_entries:]
+
+
+def read_jsonl_head(path: str) -> dict | None:
+    """Returns the first entry of a JSONL file, or None when it is empty."""
+    return next(iter_jsonl_file(path), None)
+
+
+class WriteCoalescer:
+    """
+    Write-behind buffer for whole-file JSON writes.
+
+    schedule() only remembers the latest data for a path; a background thread writes it once the
+    window has passed, so a burst of changes for one user becomes a single disk write.
+    Readers call flush(path) before loading, and flush() writes everything on shutdown. A write taken
+    off the pending map stays in `_in_flight` until it is on disk, so flush() also waits for those.
+    """
+
+    def __init__(self, window_seconds: float = 0.2, writer=None):
+        self._window = window_seconds
+        self._writer = writer or save_json_file
+        self._pending: dict[str, tuple[float, int, any]] = {}  # path -> (due time, version, data)
+        self._io_locks: dict[str, threading.Lock] = {}
+        self._written_versions: dict[str, int] = {}
+        self._in_flight: dict[str, int] = {}  # path -> writes taken off _pending and not finished yet
+        self._version = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.scheduled = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="write-coalescer", daemon=True)
+        self._thread.start()
+
+    def schedule(self, path: str, data: any):
+        """Queues data to be written to path; replaces any pending data for the same path."""
+        if isinstance(data, list):
+            data = list(data)  # snapshot, the caller keeps mutating its list
+        with self._cond:
+            closed = self._closed
+        if closed:  # after shutdown started, write through
+            self._writer(path, data)
+            return
+        with self._cond:
+            self._version += 1
+            due = self._pending[path][0] if path in self._pending else time.monotonic() + self._window
+            self._pending[path] = (due, self._version, data)
+            self._io_locks.setdefault(path, threading.Lock())
+            self.scheduled += 1
+            self._cond.notify_all()
+
+    def flush(self, path: str | None = None):
+        """Writes pending data now – for one path, or for all paths when path is None."""
+        with self._cond:
+            if path is None:
+                items = self._take(list(self._pending))
+            else:
+                items = self._take([path] if path in self._pending else [])
+        for item_path, (_, version, data) in items:
+            self._write(item_path, version, data)
+        with self._cond:  # wait for background writes that were already taken off _pending
+            while self._in_flight if path is None else path in self._in_flight:
+                self._cond.wait()
+
+    def _take(self, paths: list) -> list:
+        """Moves paths from pending to in flight (condition held)."""
+        for path in paths:
+            self._in_flight[path] = self._in_flight.get(path, 0) + 1
+        return [(path, self._pending.pop(path)) for path in paths]
+
+    def _write(self, path: str, version: int, data: any):
+        try:
+            with self._io_locks[path]:
+                if version <= self._written_versions.get(path, 0):
+                    return  # a newer version was already written by flush()
+                try:
+                    self._writer(path, data)
+                    self._written_versions[path] = version
+                    self.written += 1
+                except Exception:
+                    logging.exception(f"❌ כתיבה מושהית ל-{path} נכשלה")
+        finally:
+            with self._cond:
+                self._in_flight[path] -= 1
+                if not self._in_flight[path]:
+                    del self._in_flight[path]
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = []
+                while not self._closed:
+                    now = time.monotonic()
+                    due = [p for p, (due_at, _, _) in self._pending.items() if due_at <= now]
+                    if due:
+                        break
+                    next_due = min((due_at for due_at, _, _ in self._pending.values()), default=None)
+                    self._cond.wait(None if next_due is None else next_due - now)
+                if self._closed:
+                    return
+                items = self._take(due)
+            for path, (_, version, data) in items:
+                self._write(path, version, data)
+
+    def close(self):
+        """Writes everything still pending and stops the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+_write_coalescer: WriteCoalescer | None = None
+_write_coalescer_lock = threading.Lock()
+
+
+def get_write_coalescer() -> WriteCoalescer | None:
+    """Returns the process-wide coalescer, or None when settings.write_coalesce_ms is 0."""
+    global _write_coalescer
+    if settings.write_coalesce_ms <= 0:
+        return None
+    with _write_coalescer_lock:
+        if _write_coalescer is None:
+            _write_coalescer = WriteCoalescer(window_seconds=settings.write_coalesce_ms / 1000)
+            atexit.register(_write_coalescer.close)
+        return _write_coalescer
+
+
+def flush_pending_writes():
+    """Writes all coalesced data to disk, call on shutdown."""
+    if _write_coalescer is not None:
+        _write_coalescer.flush()
@@ -0,0 +1,111 @@
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from task_store import TaskStore
+
+NEXT_PAGE_RE = re.compile(r"^(עוד|הבא|הבאות|המשך|תמשיך|עמוד הבא|העמוד הבא|(הצג|תציג|תראה) עוד( משימות)?|עוד משימות)$")
+_DATE_RE = re.compile(r"(?<!\d)(\d{1,2})[/.](\d{1,2})(?:[/.](\d{2}|\d{4}))?(?!\d)")
+# Whole words with an optional one-letter prefix ("למחר"), so "מחר" does not match inside "מחרתיים"
+_RELATIVE_DAYS = [(re.compile(rf"(?<!\w)[ולבש]?{word}(?!\w)"), first, last)
+                  for word, first, last in [("מחרתיים", 2, 2), ("מחר", 1, 1), ("השבוע", 0, 6), ("היום", 0, 0)]]
+
+NO_TASKS = "אין משימות כרגע."
+NO_TASKS_IN_RANGE = "אין משימות בטווח התאריכים הזה."
+NO_MORE_TASKS = "אין משימות נוספות."
+MORE_FOOTER = "מוצגות {first}-{last} מתוך {total}. כתוב 'עוד' להמשך."
+
+
+def is_next_page_request(question: str) -> bool:
+    return bool(NEXT_PAGE_RE.match(question.strip().rstrip("?!. ")))
+
+
+def _day_range(first: date, last: date) -> tuple[datetime, datetime]:
+    return datetime.combine(first, time.min), datetime.combine(last, time.max)
+
+
+def parse_date_range(text: str, today: Optional[date] = None) -> Optional[tuple[datetime, datetime]]:
+    """
+    The date filter of a listing request: "היום", "מחר", "מחרתיים", "השבוע", one date ("01/05") or two ("מ-01/05 עד 10/05").
+    None when the request has no filter.
+    """
+    today = today or date.today()
+    dates = []
+    for day, month, year in _DATE_RE.findall(text):
+        year = int(year) + 2000 if year and len(year) == 2 else int(year or today.year)
+        try:
+            dates.append(date(year, int(month), int(day)))
+        except ValueError:
+            continue
+    if len(dates) >= 2:
+        return _day_range(min(dates[:2]), max(dates[:2]))
+    if dates:
+        return _day_range(dates[0], dates[0])
+    for pattern, first, last in _RELATIVE_DAYS:
+        if pattern.search(text):
+            return _day_range(today + timedelta(days=first), today + timedelta(days=last))
+    return None
+
+
+class TaskListing:
+    """
+    A paged view of a user's tasks, optionally limited to a due date range.
+
+    Pages are cut at page_size tasks or max_chars characters (WhatsApp rejects long messages).
+    Every task keeps its display number, so "מחק 12" still works from any page or filter.
+    Lines come from Task.line, which is rendered once per task, and a page is joined in one go,
+    so listing cost depends on the page, not on the whole list.
+    """
+
+    def __init__(self, date_range: Optional[tuple[datetime, datetime]] = None, offset: int = 0):
+        self.date_range = date_range
+        self.offset = offset
+
+    def render_page(self, tasks: TaskStore, page_size: int = 20, max_chars: int = 1500) -> tuple[str, bool]:
+        """
+        Renders the page at the current offset and moves past it.
+        @return: (text, whether more pages follow)
+        """
+        if self.date_range is None:
+            total = len(tasks)
+            selected = None
+        else:
+            selected = tasks.due_between(*self.date_range)
+            total = len(selected)
+        if not total:
+            return (NO_TASKS if self.date_range is None else NO_TASKS_IN_RANGE), False
+        if self.offset >= total:  # the list shrank since the previous page
+            return NO_MORE_TASKS, False
+
+        lines = []
+        chars = 0
+        budget = max_chars - len(MORE_FOOTER) - 20  # room for the footer and its numbers
+        position = self.offset
+        while position < total and len(lines) < page_size:
+            task = tasks[position] if selected is None else selected[position]
+            number = position + 1 if selected is None else tasks.position(task.id) + 1
+            line = f"{number}. {task.line}"
+            if chars + len(line) + 1 > budget:
+                if lines:
+                    break
+                line = line[:budget - 2] + "…"  # one task longer than a whole page
+            lines.append(line)
+            chars += len(line) + 1
+            position += 1
+
+        first, self.offset = self.offset + 1, position
+        more = position < total
+        if more:
+            lines.append(MORE_FOOTER.format(first=first, last=position, total=total))
+        return "\n".join(lines) + "\n", more
+
+    def to_dict(self) -> dict:
+        start, end = self.date_range or (None, None)
+        return {"offset": self.offset, "start": start and start.isoformat(), "end": end and end.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TaskListing":
+        date_range = None
+        if data.get("start"):
+            date_range = datetime.fromisoformat(data["start"]), datetime.fromisoformat(data["end"])
+        return cls(date_range, data.get("offset", 0))
@@ -0,0 +1,85 @@
+import re
+from typing import Optional
+
+# Words of a delete request that say nothing about which task is meant
+DELETE_STOP_WORDS = {
+    "מחק", "תמחק", "מחקי", "תמחקי", "הסר", "תסיר", "תסירי", "בטל", "תבטל", "את", "משימה", "המשימה",
+    "מספר", "של", "לי", "בבקשה", "כבר", "עשיתי", "סיימתי", "#",
+}
+
+_NIQQUD_RE = re.compile(r"[֑-ׇ]")
+_WORD_RE = re.compile(r"[\w#]+")
+_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+
+
+def normalize_hebrew(text: str) -> str:
+    """Lower-cases, drops niqqud and punctuation and maps final letters (ך→כ, ם→מ...) to their regular form."""
+    text = _NIQQUD_RE.sub("", str(text or "")).lower().translate(_FINAL_LETTERS)
+    return " ".join(_WORD_RE.findall(text))
+
+
+def _strip_prefix(word: str) -> str:
+    """Drops the one-letter prefixes (ו, ה, ב, ל, כ, ש, מ) so "ולחלב" and "חלב" share their n-grams."""
+    if len(word) >= 4 and word[0] == "ו":
+        word = word[1:]
+    if len(word) >= 4 and word[0] in "הבלכשמ":
+        word = word[1:]
+    return word
+
+
+def content_words(text: str, stop_words=frozenset()) -> list[str]:
+    words = normalize_hebrew(text).split()
+    return [_strip_prefix(word) for word in words if word not in stop_words]
+
+
+def ngrams(words: list[str], n: int = 3) -> set[str]:
+    """Character n-grams of each word, padded with spaces so word starts and ends count."""
+    grams = set()
+    for word in words:
+        padded = f" {word} "
+        if len(padded) <= n:
+            grams.add(padded)
+            continue
+        grams.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+def description_ngrams(description) -> set[str]:
+    return ngrams(content_words(description))
+
+
+def explicit_index(question: str) -> Optional[int]:
+    """The task number of requests like "מחק 2" or "תמחק את משימה מספר 3", None otherwise."""
+    words = [word for word in normalize_hebrew(question).split() if word not in DELETE_STOP_WORDS]
+    if len(words) == 1 and words[0].lstrip("#").isdigit():
+        return int(words[0].lstrip("#"))
+    return None
+
+
+def match_delete_target(question: str, store, threshold: float = 0.6, margin: float = 0.15,
+                        shortlist_size: int = 5) -> tuple[Optional[dict], list]:
+    """
+    Resolves which task a delete request refers to without GPT when possible.
+
+    @param question: The user's delete request.
+    @param store: The user's TaskStore.
+    @param threshold: Minimum similarity for a confident description match.
+    @param margin: How far ahead of the runner-up a confident match has to be.
+    @return: ({"index", "description"} or None, shortlist of (position, Task) to send GPT when None)
+    """
+    index = explicit_index(question)
+    if index is not None:
+        if 1 <= index <= len(store):
+            return {"index": index, "description": store[index - 1].description}, []
+        return None, []
+
+    query = ngrams(content_words(question, DELETE_STOP_WORDS))
+    ranked = store.search(query, limit=shortlist_size) if query else []
+    if ranked:
+        best_score, best_position, best_task = ranked[0]
+        runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+        if best_score >= threshold and best_score - runner_up >= margin:
+            return {"index": best_position + 1, "description": best_task.description}, []
+    if not ranked:  # nothing in common, let GPT look at the first tasks
+        return None, [(position, store[position]) for position in range(min(shortlist_size, len(store)))]
+    return None, [(position, task) for _, position, task in ranked]
@@ -0,0 +1,219 @@
+import re
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional
+
+from task_matcher import description_ngrams
+
+TIME_FORMATS = ("%d/%m/%Y %H:%M", "%d/%m/%Y")
+
+_NO_TIME = object()  # the task dict had no "time" key at all
+
+
+def parse_task_time(value) -> Optional[datetime]:
+    """Parses the "DD/MM/YYYY HH:MM" (or "DD/MM/YYYY") time of a task, None for free text like "מחר"."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_description(description) -> str:
+    return re.sub(r"\s+", " ", str(description or "")).strip().lower()
+
+
+class Task:
+    """
+    One saved task. The original description and time string are kept as-is so that
+    to_dict() writes back exactly what was loaded; any other keys are kept in `extra`.
+    """
+
+    __slots__ = ("id", "description", "normalized", "time", "due", "extra", "_line")
+
+    def __init__(self, task_id: int, description, time=None, extra: Optional[dict] = None):
+        self.id = task_id
+        self.description = description
+        self.normalized = normalize_description(description)
+        self.time = time
+        self.due = parse_task_time(time)
+        self.extra = extra or None
+        self._line = None
+
+    @classmethod
+    def from_dict(cls, task_id: int, data: dict) -> "Task":
+        extra = {key: value for key, value in data.items() if key not in ("description", "time")}
+        return cls(task_id, data.get("description"), data.get("time", _NO_TIME), extra)
+
+    @property
+    def line(self) -> str:
+        """The task as listed to the user, without its number. Rendered once, tasks are never edited in place."""
+        if self._line is None:
+            desc = self.description if self.description is not None else "ללא תיאור"
+            self._line = f"{desc} ({self.time})" if isinstance(self.time, str) and self.time else str(desc)
+        return self._line
+
+    def to_dict(self) -> dict:
+        data = {}
+        if self.description is not None:
+            data["description"] = self.description
+        if self.time is not _NO_TIME:
+            data["time"] = self.time
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return f"Task({self.id}, {self.description!r}, {self.time!r})"
+
+
+class TaskStore:
+    """
+    Ordered task list of one user with an id map, a sorted-by-due-time index and an
+    inverted n-gram index over the descriptions for fuzzy lookups.
+
+    Tasks keep their display order (the numbers shown to the user). Ids grow with every insert,
+    so the display list is also sorted by id and a task is located by id with a binary search.
+    The list-style API (append, extend, pop, clear, len, ==) accepts and compares task dicts,
+    so code and files that use plain dicts keep working.
+
+    Deleting is O(log n) lookups plus one list shift of the display list (the numbers after the task
+    move up, so they have to). The due index is cleaned lazily: a deleted task's entry stays until it
+    is skipped by due_between, and the index is rebuilt once most of it is stale.
+    """
+
+    def __init__(self, tasks: Iterable[dict] = ()):
+        self._tasks: list[Task] = []
+        self._ids: list[int] = []  # parallel to _tasks, sorted
+        self._by_id: dict[int, Task] = {}
+        self._due: list[tuple[datetime, int]] = []  # sorted (due, id) of tasks with a parsed time
+        self._stale_due = 0  # entries of deleted tasks still in _due
+        self._grams: dict[str, set[int]] = {}  # description n-gram -> task ids
+        self._gram_counts: dict[int, int] = {}
+        self._next_id = 1
+        self.extend(tasks)
+
+    def add(self, data: dict) -> Task:
+        """Appends a task dict and returns the Task created for it."""
+        task = Task.from_dict(self._next_id, data)
+        self._next_id += 1
+        self._tasks.append(task)
+        self._ids.append(task.id)
+        self._by_id[task.id] = task
+        if task.due is not None:
+            insort(self._due, (task.due, task.id))
+        grams = description_ngrams(task.description)
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(task.id)
+        self._gram_counts[task.id] = len(grams)
+        return task
+
+    def append(self, data: dict):
+        self.add(data)
+
+    def extend(self, tasks: Iterable[dict]):
+        for data in tasks:
+            self.add(data)
+
+    def get(self, task_id: int) -> Optional[Task]:
+        return self._by_id.get(task_id)
+
+    def position(self, task_id: int) -> int:
+        """0-based display position of a task id, -1 when it does not exist."""
+        pos = bisect_left(self._ids, task_id)
+        if pos < len(self._ids) and self._ids[pos] == task_id:
+            return pos
+        return -1
+
+    def delete(self, task_id: int) -> Task:
+        """Removes a task by id, raises KeyError when it does not exist."""
+        pos = self.position(task_id)
+        if pos < 0:
+            raise KeyError(task_id)
+        return self._remove_at(pos)
+
+    def pop(self, index: int = -1) -> dict:
+        """Removes a task by display position (like list.pop) and returns its dict."""
+        if not -len(self._tasks) <= index < len(self._tasks):
+            raise IndexError("task index out of range")
+        return self._remove_at(index % len(self._tasks)).to_dict()
+
+    def _remove_at(self, pos: int) -> Task:
+        task = self._tasks.pop(pos)
+        del self._ids[pos]
+        del self._by_id[task.id]
+        if task.due is not None:
+            self._stale_due += 1
+            if self._stale_due > 64 and 2 * self._stale_due > len(self._due):
+                self._due = [entry for entry in self._due if entry[1] in self._by_id]
+                self._stale_due = 0
+        for gram in description_ngrams(task.description):
+            ids = self._grams[gram]
+            ids.discard(task.id)
+            if not ids:
+                del self._grams[gram]
+        del self._gram_counts[task.id]
+        return task
+
+    def clear(self):
+        self._tasks.clear()
+        self._ids.clear()
+        self._by_id.clear()
+        self._due.clear()
+        self._stale_due = 0
+        self._grams.clear()
+        self._gram_counts.clear()
+
+    def due_between(self, start: datetime, end: datetime) -> list[Task]:
+        """Tasks due in [start, end], ordered by due time."""
+        lo = bisect_left(self._due, (start, 0))
+        hi = bisect_right(self._due, (end, float("inf")))
+        return [self._by_id[task_id] for _, task_id in self._due[lo:hi] if task_id in self._by_id]
+
+    def due_within(self, hours: float, now: Optional[datetime] = None) -> list[Task]:
+        """Tasks due in the next `hours` hours."""
+        now = now or datetime.now()
+        return self.due_between(now, now + timedelta(hours=hours))
+
+    def search(self, query_grams: set[str], limit: int = 5) -> list[tuple[float, int, Task]]:
+        """
+        Tasks sharing n-grams with the query, best first, as (dice similarity, position, task).
+        Only tasks found through the inverted index are scored.
+        """
+        overlap = Counter()
+        for gram in query_grams:
+            overlap.update(self._grams.get(gram, ()))
+        scored = []
+        for task_id, shared in overlap.items():
+            score = 2 * shared / (len(query_grams) + self._gram_counts[task_id])
+            scored.append((score, self.position(task_id)))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, position, self._tasks[position]) for score, position in scored[:limit]]
+
+    def to_dicts(self) -> list[dict]:
+        """The tasks as saved to storage, in display order."""
+        return [task.to_dict() for task in self._tasks]
+
+    def __iter__(self) -> Iterator[Task]:
+        return iter(self._tasks)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __getitem__(self, index: int) -> Task:
+        return self._tasks[index]
+
+    def __eq__(self, other):
+        if isinstance(other, TaskStore):
+            return self.to_dicts() == other.to_dicts()
+        if isinstance(other, list):
+            return self.to_dicts() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"TaskStore({self.to_dicts()!r})"
@@ -0,0 +1,142 @@
+"""
+Minimal local stand-in for the OpenAI chat completions endpoint, used to test gpt_client over real HTTP.
+
+Each request takes the next scripted reply: {"status", "content", "delay", "headers", "usage"}. When the script
+is empty the server answers with `responder(request_body)` when one is given (used by the load test to
+answer each prompt realistically), otherwise 200 with `default_content`. Streamed requests ("stream": true) get the
+content as server-sent events of `chunk_size` characters, `chunk_delay` seconds apart; with `stall_after` the
+stream stops sending for `stall` seconds after that many chunks, like an upstream that hangs mid-reply.
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+DEFAULT_USAGE = {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+
+
+def completion_body(content: str, model: str = "gpt-4o", usage: dict | None = None) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage or DEFAULT_USAGE,
+    }
+
+
+def stream_chunk_body(content: str | None, model: str = "gpt-4o", finish_reason: str | None = None) -> dict:
+    delta = {"content": content} if content is not None else {}
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class FakeOpenAIServer:
+    def __init__(self, default_content: str = "ok", responder: Optional[Callable[[dict], dict]] = None,
+                 record_requests: bool = True):
+        self.default_content = default_content
+        self.responder = responder
+        self.record_requests = record_requests
+        self.request_count = 0
+        self.script: deque[dict] = deque()
+        self.requests: list[dict] = []
+        self.streamed_chunks = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    server.request_count += 1
+                    if server.record_requests:
+                        server.requests.append(body)
+                    reply = server.script.popleft() if server.script else None
+                if reply is None:
+                    reply = server.responder(body) if server.responder is not None else {}
+                time.sleep(reply.get("delay", 0))
+                status = reply.get("status", 200)
+                if status == 200 and body.get("stream"):
+                    self._stream(reply, body)
+                    return
+                if status == 200:
+                    payload = completion_body(reply.get("content", server.default_content), body.get("model", "gpt-4o"),
+                                              reply.get("usage"))
+                else:
+                    payload = {"error": {"message": f"fake error {status}", "type": "server_error", "code": None}}
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    for name, value in reply.get("headers", {}).items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (timeout or hedged duplicate)
+
+            def _stream(self, reply: dict, body: dict):
+                model = body.get("model", "gpt-4o")
+                content = reply.get("content", server.default_content)
+                size = reply.get("chunk_size", 4)
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for number, start in enumerate(range(0, len(content), size)):
+                        if number == reply.get("stall_after"):
+                            time.sleep(reply.get("stall", 0))
+                        event = stream_chunk_body(content[start:start + size], model)
+                        self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        with server._lock:
+                            server.streamed_chunks += 1
+                        time.sleep(reply.get("chunk_delay", 0))
+                    events = [stream_chunk_body(None, model, finish_reason="stop")]
+                    if body.get("stream_options", {}).get("include_usage"):
+                        events.append(dict(stream_chunk_body(None, model), choices=[],
+                                           usage=reply.get("usage", DEFAULT_USAGE)))
+                    for event in events:
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client closed the stream early
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256  # many pooled clients connect at once under load
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def enqueue(self, *replies: dict):
+        with self._lock:
+            self.script.extend(replies)
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
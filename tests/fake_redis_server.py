@@ -0,0 +1,121 @@
+"""
+Minimal local stand-in for a Redis server, used to test the RESP state store over a real socket.
+
+Supports PING, GET, SET (with NX/XX/EX/PX), DEL, RPUSH and LPOP (with a count), with key expiry checked on
+access (lists never expire). EVAL runs only
+the lease scripts of conversation_state (compare-and-renew, compare-and-delete), emulated in Python.
+"""
+import socketserver
+import threading
+import time
+
+from conversation_state import RELEASE_LEASE_SCRIPT, RENEW_LEASE_SCRIPT
+
+
+class FakeRedisServer:
+    def __init__(self):
+        self.data: dict[bytes, tuple[bytes, float | None]] = {}  # key -> (value, expires_at)
+        self.lists: dict[bytes, list[bytes]] = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    args = self._read_command()
+                    if args is None:
+                        return
+                    self.wfile.write(server.execute(args))
+                    self.wfile.flush()
+
+            def _read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int(self.rfile.readline()[1:-2])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def execute(self, args: list) -> bytes:
+        command = args[0].upper()
+        with self._lock:
+            self.commands += 1
+            if command == b"PING":
+                return b"+PONG\r\n"
+            if command == b"GET":
+                value = self._get(args[1])
+                return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            if command == b"SET":
+                return self._set(args[1], args[2], [arg.upper() for arg in args[3:]], args[3:])
+            if command == b"DEL":
+                removed = sum(self.data.pop(key, None) is not None for key in args[1:])
+                return b":%d\r\n" % removed
+            if command == b"RPUSH":
+                values = self.lists.setdefault(args[1], [])
+                values.extend(args[2:])
+                return b":%d\r\n" % len(values)
+            if command == b"LPOP":
+                values = self.lists.get(args[1])
+                if not values:
+                    return b"*-1\r\n"
+                popped, values[:] = values[:int(args[2])], values[int(args[2]):]
+                return b"*%d\r\n" % len(popped) + b"".join(b"$%d\r\n%s\r\n" % (len(v), v) for v in popped)
+            if command == b"EVAL":
+                return self._eval(args[1].decode("utf-8"), args[3], args[4:])
+        return b"-ERR unknown command\r\n"
+
+    def _eval(self, script: str, key: bytes, argv: list) -> bytes:
+        if script not in (RENEW_LEASE_SCRIPT, RELEASE_LEASE_SCRIPT):
+            return b"-ERR unknown script\r\n"
+        if self._get(key) != argv[0]:
+            return b":0\r\n"
+        if script == RELEASE_LEASE_SCRIPT:
+            del self.data[key]
+        else:
+            self.data[key] = (argv[0], time.monotonic() + int(argv[1]) / 1000)
+        return b":1\r\n"
+
+    def _get(self, key: bytes):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self.data[key]
+            return None
+        return value
+
+    def _set(self, key: bytes, value: bytes, options: list, raw: list) -> bytes:
+        exists = self._get(key) is not None
+        if (b"NX" in options and exists) or (b"XX" in options and not exists):
+            return b"$-1\r\n"
+        expires_at = None
+        if b"EX" in options:
+            expires_at = time.monotonic() + int(raw[options.index(b"EX") + 1])
+        if b"PX" in options:
+            expires_at = time.monotonic() + int(raw[options.index(b"PX") + 1]) / 1000
+        self.data[key] = (value, expires_at)
+        return b"+OK\r\n"
+
+    def start(self) -> "FakeRedisServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -23,20 +23,22 @@ def tmp_env(tmp_path, monkeypatch):
     monkeypatch.setenv("OPENAI_API_KEY", "test-key")
     monkeypatch.setenv("TWILIO_AUTH_TOKEN", "fake-token")
 
-    # 2) patch data‑files base‑dir
+    # 2) patch data‑files base‑dir, including the deleted-entries archives
     import assistant as _assistant_mod
-    from storage import storage as _storege_mod
+    import storege as _storege_mod
 
     tmp_dir = str(tmp_path)
-    _assistant_mod.FILE_TASKS_NAME = f"{tmp_dir}/todo_list_{{name}}.json"
-    _assistant_mod.FILE_MESSAGES_NAME = f"{tmp_dir}/chat_log_{{name}}.json"
-    _storege_mod.FILE_LOG_DELETED_LEAD_NAME = f"{tmp_dir}/deleted_tasks_{{name}}.jsonl"
-    _storege_mod.FILE_LOG_DELETED_CHAT_NAME = f"{tmp_dir}/deleted_messages_{{name}}.jsonl"
+    monkeypatch.setattr(_assistant_mod, "FILE_TASKS_NAME", f"{tmp_dir}/todo_list_{{name}}.json")
+    monkeypatch.setattr(_assistant_mod, "FILE_MESSAGES_NAME", f"{tmp_dir}/chat_log_{{name}}.json")
+    monkeypatch.setattr(_storege_mod, "FILE_LOG_DELETED_TASKS_NAME", f"{tmp_dir}/deleted_tasks_{{name}}.jsonl")
+    monkeypatch.setattr(_storege_mod, "FILE_LOG_DELETED_MESSAGES", f"{tmp_dir}/deleted_messages_{{name}}.jsonl")
+    monkeypatch.setattr(_storege_mod.settings, "data_dir", tmp_path)  # shared by every module imported so far
 
     # 3) reload config so settings read the new env
     import importlib, config as _config
 
     importlib.reload(_config)
+    monkeypatch.setattr(_config.settings, "data_dir", tmp_path)
 
     yield tmp_path
 
@@ -68,11 +70,23 @@ def mock_gpt(monkeypatch):
                     return val
         return ""
 
+    async def _fake_ask_async(system_prompt: str, user_input: str, *args, **kwargs) -> str:
+        return _fake_ask(system_prompt, user_input, *args, **kwargs)
+
+    def _fake_ask_stream(system_prompt: str, user_input: str, *args, **kwargs):
+        response = _fake_ask(system_prompt, user_input, *args, **kwargs)
+        for start in range(0, len(response), 3):  # small chunks, like the real stream
+            yield response[start:start + 3]
+
     import gpt_client as _gpt_mod
     import assistant as _assistant_mod
 
     monkeypatch.setattr(_gpt_mod, "ask_gpt", _fake_ask, raising=True)
     monkeypatch.setattr(_assistant_mod, "ask_gpt", _fake_ask, raising=True)
+    monkeypatch.setattr(_gpt_mod, "ask_gpt_async", _fake_ask_async, raising=True)
+    monkeypatch.setattr(_assistant_mod, "ask_gpt_async", _fake_ask_async, raising=True)
+    monkeypatch.setattr(_gpt_mod, "ask_gpt_stream", _fake_ask_stream, raising=True)
+    monkeypatch.setattr(_assistant_mod, "ask_gpt_stream", _fake_ask_stream, raising=True)
 
     return responses
 
@@ -117,22 +131,26 @@ def test_parse_question_intent_with_gpt(assistant_instance, mock_gpt, user_input
 
 
 def test_save_question_success(assistant_instance, mock_gpt):
+    from datetime import date, timedelta
+
     question = "מחר ב‑15:00 פגישה עם אורי"
-    mock_gpt[("היום זה", question)] = (
+    mock_gpt[("אתה מקבל טקסט של משימות", question)] = (
         '[{"description": "פגישה עם אורי", "time": "23/04/2025 15:00"}]'
     )
 
     reply = assistant_instance.save_question(question)
     assert "נשמרו בהצלחה" in reply
 
+    # "מחר ב־15:00" is resolved by the local time parser, not by GPT
+    tomorrow = (date.today() + timedelta(days=1)).strftime("%d/%m/%Y")
     todo_path = assistant_instance._todo_file
     with open(todo_path, encoding="utf-8") as fh:
         data = json.load(fh)
-    assert data == [{"description": "פגישה עם אורי", "time": "23/04/2025 15:00"}]
+    assert data == [{"description": "פגישה עם אורי", "time": f"{tomorrow} 15:00"}]
 
 
 def test_save_question_bad_json_then_retry(assistant_instance, mock_gpt):
-    question = "תזכיר לי לשלם חשבון מחר"
+    question = "תזכיר לי לשלם חשבון"
     mock_gpt[question] = (
         '[{"description":"לשלם חשבון","time":"23/04/2025 09:00"}]'
     )
@@ -165,7 +183,7 @@ def test_delete_task_confirmation_and_yes_flow(assistant_instance, mock_gpt):
     mock_gpt[("אתה מקבל", "מחק 1")] = "מחק משימה"
 
     # ➋ GPT‑Delete Parser
-    mock_gpt[("לפניך רשימת משימות", "מחק 1")] = json.dumps(
+    mock_gpt[("המשתמש ביקש למחוק משימה", "מחק 1")] = json.dumps(
         {"index": 1, "description": "לחם"},
         ensure_ascii=False,
     )
@@ -186,7 +204,7 @@ def test_delete_task_confirmation_no_flow(assistant_instance, mock_gpt):
     mock_gpt[("אתה מקבל", "מחק גבינה")] = "מחק משימה"
 
     # ➋ מיפוי GPT‑Delete Parser
-    mock_gpt[("לפניך רשימת משימות", "מחק גבינה")] = json.dumps(
+    mock_gpt[("המשתמש ביקש למחוק משימה", "מחק גבינה")] = json.dumps(
         {"index": 1, "description": "גבינה"},
         ensure_ascii=False,
     )
@@ -234,7 +252,7 @@ def test_exit_saves_state(assistant_instance, monkeypatch):
 
 
 def test_storage_round_trip(tmp_env):
-    from storage import storage as st
+    import storege as st
 
     f = tmp_env / "sample.json"
     st.save_json_file(str(f), {"k": 1})
@@ -332,3 +350,1987 @@ def test_save_and_load_state_consistency(tmp_env):
 
     a2 = PersonalAssistant.load_state("verify")
     assert a2._todo_list == a1._todo_list
+
+
+# ---------------------------------------------------------------------------
+#  Local intent fast path
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "user_input,intent",
+    [
+        ("הצג משימות", "הצג משימות"),
+        ("תראה לי את כל המשימות", "הצג משימות"),
+        ("מחק 2", "מחק משימה"),
+        ("מחק לחם", "מחק משימה"),
+        ("מחק את כל המשימות", "מחק כל המשימות"),
+        ("איפוס", "איפוס"),
+        ("שמור לקנות חלב מחר", "שמור"),
+    ],
+)
+def test_intent_classifier_rules(user_input, intent):
+    from intent_classifier import IntentClassifier
+
+    assert IntentClassifier().resolve(user_input) == intent
+
+
+def test_intent_classifier_falls_back_and_counts():
+    from intent_classifier import IntentClassifier
+
+    clf = IntentClassifier()
+    assert clf.resolve("מחר ב‑3 פגישה") is None
+    assert clf.resolve("מחק 1") == "מחק משימה"
+    stats = clf.stats()
+    assert stats["local_hits"] == 1 and stats["gpt_fallbacks"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_intent_model_round_trip(tmp_path):
+    from intent_classifier import IntentClassifier, IntentModel
+
+    model = IntentModel.train([
+        ("יש לי פגישה מחר", "שמור"),
+        ("קבעתי תור לרופא", "שמור"),
+        ("מה יש לי לעשות", "הצג משימות"),
+    ])
+    path = str(tmp_path / "intent_model.json")
+    model.save(path)
+
+    clf = IntentClassifier.from_file(path, threshold=0.6)
+    assert clf.classify("יש לי תור מחר")[0] == "שמור"
+    assert IntentModel.load(str(tmp_path / "missing.json")) is None
+
+
+def test_intent_fast_path_skips_gpt(assistant_instance, mock_gpt):
+    # אין תשובה מוגדרת ל-GPT – הסיווג חייב להגיע מהכללים המקומיים
+    assert assistant_instance.parse_question_intent_with_gpt("הצג משימות") == "הצג משימות"
+
+
+# ---------------------------------------------------------------------------
+#  Combined intent + payload extraction
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def gpt_calls(mock_gpt, monkeypatch):
+    """Records the system prompts of every ask_gpt (or ask_gpt_stream) call made by the assistant."""
+    import assistant as _assistant_mod
+
+    calls = []
+    inner = _assistant_mod.ask_gpt
+
+    def _counting_ask(system_prompt, user_input, *args, **kwargs):
+        calls.append(system_prompt)
+        return inner(system_prompt, user_input, *args, **kwargs)
+
+    inner_stream = _assistant_mod.ask_gpt_stream
+
+    def _counting_stream(system_prompt, user_input, *args, **kwargs):
+        calls.append(system_prompt)
+        return inner_stream(system_prompt, user_input, *args, **kwargs)
+
+    monkeypatch.setattr(_assistant_mod, "ask_gpt", _counting_ask)
+    monkeypatch.setattr(_assistant_mod, "ask_gpt_stream", _counting_stream)
+    return calls
+
+
+def test_combined_save_single_gpt_call(assistant_instance, mock_gpt, gpt_calls):
+    question = "יש לי מחר פגישה עם דנה ב-10"
+    mock_gpt[question] = json.dumps(
+        {"intent": "שמור", "tasks": [{"description": "פגישה עם דנה", "time": "24/04/2025 10:00"}],
+         "delete_query": None, "reply": None},
+        ensure_ascii=False,
+    )
+    reply = assistant_instance.process_user_input(question)
+    assert "נשמרו בהצלחה" in reply
+    assert assistant_instance._todo_list == [{"description": "פגישה עם דנה", "time": "24/04/2025 10:00"}]
+    assert len(gpt_calls) == 1
+
+
+def test_combined_delete_single_gpt_call(assistant_instance, mock_gpt, gpt_calls):
+    assistant_instance._todo_list.append({"description": "לקנות חלב", "time": None})
+    question = "את החלב כבר קניתי"
+    mock_gpt[question] = json.dumps(
+        {"intent": "מחק משימה", "tasks": None, "delete_query": "לקנות חלב"},
+        ensure_ascii=False,
+    )
+    ask = assistant_instance.process_user_input(question)
+    assert "האם למחוק" in ask and "לקנות חלב" in ask
+    assert len(gpt_calls) == 1
+    assert "לקנות חלב" not in gpt_calls[0]  # the task list is not part of the prompt
+
+
+def test_combined_non_intent_returns_reply(assistant_instance, mock_gpt):
+    question = "מה שלומך"
+    mock_gpt[question] = json.dumps({"intent": None, "reply": "מצוין, תודה!"}, ensure_ascii=False)
+    assert assistant_instance.process_user_input(question) == "מצוין, תודה!"
+
+
+def test_combined_invalid_payload_falls_back_to_handler(assistant_instance, mock_gpt):
+    question = "צריך להתקשר לאמא"
+    mock_gpt[("אתה מקבל טקסט מהמשתמש, ועליך", question)] = json.dumps({"intent": "שמור", "tasks": "???"}, ensure_ascii=False)
+    intent, payload = assistant_instance.parse_question_with_payload_with_gpt(question)
+    assert intent == "שמור" and payload is None
+
+
+# ---------------------------------------------------------------------------
+#  GPT response cache
+# ---------------------------------------------------------------------------
+
+
+def _fake_openai_client(reply: str):
+    completion = MagicMock()
+    completion.choices = [MagicMock(message=MagicMock(content=reply))]
+    fake = MagicMock()
+    fake.chat.completions.create.return_value = completion
+    return fake
+
+
+def test_cache_key_normalizes_input():
+    from gpt_cache import make_cache_key
+
+    key = make_cache_key("gpt-4o", 0.3, "prompt", "הצג  משימות ")
+    assert key == make_cache_key("gpt-4o", 0.3, "prompt", "הצג משימות")
+    assert key != make_cache_key("gpt-4o", 0.3, "other prompt", "הצג משימות")
+    assert key != make_cache_key("gpt-4o", 0.7, "prompt", "הצג משימות")
+
+
+def test_lru_cache_eviction_and_ttl(monkeypatch):
+    import gpt_cache
+
+    cache = gpt_cache.LRUResponseCache(max_entries=2, ttl_seconds=10)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"  # a becomes most recently used
+    cache.set("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1"
+
+    now = gpt_cache.time.monotonic()
+    monkeypatch.setattr(gpt_cache.time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+def test_sqlite_cache_persists_and_expires(tmp_path, monkeypatch):
+    import gpt_cache
+
+    path = str(tmp_path / "cache.sqlite3")
+    cache = gpt_cache.SQLiteResponseCache(path, ttl_seconds=10)
+    cache.set("k", "הצג משימות")
+    cache.close()
+
+    reopened = gpt_cache.SQLiteResponseCache(path, ttl_seconds=10)
+    assert reopened.get("k") == "הצג משימות"
+    now = gpt_cache.time.time()
+    monkeypatch.setattr(gpt_cache.time, "time", lambda: now + 11)
+    assert reopened.get("k") is None
+
+
+def test_ask_gpt_uses_cache_unless_volatile(tmp_env, monkeypatch):
+    import gpt_client as gc
+    from gpt_cache import LRUResponseCache
+
+    fake = _fake_openai_client("הצג משימות")
+    monkeypatch.setattr(gc, "_client", fake)
+    monkeypatch.setattr(gc, "response_cache", LRUResponseCache())
+
+    assert gc.ask_gpt("prompt", "הצג משימות") == "הצג משימות"
+    assert gc.ask_gpt("prompt", "הצג משימות") == "הצג משימות"
+    assert fake.chat.completions.create.call_count == 1
+
+    gc.ask_gpt("היום זה 2025-04-22", "שמור חלב", cacheable=False)
+    gc.ask_gpt("היום זה 2025-04-22", "שמור חלב", cacheable=False)
+    assert fake.chat.completions.create.call_count == 3
+
+
+# ---------------------------------------------------------------------------
+#  Async request path
+# ---------------------------------------------------------------------------
+
+
+def test_process_user_input_async_save(assistant_instance, mock_gpt):
+    import asyncio
+
+    question = "שמור לקנות חלב"
+    mock_gpt[("אתה מקבל טקסט של משימות", question)] = '[{"description": "לקנות חלב", "time": "23/04/2025 09:00"}]'
+
+    reply = asyncio.run(assistant_instance.process_user_input_async(question))
+    assert "נשמרו בהצלחה" in reply
+    assert assistant_instance._todo_list == [{"description": "לקנות חלב", "time": "23/04/2025 09:00"}]
+
+
+def test_process_user_input_async_delete_confirmation(assistant_instance, mock_gpt):
+    import asyncio
+
+    assistant_instance._todo_list.append({"description": "לחם", "time": None})
+    mock_gpt[("המשתמש ביקש למחוק משימה", "מחק לחם")] = json.dumps({"index": 1, "description": "לחם"}, ensure_ascii=False)
+
+    ask = asyncio.run(assistant_instance.process_user_input_async("מחק לחם"))
+    assert "האם למחוק" in ask
+    assert "נמחקה" in asyncio.run(assistant_instance.process_user_input_async("כן"))
+    assert not assistant_instance._todo_list
+
+
+def test_async_webhook_serves_users_concurrently(tmp_env, monkeypatch):
+    import asyncio
+    import time
+    from aiohttp.test_utils import TestClient, TestServer
+    import async_whatsapp_server as aws
+
+    class SlowAssistant:
+        async def process_user_input_async(self, question):
+            await asyncio.sleep(0.2)
+            return f"pong {question}"
+
+    from session_store import SessionManager
+
+    monkeypatch.setattr(aws, "user_sessions", SessionManager(loader=lambda name: SlowAssistant()))
+
+    async def _run():
+        async with TestClient(TestServer(aws.create_app())) as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/whatsapp", data={"Body": str(i), "From": f"whatsapp:+9725{i:05d}"})
+                for i in range(50)
+            ])
+            elapsed = time.perf_counter() - start
+            texts = [await r.text() for r in responses]
+        return elapsed, responses, texts
+
+    elapsed, responses, texts = asyncio.run(_run())
+    assert all(r.status == 200 for r in responses)
+    assert "pong 7" in texts[7]
+    assert elapsed < 2  # 50 × 0.2s would take 10s if handled serially
+
+
+def test_async_sessions_stay_pinned_and_locks_are_dropped(monkeypatch):
+    import asyncio
+    import async_whatsapp_server as aws
+    from session_store import SessionManager
+
+    saved = []
+
+    class SlowAssistant:
+        def __init__(self, name):
+            self.name = name
+            self.busy = 0
+
+        async def process_user_input_async(self, question):
+            self.busy += 1
+            await asyncio.sleep(0.05)
+            self.busy -= 1
+            return question
+
+        def save_state(self):
+            saved.append((self.name, self.busy))
+
+    sessions = SessionManager(loader=SlowAssistant, max_sessions=1)
+    monkeypatch.setattr(aws, "user_sessions", sessions)
+
+    async def _run():
+        return await asyncio.gather(*[aws.process_message(f"u{i % 5}", str(i)) for i in range(20)])
+
+    assert asyncio.run(_run()) == [str(i) for i in range(20)]
+    sessions.evict_idle()
+    # Five users with a limit of one: sessions are evicted, but never while a message of theirs runs
+    assert saved and all(busy == 0 for _, busy in saved)
+    assert aws._session_locks == {}
+
+
+# ---------------------------------------------------------------------------
+#  Background processing with outbound replies
+# ---------------------------------------------------------------------------
+
+
+def test_worker_pool_replies_in_order_per_user():
+    from background_worker import WebhookWorkerPool
+    from message_sender import FakeMessageSender
+
+    sender = FakeMessageSender()
+    pool = WebhookWorkerPool(lambda number, text: f"{number}:{text}", sender, workers=3)
+    for i in range(20):
+        pool.submit("whatsapp:+1", "+1", str(i))
+        pool.submit("whatsapp:+2", "+2", str(i))
+    pool.join()
+    pool.stop(1)
+
+    assert sender.messages_to("whatsapp:+1") == [f"+1:{i}" for i in range(20)]
+    assert sender.messages_to("whatsapp:+2") == [f"+2:{i}" for i in range(20)]
+
+
+def test_worker_pool_sends_error_reply_on_failure():
+    from background_worker import ERROR_REPLY, WebhookWorkerPool
+    from message_sender import FakeMessageSender
+
+    def _boom(number, text):
+        raise RuntimeError("gpt down")
+
+    sender = FakeMessageSender()
+    pool = WebhookWorkerPool(_boom, sender, workers=1)
+    pool.submit("whatsapp:+1", "+1", "שלום")
+    pool.join()
+    pool.stop(1)
+    assert sender.sent == [("whatsapp:+1", ERROR_REPLY)]
+
+
+def test_whatsapp_webhook_background_ack(flask_client, monkeypatch):
+    import whatsapp_server as ws
+    from background_worker import WebhookWorkerPool
+    from message_sender import FakeMessageSender
+
+    sender = FakeMessageSender()
+    pool = WebhookWorkerPool(ws.process_message, sender, workers=2)
+    monkeypatch.setattr(ws, "worker_pool", pool)
+    monkeypatch.setattr(ws.settings, "webhook_background_processing", True)
+
+    rv = flask_client.post("/whatsapp", data={"Body": "שלום", "From": "whatsapp:+972555"})
+    assert rv.status_code == 200
+    assert "<Message>" not in rv.text
+
+    pool.join()
+    pool.stop(1)
+    assert sender.sent == [("whatsapp:+972555", "pong")]
+
+
+# ---------------------------------------------------------------------------
+#  Bounded session store
+# ---------------------------------------------------------------------------
+
+
+class _FakeSession:
+    def __init__(self, name, saved):
+        self.name = name
+        self._saved = saved
+        self._messages = [{"role": "system", "content": "x" * 100}]
+        self._todo_list = []
+
+    def save_state(self):
+        self._saved.append(self.name)
+
+
+def test_session_manager_lru_eviction_flushes_and_rehydrates():
+    from session_store import SessionManager
+
+    saved, loaded = [], []
+
+    def _load(name):
+        loaded.append(name)
+        return _FakeSession(name, saved)
+
+    sessions = SessionManager(loader=_load, max_sessions=2)
+    a = sessions.get("a")
+    sessions.get("b")
+    assert sessions.get("a") is a  # resident – no reload, "a" is now most recent
+    sessions.get("c")  # evicts "b", the least recently used
+
+    assert saved == ["b"]
+    assert "b" not in sessions and "a" in sessions
+    sessions.get("b")
+    assert loaded == ["a", "b", "c", "b"]
+
+    metrics = sessions.metrics()
+    assert metrics["resident_sessions"] == 2
+    assert metrics["evictions"] == 2
+    assert metrics["rehydrations"] == 4
+
+
+def test_session_manager_idle_ttl_and_memory_budget():
+    from session_store import SessionManager
+
+    now = [0.0]
+    saved = []
+    sessions = SessionManager(loader=lambda name: _FakeSession(name, saved), idle_ttl_seconds=60,
+                              clock=lambda: now[0])
+    sessions.get("old")
+    now[0] = 120
+    sessions.get("new")
+    assert saved == ["old"] and len(sessions) == 1
+
+    budget = SessionManager(loader=lambda name: _FakeSession(name, saved), memory_budget_bytes=2000,
+                            size_of=lambda session: 1000)
+    for name in ("x", "y", "z"):
+        budget.get(name)
+    assert len(budget) == 2 and "x" not in budget
+
+
+def test_session_manager_flush_all():
+    from session_store import SessionManager
+
+    saved = []
+    sessions = SessionManager(loader=lambda name: _FakeSession(name, saved))
+    sessions.get("a")
+    sessions.get("b")
+    sessions.flush_all()
+    assert sorted(saved) == ["a", "b"]
+
+
+# ---------------------------------------------------------------------------
+#  Per-user serialization under concurrency
+# ---------------------------------------------------------------------------
+
+
+def test_concurrent_messages_lose_no_updates(tmp_env, mock_gpt, monkeypatch):
+    """Fires concurrent saves for several users and checks every task and chat entry survives."""
+    from concurrent.futures import ThreadPoolExecutor
+    import whatsapp_server as ws
+    from assistant import PersonalAssistant
+    from session_store import SessionManager
+
+    import time
+    import storage_backends as _backends_mod
+
+    def _chunked_save(path, data):
+        # Writes in small chunks and yields the GIL, so unsynchronized writers interleave
+        text = json.dumps(data, ensure_ascii=False)
+        with open(path, "w", encoding="utf-8") as fh:
+            for start in range(0, len(text), 8):
+                fh.write(text[start:start + 8])
+                fh.flush()
+                time.sleep(0)
+
+    monkeypatch.setattr(_backends_mod, "save_json_file", _chunked_save)
+    monkeypatch.setattr(ws, "user_sessions", SessionManager(loader=lambda name: PersonalAssistant.load_state(name)))
+    users = [f"+97250000{i}" for i in range(4)]
+    per_user = 25
+    jobs = []
+    for user in users:
+        for i in range(per_user):
+            question = f"שמור משימה {user} {i}"
+            mock_gpt[("אתה מקבל טקסט של משימות", question)] = json.dumps(
+                [{"description": f"משימה {i}", "time": None}], ensure_ascii=False
+            )
+            jobs.append((user, question))
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        replies = list(pool.map(lambda job: ws.process_message(*job), jobs))
+    assert all("נשמרו בהצלחה" in reply for reply in replies)
+
+    for user in users:
+        assistant = ws.user_sessions.get(user)
+        assert len(assistant._todo_list) == per_user
+        assert len(assistant._messages) == 1 + 2 * per_user
+        with open(assistant._todo_file, encoding="utf-8") as fh:
+            assert len(json.load(fh)) == per_user
+
+
+def test_session_lock_serializes_same_user_only():
+    import threading
+    import time
+    from session_store import SessionManager
+
+    sessions = SessionManager(loader=lambda name: {"name": name})
+    active, peak = {"a": 0, "b": 0}, {"a": 0, "b": 0}
+    guard = threading.Lock()
+
+    def _work(name):
+        with sessions.session(name):
+            with guard:
+                active[name] += 1
+                peak[name] = max(peak[name], active[name])
+            time.sleep(0.01)
+            with guard:
+                active[name] -= 1
+
+    threads = [threading.Thread(target=_work, args=(name,)) for name in "ab" * 10]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == {"a": 1, "b": 1}
+    assert sessions.metrics()["rehydrations"] == 2
+
+
+# ---------------------------------------------------------------------------
+#  SQLite storage backend
+# ---------------------------------------------------------------------------
+
+
+def test_sqlite_storage_row_level_operations(tmp_path):
+    from storage_backends import SQLiteDatabase, SQLiteUserStorage
+
+    db = SQLiteDatabase(str(tmp_path / "assistant.sqlite3"))
+    bob, alice = SQLiteUserStorage(db, "bob"), SQLiteUserStorage(db, "alice")
+
+    tasks = [{"description": "חלב", "time": None}, {"description": "לחם", "time": "01/05/2025 10:00"}]
+    bob.add_tasks(tasks, tasks)
+    alice.add_tasks([{"description": "גבינה", "time": None}], [])
+    assert bob.load_tasks() == tasks
+
+    bob.delete_task(0, tasks[0], tasks[1:])
+    assert bob.load_tasks() == tasks[1:]
+    assert alice.load_tasks() == [{"description": "גבינה", "time": None}]
+    deleted = db.connect().execute("SELECT data FROM deleted_tasks WHERE user = 'bob'").fetchall()
+    assert [json.loads(row[0]) for row in deleted] == [tasks[0]]
+    assert bob.has_task("לחם", "01/05/2025 10:00") and not alice.has_task("לחם", "01/05/2025 10:00")
+
+    assert bob.load_messages() is None
+    history = [{"role": "system", "content": "s"}, {"role": "user", "content": "היי"}]
+    bob.append_messages(history)
+    bob.append_messages([{"role": "assistant", "content": "שלום"}])
+    assert bob.load_messages() == history + [{"role": "assistant", "content": "שלום"}]
+    assert bob.load_messages(limit=1) == [history[0], {"role": "assistant", "content": "שלום"}]
+    bob.replace_messages([])
+    assert bob.load_messages() is None
+
+
+def test_assistant_with_sqlite_storage_round_trip(tmp_env, mock_gpt):
+    from assistant import PersonalAssistant
+    from storage_backends import SQLiteDatabase, SQLiteUserStorage
+
+    db = SQLiteDatabase(str(tmp_env / "assistant.sqlite3"))
+    question = "שמור פגישה עם אורי"
+    mock_gpt[("אתה מקבל טקסט של משימות", question)] = '[{"description": "פגישה עם אורי", "time": "23/04/2025 15:00"}]'
+
+    a1 = PersonalAssistant("sq", storage=SQLiteUserStorage(db, "sq"))
+    serialized = []
+    a1._todo_list.to_dicts = lambda: serialized.append(1)  # row-level writes never serialize the whole list
+    a1.process_user_input(question)
+    assert not serialized
+    del a1._todo_list.to_dicts
+
+    storage = SQLiteUserStorage(db, "sq")
+    assert storage.load_tasks() == a1._todo_list == [{"description": "פגישה עם אורי", "time": "23/04/2025 15:00"}]
+    stored = storage.load_messages()
+    assert stored[0]["role"] == "system"
+    assert [m["content"] for m in stored[1:]] == [question, "1 משימות נשמרו בהצלחה. איך עוד אפשר לעזור?"]
+
+
+def test_migrate_json_files_to_sqlite(tmp_path):
+    from migrate_to_sqlite import migrate
+    from storage_backends import SQLiteDatabase, SQLiteUserStorage
+
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    tasks = [{"description": "חלב", "time": None}]
+    messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "היי"}]
+    (data_dir / "todo_list_+972500.json").write_text(json.dumps(tasks, ensure_ascii=False), encoding="utf-8")
+    (data_dir / "chat_log_+972500.json").write_text(json.dumps(messages, ensure_ascii=False), encoding="utf-8")
+    (data_dir / "deleted_tasks_+972500.jsonl").write_text('{"description": "לחם"}\n{"description": "ביצים"}\n',
+                                                         encoding="utf-8")
+
+    db_path = str(tmp_path / "assistant.sqlite3")
+    counts = migrate(str(data_dir), db_path)
+    migrate(str(data_dir), db_path)  # running twice must not duplicate anything
+    assert counts == {"users": 1, "tasks": 1, "messages": 2, "deleted_tasks": 2, "deleted_messages": 0}
+
+    storage = SQLiteUserStorage(SQLiteDatabase(db_path), "+972500")
+    assert storage.load_tasks() == tasks
+    assert storage.load_messages() == messages
+    (count,) = SQLiteDatabase(db_path).connect().execute("SELECT COUNT(*) FROM deleted_tasks").fetchone()
+    assert count == 2
+
+
+# ---------------------------------------------------------------------------
+#  Atomic writes and write coalescing
+# ---------------------------------------------------------------------------
+
+
+def test_save_json_file_is_atomic(tmp_env):
+    import storege
+
+    path = tmp_env / "todo.json"
+    storege.save_json_file(str(path), [{"description": "חלב"}], fsync=True)
+    with pytest.raises(TypeError):
+        storege.save_json_file(str(path), [{"description": object()}])  # fails mid-serialization
+
+    assert storege.load_json_file(str(path)) == [{"description": "חלב"}]
+    assert [p.name for p in tmp_env.iterdir() if p.name.endswith(".tmp")] == []
+
+
+def test_write_coalescer_batches_burst_into_one_write():
+    import storege
+
+    writes = []
+    coalescer = storege.WriteCoalescer(window_seconds=0.05, writer=lambda path, data: writes.append((path, data)))
+    tasks = []
+    for i in range(10):
+        tasks.append(i)
+        coalescer.schedule("todo_a.json", tasks)
+    coalescer.schedule("todo_b.json", ["b"])
+
+    import time
+    deadline = time.monotonic() + 2
+    while len(writes) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    coalescer.close()
+    assert sorted(writes, key=lambda w: w[0]) == [("todo_a.json", list(range(10))), ("todo_b.json", ["b"])]
+
+
+def test_write_coalescer_flush_before_read(tmp_path):
+    import storege
+    from storage_backends import JsonUserStorage
+
+    coalescer = storege.WriteCoalescer(window_seconds=60)
+    storage = JsonUserStorage("u", str(tmp_path / "todo.json"), str(tmp_path / "chat.json"), coalescer=coalescer)
+    storage.ensure_files()
+    storage.add_tasks([{"description": "x"}], [{"description": "x"}])
+    assert storege.load_json_file(str(tmp_path / "todo.json")) == []  # still pending
+    assert storage.load_tasks() == [{"description": "x"}]  # reads flush their path first
+
+    storage.save_tasks([{"description": "y"}])
+    coalescer.close()  # shutdown writes everything that is pending
+    assert storege.load_json_file(str(tmp_path / "todo.json")) == [{"description": "y"}]
+
+
+def test_write_coalescer_flush_waits_for_a_write_in_flight():
+    import threading
+    import storege
+
+    writes = []
+    coalescer = storege.WriteCoalescer(window_seconds=0.01, writer=lambda path, data: writes.append(data))
+    started, release = threading.Event(), threading.Event()
+    write = coalescer._write
+
+    def slow_write(path, version, data):  # taken off the pending map, not written yet
+        started.set()
+        release.wait(5)
+        write(path, version, data)
+
+    coalescer._write = slow_write
+    coalescer.schedule("todo.json", ["x"])
+    assert started.wait(2)
+    flushed = threading.Thread(target=coalescer.flush, args=("todo.json",))
+    flushed.start()
+    flushed.join(0.1)
+    assert flushed.is_alive() and not writes
+    release.set()
+    flushed.join(2)
+    assert not flushed.is_alive() and writes == [["x"]]
+    coalescer.close()
+
+
+# ---------------------------------------------------------------------------
+#  Append-only chat log
+# ---------------------------------------------------------------------------
+
+
+def test_read_jsonl_tail_reads_from_the_end(tmp_path):
+    import storege
+
+    path = str(tmp_path / "log.jsonl")
+    storege.save_jsonl_file(path, [{"i": i, "text": "שלום" * i} for i in range(300)])
+    assert [e["i"] for e in storege.read_jsonl_tail(path, 3, block_size=64)] == [297, 298, 299]
+    assert len(storege.read_jsonl_tail(path, 1000)) == 300
+    assert storege.read_jsonl_head(path) == {"i": 0, "text": ""}
+
+
+def test_chat_history_is_appended_not_rewritten(tmp_env, mock_gpt, monkeypatch):
+    import storage_backends
+    from assistant import PersonalAssistant
+
+    a = PersonalAssistant(name="chat")
+    a.keep_chat_history("היי", "שלום")
+    rewrites = []
+    monkeypatch.setattr(storage_backends, "save_jsonl_file", lambda *args, **kwargs: rewrites.append(args))
+    a.keep_chat_history("מה נשמע?", "הכל טוב")
+    a.save_state()
+    assert rewrites == []
+
+    with open(a._chat_file, encoding="utf-8") as fh:
+        lines = [json.loads(line) for line in fh]
+    assert [m["role"] for m in lines] == ["system", "user", "assistant", "user", "assistant"]
+
+
+def test_load_state_reads_only_the_tail(tmp_env, mock_gpt, monkeypatch):
+    import assistant as _assistant_mod
+    from assistant import PersonalAssistant
+
+    a = PersonalAssistant(name="long")
+    for i in range(100):
+        a.keep_chat_history(f"שאלה {i}", f"תשובה {i}")
+
+    monkeypatch.setattr(_assistant_mod.settings, "chat_context_messages", 4)
+    b = PersonalAssistant.load_state("long")
+    assert b._messages[0]["role"] == "system"
+    assert [m["content"] for m in b._messages[1:]] == ["שאלה 98", "תשובה 98", "שאלה 99", "תשובה 99"]
+
+    b.keep_chat_history("עוד", "אחת")
+    with open(b._chat_file, encoding="utf-8") as fh:
+        assert sum(1 for _ in fh) == 1 + 2 * 101
+
+
+def test_legacy_json_chat_log_is_converted(tmp_path, monkeypatch):
+    import builtins
+    from storage_backends import JsonUserStorage
+
+    real_open = builtins.open
+
+    legacy = tmp_path / "chat_log_u.json"
+    legacy.write_text(json.dumps([{"role": "system", "content": "s"}, {"role": "user", "content": "היי"}],
+                                 ensure_ascii=False), encoding="utf-8")
+    storage = JsonUserStorage("u", str(tmp_path / "todo.json"), str(tmp_path / "chat_log_u.jsonl"))
+    assert storage.load_messages() == [{"role": "system", "content": "s"}, {"role": "user", "content": "היי"}]
+    assert not legacy.exists()
+
+    read_opens = []
+    monkeypatch.setattr("builtins.open", lambda file, mode="r", *args, **kwargs:
+                        (mode == "r" and read_opens.append(file)) or real_open(file, mode, *args, **kwargs))
+    for _ in range(3):
+        storage.append_messages([{"role": "user", "content": "עוד"}])
+    assert not read_opens  # the format is not checked again on appends
+
+
+def test_clear_messages_archives_the_whole_stored_log(tmp_env, mock_gpt, monkeypatch):
+    import assistant as _assistant_mod
+    from assistant import PersonalAssistant
+    from storage_backends import SQLiteDatabase, SQLiteUserStorage
+
+    monkeypatch.setattr(_assistant_mod.settings, "chat_context_messages", 4)
+    db = SQLiteDatabase(str(tmp_env / "archive.sqlite3"))
+    for storage in (None, SQLiteUserStorage(db, "long")):
+        a = PersonalAssistant(name="long", storage=storage)
+        for i in range(50):
+            a.keep_chat_history(f"שאלה {i}", f"תשובה {i}")
+        b = PersonalAssistant.load_state("long") if storage is None else PersonalAssistant(
+            name="long", storage=storage, messages=storage.load_messages(limit=4), persisted_messages=5)
+        b._messages.append({"role": "user", "content": "לא נשמר עדיין"})
+        b.clear_messages()
+
+        if storage is None:
+            with open(tmp_env / "deleted_messages_long.jsonl", encoding="utf-8") as fh:
+                archived = [json.loads(line) for line in fh]
+            assert len(archived) == 1
+        else:
+            archived = [json.loads(row[0]) for row in
+                        db.connect().execute("SELECT data FROM deleted_messages WHERE user = 'long'")]
+        messages = archived[-1]["task"]
+        assert len(messages) == 1 + 2 * 50 + 1
+        assert messages[1]["content"] == "שאלה 0" and messages[-1]["content"] == "לא נשמר עדיין"
+        assert (storage or b._storage).load_messages() is None
+
+
+def test_torn_jsonl_line_is_skipped_and_next_append_starts_fresh(tmp_env):
+    import storege as st
+    from storage_backends import JsonUserStorage
+
+    chat = tmp_env / "chat_log_u.jsonl"
+    chat.write_text('{"role": "system", "content": "s"}\n{"role": "user", "cont', encoding="utf-8")
+    storage = JsonUserStorage("u", str(tmp_env / "todo.json"), str(chat))
+    assert storage.load_messages() == [{"role": "system", "content": "s"}]
+    assert storage.load_messages(limit=1) == [{"role": "system", "content": "s"}]
+
+    storage.append_messages([{"role": "user", "content": "היי"}])
+    assert storage.load_messages(limit=1) == [{"role": "system", "content": "s"}, {"role": "user", "content": "היי"}]
+    assert len(st.read_jsonl_file(str(chat))) == 2
+
+
+# ---------------------------------------------------------------------------
+#  Token-budgeted context window
+# ---------------------------------------------------------------------------
+
+
+def test_count_tokens_is_local_estimate():
+    from context_window import count_tokens
+
+    assert count_tokens("") == 0
+    assert count_tokens("שלום, עולם!") == 2 + 1 + 2 + 1
+    assert count_tokens("a" * 30) == 10
+
+
+def test_context_window_folds_old_turns_into_summary():
+    from context_window import SUMMARY_HEADER, ContextWindow, message_tokens
+
+    window = ContextWindow(max_tokens=60, summary_max_tokens=40)
+    messages = [{"role": "system", "content": "s"}]
+    for i in range(20):
+        messages += [{"role": "user", "content": f"שאלה מספר {i}"}, {"role": "assistant", "content": f"תשובה {i}"}]
+
+    removed, summary = window.trim(messages, "", foldable=len(messages))
+    assert removed > 0
+    assert messages[0]["content"] == "s"
+    assert messages[-1]["content"] == "תשובה 19"
+    assert sum(message_tokens(m) for m in messages[1:]) <= 60
+    assert summary.startswith(SUMMARY_HEADER)
+    assert "- משתמש: שאלה מספר" in summary
+    # The summary keeps the most recent folded lines within its own budget
+    assert "שאלה מספר 0" not in summary
+
+    assert window.trim(messages, summary, foldable=len(messages)) == (0, summary)
+
+
+def test_context_window_only_folds_persisted_messages():
+    from context_window import ContextWindow
+
+    window = ContextWindow(max_tokens=1)
+    messages = [{"role": "user", "content": "א"}, {"role": "assistant", "content": "ב"},
+                {"role": "user", "content": "ג"}, {"role": "assistant", "content": "ד"}]
+    removed, _ = window.trim(messages, "", foldable=1)
+    assert removed == 1
+    assert [m["content"] for m in messages] == ["ב", "ג", "ד"]
+
+
+def test_assistant_memory_stays_bounded(tmp_env, mock_gpt, monkeypatch):
+    import assistant as _assistant_mod
+    from assistant import PersonalAssistant
+
+    monkeypatch.setattr(_assistant_mod.settings, "context_max_tokens", 100)
+    a = PersonalAssistant(name="veteran")
+    for i in range(200):
+        a.keep_chat_history(f"שאלה ארוכה מאוד מספר {i}", f"תשובה ארוכה מאוד מספר {i}")
+
+    assert len(a._messages) < 20
+    context = a.context_messages()
+    assert context[1]["content"].startswith("סיכום השיחה")
+    assert context[-1]["content"] == "תשובה ארוכה מאוד מספר 199"
+    assert len(a.process_user_input("בקרה")) < 3000
+
+    # The full history is still in the chat log
+    with open(a._chat_file, encoding="utf-8") as fh:
+        assert sum(1 for _ in fh) == 1 + 2 * 200
+    b = PersonalAssistant.load_state("veteran")
+    assert len(b._messages) < 20
+    b.keep_chat_history("עוד", "אחת")
+    with open(b._chat_file, encoding="utf-8") as fh:
+        assert sum(1 for _ in fh) == 1 + 2 * 201
+
+
+# ---------------------------------------------------------------------------
+#  Task store
+# ---------------------------------------------------------------------------
+
+
+def test_task_store_round_trips_task_dicts():
+    from task_store import TaskStore
+
+    raw = [
+        {"description": "פגישה עם דנה", "time": "24/04/2025 10:00"},
+        {"description": "לקנות חלב", "time": None},
+        {"description": "בלי זמן"},
+        {"description": "עם שדה נוסף", "time": "מחר", "priority": "high"},
+    ]
+    store = TaskStore(raw)
+    assert store.to_dicts() == raw
+    assert store == raw and raw == store
+    assert store[0].due.hour == 10
+    assert store[1].due is None and store[3].due is None
+    assert store[2].normalized == "בלי זמן"
+
+
+def test_task_store_delete_by_id_and_position():
+    from task_store import TaskStore
+
+    store = TaskStore([{"description": f"משימה {i}", "time": f"0{i}/05/2025 09:00"} for i in range(1, 6)])
+    third = store[2]
+    assert store.position(third.id) == 2
+    assert store.delete(third.id) is third
+    assert store.get(third.id) is None and store.position(third.id) == -1
+    assert store.pop(0) == {"description": "משימה 1", "time": "01/05/2025 09:00"}
+    assert [task.description for task in store] == ["משימה 2", "משימה 4", "משימה 5"]
+    with pytest.raises(IndexError):
+        store.pop(3)
+    with pytest.raises(KeyError):
+        store.delete(third.id)
+    store.add({"description": "חדשה"})
+    assert store[-1].id > store[-2].id and store.position(store[-1].id) == 3
+
+
+def test_task_store_due_within():
+    from datetime import datetime
+    from task_store import TaskStore
+
+    store = TaskStore([
+        {"description": "מאוחר", "time": "02/05/2025 18:00"},
+        {"description": "בקרוב", "time": "01/05/2025 10:30"},
+        {"description": "עבר", "time": "01/05/2025 08:00"},
+        {"description": "טקסט חופשי", "time": "מחר"},
+        {"description": "גם בקרוב", "time": "01/05/2025 12:00"},
+    ])
+    now = datetime(2025, 5, 1, 9, 0)
+    assert [task.description for task in store.due_within(4, now=now)] == ["בקרוב", "גם בקרוב"]
+    assert len(store.due_within(48, now=now)) == 3
+    store.delete(store[1].id)
+    assert [task.description for task in store.due_within(4, now=now)] == ["גם בקרוב"]
+
+    many = TaskStore([{"description": f"משימה {i}", "time": f"01/05/2025 {i % 24:02d}:00"} for i in range(200)])
+    for task in list(many)[:150]:
+        many.delete(task.id)
+    assert len(many._due) < 200  # the stale entries were dropped once they were the majority
+    assert len(many.due_between(datetime(2025, 5, 1), datetime(2025, 5, 2))) == 50
+    store.clear()
+    assert store.due_within(48, now=now) == [] and not store
+
+
+# ---------------------------------------------------------------------------
+#  Local delete matcher
+# ---------------------------------------------------------------------------
+
+
+def test_normalize_hebrew_and_prefixes():
+    from task_matcher import content_words, normalize_hebrew
+
+    assert normalize_hebrew("לֶחֶם!") == "לחמ"
+    assert content_words("ולהחליף את הנורה") == ["החליפ", "את", "נורה"]
+    assert content_words("מחק את החלב", {"מחק", "את"}) == ["חלב"]
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("מחק 2", {"index": 2, "description": "פגישה עם יוסי"}),
+    ("תמחק את משימה מספר 3", {"index": 3, "description": "לקנות חלב"}),
+    ("מחק את הפגישה עם דנה", {"index": 1, "description": "פגישה עם דנה"}),
+    ("תמחק את החלב", {"index": 3, "description": "לקנות חלב"}),
+    ("מחק 7", None),
+])
+def test_match_delete_target_resolves_locally(question, expected):
+    from task_matcher import match_delete_target
+    from task_store import TaskStore
+
+    store = TaskStore([{"description": "פגישה עם דנה", "time": None},
+                       {"description": "פגישה עם יוסי", "time": None},
+                       {"description": "לקנות חלב", "time": None}])
+    target, _ = match_delete_target(question, store)
+    assert target == expected
+
+
+def test_ambiguous_delete_sends_only_shortlist(assistant_instance, mock_gpt, gpt_calls):
+    assistant_instance._todo_list.extend([{"description": f"משימה כללית {i}", "time": None} for i in range(40)])
+    assistant_instance._todo_list.extend([{"description": "להתקשר לאמא", "time": None},
+                                          {"description": "להתקשר לאבא", "time": None}])
+    mock_gpt[("המשתמש ביקש למחוק משימה", "מחק להתקשר")] = json.dumps({"index": 42, "description": "להתקשר לאבא"},
+                                                              ensure_ascii=False)
+
+    ask = assistant_instance.ensure_delete_intent("מחק להתקשר")
+    assert "להתקשר לאבא" in ask and "#42" in ask
+    assert len(gpt_calls) == 1
+    assert "להתקשר לאמא" in gpt_calls[0] and "משימה כללית" not in gpt_calls[0]
+
+
+def test_clear_delete_match_needs_no_gpt(assistant_instance, mock_gpt, gpt_calls):
+    assistant_instance._todo_list.extend([{"description": "לקנות לחם", "time": None},
+                                          {"description": "לשלם חשבון חשמל", "time": None}])
+    ask = assistant_instance.ensure_delete_intent("מחק את החשבון חשמל")
+    assert "לשלם חשבון חשמל" in ask and "#2" in ask
+    assert gpt_calls == []
+
+
+def test_gpt_delete_answer_outside_shortlist_is_rejected(assistant_instance, mock_gpt):
+    assistant_instance._todo_list.extend([{"description": "להתקשר לאמא", "time": None},
+                                          {"description": "להתקשר לאבא", "time": None}])
+    mock_gpt[("המשתמש ביקש למחוק משימה", "מחק להתקשר")] = json.dumps({"index": 9, "description": "משהו"},
+                                                              ensure_ascii=False)
+    assert assistant_instance.resolve_delete_target("מחק להתקשר") is None
+
+
+# ---------------------------------------------------------------------------
+#  Local Hebrew time parser
+# ---------------------------------------------------------------------------
+
+
+def _time_corpus():
+    import benchmark_time_parser
+
+    return benchmark_time_parser.load_corpus(benchmark_time_parser.DEFAULT_CORPUS)
+
+
+@pytest.mark.parametrize("case", _time_corpus(), ids=lambda case: case["text"])
+def test_hebrew_time_corpus(case):
+    from datetime import datetime
+    from hebrew_time import extract_task
+
+    task = extract_task(case["text"], datetime.fromisoformat(case["now"]))
+    assert task == (case["tasks"][0] if case["local"] else None)
+
+
+def test_hebrew_time_hour_only_rolls_to_tomorrow():
+    from datetime import datetime
+    from hebrew_time import parse_hebrew_time
+
+    now = datetime(2025, 4, 22, 20, 0)
+    assert parse_hebrew_time("ריצה ב-9", now).format() == "23/04/2025 09:00"
+    assert parse_hebrew_time("ב-21:30 סרט", now).format() == "22/04/2025 21:30"
+    assert parse_hebrew_time("לקנות חלב", now) is None
+    assert parse_hebrew_time("מחר ומחרתיים", now) is None
+
+
+def test_simple_save_needs_no_gpt(assistant_instance, mock_gpt, gpt_calls):
+    from datetime import date, timedelta
+
+    reply = assistant_instance.process_user_input("שמור לקנות חלב מחר ב-9")
+    assert "נשמרו בהצלחה" in reply
+    tomorrow = (date.today() + timedelta(days=1)).strftime("%d/%m/%Y")
+    assert assistant_instance._todo_list == [{"description": "לקנות חלב", "time": f"{tomorrow} 09:00"}]
+    assert gpt_calls == []
+
+
+def test_benchmark_reports_local_accuracy():
+    import benchmark_time_parser
+
+    result = benchmark_time_parser.evaluate_local(_time_corpus(), repeat=1)
+    assert result["accuracy"] == 1.0 and result["false_positives"] == 0
+    assert result["coverage"] > 0.5
+
+
+# ---------------------------------------------------------------------------
+#  GPT resilience (against a local fake OpenAI server)
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Points gpt_client at a local fake OpenAI server with fast retry settings."""
+    from openai import AsyncOpenAI, OpenAI
+    import gpt_client as gc
+    from fake_openai_server import FakeOpenAIServer
+    from gpt_resilience import CircuitBreaker, ResilientCaller, RetryPolicy
+
+    server = FakeOpenAIServer().start()
+    monkeypatch.setattr(gc, "_client", OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+    monkeypatch.setattr(gc, "_async_client", AsyncOpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+    monkeypatch.setattr(gc, "response_cache", None)
+    monkeypatch.setattr(gc, "resilience", ResilientCaller(
+        policy=RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.05),
+        breaker=CircuitBreaker(failure_threshold=5, reset_seconds=60),
+        deadline_seconds=5, attempt_timeout_seconds=0.5,
+    ))
+    yield server
+    server.stop()
+
+
+def test_ask_gpt_retries_429_and_5xx(fake_openai):
+    import gpt_client as gc
+
+    fake_openai.enqueue({"status": 429, "headers": {"Retry-After": "0"}}, {"status": 503}, {"content": "שלום"})
+    assert gc.ask_gpt("s", "u") == "שלום"
+    assert len(fake_openai.requests) == 3
+
+
+def test_ask_gpt_times_out_slow_attempt_and_retries(fake_openai):
+    import time
+    import gpt_client as gc
+
+    fake_openai.enqueue({"delay": 1.5, "content": "איטי"}, {"content": "מהיר"})
+    started = time.perf_counter()
+    assert gc.ask_gpt("s", "u") == "מהיר"
+    assert time.perf_counter() - started < 1.5
+
+
+def test_ask_gpt_does_not_retry_client_errors(fake_openai):
+    import openai
+    import gpt_client as gc
+
+    fake_openai.enqueue({"status": 400})
+    with pytest.raises(openai.BadRequestError):
+        gc.ask_gpt("s", "u")
+    assert len(fake_openai.requests) == 1
+
+
+def test_ask_gpt_circuit_breaker_fails_fast(fake_openai):
+    import gpt_client as gc
+    from gpt_resilience import UNAVAILABLE_REPLY
+
+    gc.resilience.breaker.failure_threshold = 3
+    fake_openai.enqueue(*[{"status": 500}] * 3)
+    assert gc.ask_gpt("s", "u") == UNAVAILABLE_REPLY
+    assert gc.resilience.breaker.state == "open"
+    assert gc.ask_gpt("s", "u") == UNAVAILABLE_REPLY
+    assert len(fake_openai.requests) == 3  # the second call never reached the server
+
+
+def test_outage_reply_is_not_parsed_or_retried(assistant_instance, monkeypatch):
+    import asyncio
+    import assistant as _assistant_mod
+    from gpt_resilience import UNAVAILABLE_REPLY
+
+    calls = []
+
+    def _down(system_prompt, user_input, *args, **kwargs):
+        calls.append(system_prompt)
+        return UNAVAILABLE_REPLY
+
+    async def _down_async(*args, **kwargs):
+        return _down(*args, **kwargs)
+
+    def _down_stream(*args, **kwargs):
+        yield _down(*args, **kwargs)  # the canned reply comes as one chunk
+
+    monkeypatch.setattr(_assistant_mod, "ask_gpt", _down)
+    monkeypatch.setattr(_assistant_mod, "ask_gpt_async", _down_async)
+    monkeypatch.setattr(_assistant_mod, "ask_gpt_stream", _down_stream)
+    assistant_instance._todo_list.extend([{"description": "להתקשר לאמא", "time": None},
+                                          {"description": "להתקשר לאבא", "time": None}])
+
+    for streaming in (True, False):
+        monkeypatch.setattr(assistant_instance._settings, "gpt_streaming", streaming)
+        assert assistant_instance._handle_intent("פגישה עם דנה", "שמור", None) == UNAVAILABLE_REPLY
+    assert assistant_instance._handle_intent("מחק להתקשר", "מחק משימה", None) == UNAVAILABLE_REPLY
+    assert len(calls) == 3  # no FALLBACK_TASK_PROMPT call after an outage
+
+    monkeypatch.setattr(assistant_instance, "parse_question_intent_and_payload_async",
+                        lambda question: _intent_without_payload("שמור"))
+    assert asyncio.run(assistant_instance.process_user_input_async("פגישה עם דנה")) == UNAVAILABLE_REPLY
+    assert len(calls) == 4 and len(assistant_instance._todo_list) == 2
+
+
+async def _intent_without_payload(intent):
+    return intent, None
+
+
+def test_ask_gpt_async_retries(fake_openai):
+    import asyncio
+    import gpt_client as gc
+
+    fake_openai.enqueue({"status": 502}, {"content": "אסינכרוני"})
+    assert asyncio.run(gc.ask_gpt_async("s", "u")) == "אסינכרוני"
+    assert len(fake_openai.requests) == 2
+
+
+def test_ask_gpt_hedges_slow_request(fake_openai):
+    import time
+    import gpt_client as gc
+
+    gc.resilience.hedge = True
+    for _ in range(gc.resilience.min_hedge_samples):
+        gc.resilience.tracker.record(0.05)
+    fake_openai.enqueue({"delay": 0.4, "content": "ראשונה"}, {"content": "גיבוי"})
+    started = time.perf_counter()
+    assert gc.ask_gpt("s", "u") == "גיבוי"
+    assert time.perf_counter() - started < 0.35
+    assert gc.resilience.hedged_requests == 1
+
+
+def test_circuit_breaker_half_open_trial():
+    from gpt_resilience import CircuitBreaker
+
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    now[0] = 10
+    assert breaker.allow()       # single trial call
+    assert not breaker.allow()
+    breaker.record_failure()     # trial failed → open again
+    assert breaker.state == "open"
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_hedged_call_discards_the_losing_result():
+    import threading
+    import time
+    from gpt_resilience import ResilientCaller
+
+    caller = ResilientCaller(hedge=True, min_hedge_samples=1)
+    caller.tracker.record(0.05)
+    calls, discarded, done = [], [], threading.Event()
+
+    def open_stream(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return "slow"
+        return "fast"
+
+    assert caller.call(open_stream, discard=lambda stream: (discarded.append(stream), done.set())) == "fast"
+    assert done.wait(2) and discarded == ["slow"]
+
+
+def test_retry_policy_backoff_bounds():
+    from gpt_resilience import RetryPolicy
+
+    policy = RetryPolicy(base_delay=0.5, max_delay=4, rng=lambda low, high: high)
+    assert [policy.delay(n) for n in range(5)] == [0.5, 1.0, 2.0, 4, 4]
+
+
+# ---------------------------------------------------------------------------
+#  Lazy OpenAI clients
+# ---------------------------------------------------------------------------
+
+
+def test_import_does_not_load_openai_or_need_key():
+    import benchmark_import_time
+
+    result = benchmark_import_time.measure("main", runs=1)
+    assert result["openai_loaded"] is False
+
+
+def test_clients_are_built_once_with_pool(monkeypatch):
+    import gpt_client as gc
+
+    monkeypatch.setattr(gc, "_client", None)
+    monkeypatch.setattr(gc.settings, "openai_api_key", "test-key")
+    monkeypatch.setattr(gc.settings, "gpt_max_keepalive_connections", 7)
+    client = gc.get_client()
+    assert gc.get_client() is client and gc.client is client
+    pool = client._client._transport._pool
+    assert pool._max_keepalive_connections == 7
+
+
+def test_missing_api_key_fails_on_first_call(monkeypatch):
+    import gpt_client as gc
+
+    monkeypatch.setattr(gc, "_client", None)
+    monkeypatch.setattr(gc, "response_cache", None)
+    monkeypatch.setattr(gc.settings, "openai_api_key", None)
+    with pytest.raises(RuntimeError, match="OPENAI_API_KEY"):
+        gc.ask_gpt("s", "u")
+
+
+# ---------------------------------------------------------------------------
+#  Streaming GPT replies
+# ---------------------------------------------------------------------------
+
+
+def test_json_array_stream_yields_objects_as_they_close():
+    from json_stream import JsonArrayStream
+
+    parser = JsonArrayStream()
+    text = '```json\n[{"description": "סוגריים {ו} \\"מרכאות\\"", "time": null}, {"description": "ב", "time": "x"}]\n```'
+    seen = []
+    for char in text:
+        seen.extend(parser.feed(char))
+        if len(seen) == 1:
+            assert parser.done is False  # the first task is out before the second one arrives
+    assert seen == [{"description": 'סוגריים {ו} "מרכאות"', "time": None}, {"description": "ב", "time": "x"}]
+    assert parser.done
+
+
+def test_json_array_stream_single_object():
+    from json_stream import iter_json_array
+
+    assert list(iter_json_array(['{"description": "א", ', '"time": null}', " extra"])) == [
+        {"description": "א", "time": None}]
+
+
+def test_streamed_save_persists_each_task(assistant_instance, mock_gpt, monkeypatch):
+    question = "תזכיר לי לקנות חלב ולהתקשר לאמא ולשלם חשבון"
+    tasks = [{"description": "לקנות חלב", "time": None}, {"description": "להתקשר לאמא", "time": None},
+             {"description": "לשלם חשבון", "time": None}]
+    mock_gpt[("אתה מקבל טקסט של משימות", question)] = json.dumps(tasks, ensure_ascii=False)
+    writes = []
+    monkeypatch.setattr(assistant_instance._storage, "add_tasks",
+                        lambda new_tasks, all_tasks: writes.append((new_tasks, len(all_tasks))))
+
+    assert assistant_instance.save_question(question).startswith("3 משימות")
+    assert writes == [([tasks[0]], 1), ([tasks[1]], 2), ([tasks[2]], 3)]
+
+
+def test_streamed_save_falls_back_when_stream_has_no_task(assistant_instance, mock_gpt):
+    question = "תזכיר לי משהו חשוב"
+    mock_gpt[("החזר רק JSON תקין", question)] = '[{"description": "משהו חשוב", "time": null}]'
+    mock_gpt[question] = "לא הבנתי"
+
+    assert assistant_instance.save_question(question).startswith("1 משימות")
+    assert assistant_instance._todo_list[0].description == "משהו חשוב"
+
+
+def test_ask_gpt_stream_over_http(fake_openai):
+    import gpt_client as gc
+
+    fake_openai.enqueue({"content": '[{"description": "א", "time": null}]', "chunk_size": 5})
+    chunks = list(gc.ask_gpt_stream("s", "u"))
+    assert len(chunks) > 1 and "".join(chunks) == '[{"description": "א", "time": null}]'
+    assert fake_openai.requests[0]["stream"] is True
+
+
+def test_intent_stream_stops_at_known_intent(fake_openai):
+    import gpt_client as gc
+    from intent_classifier import KNOWN_INTENTS
+
+    fake_openai.enqueue({"content": "שמור" + "\nהסבר ארוך" * 20, "chunk_size": 4, "chunk_delay": 0.02})
+    assert gc.collect_stream(gc.ask_gpt_stream("s", "u"), stop_at=KNOWN_INTENTS) == "שמור"
+    assert fake_openai.streamed_chunks < 10
+
+
+def test_ask_gpt_stream_handles_a_stream_that_breaks_mid_reply(fake_openai, monkeypatch):
+    import gpt_client as gc
+    from gpt_resilience import UNAVAILABLE_REPLY
+
+    outcomes = []
+    monkeypatch.setattr(gc, "_record_call", lambda call_site, started, usage=None, outcome="ok": outcomes.append(outcome))
+    # the read timeout (attempt_timeout_seconds=0.5) fires while the upstream hangs
+    fake_openai.enqueue({"content": "שמור משימה", "chunk_size": 4, "stall_after": 1, "stall": 1.5},
+                        {"content": "שמור", "stall_after": 0, "stall": 1.5})
+    assert gc.collect_stream(gc.ask_gpt_stream("s", "u", call_site="intent")) == "שמור"
+    assert gc.collect_stream(gc.ask_gpt_stream("s", "u", call_site="intent")) == UNAVAILABLE_REPLY
+    assert outcomes == ["error", "error"]
+    assert gc.resilience.breaker._failures == 2
+
+
+def test_ask_gpt_stream_enforces_the_deadline_on_reads(fake_openai):
+    import time
+    import gpt_client as gc
+
+    gc.resilience.deadline_seconds = 0.5
+    fake_openai.enqueue({"content": "א" * 40, "chunk_size": 1, "chunk_delay": 0.1})
+    started = time.perf_counter()
+    text = "".join(gc.ask_gpt_stream("s", "u"))
+    assert time.perf_counter() - started < 1.5 and 0 < len(text) < 40
+
+
+# ---------------------------------------------------------------------------
+#  Intent micro-batching
+# ---------------------------------------------------------------------------
+
+
+def _fake_batch_reply(user_input: str, drop: int | None = None) -> str:
+    items = json.loads(user_input)
+    return json.dumps([{"id": item["id"], "intent": "שמור" if "פגישה" in item["text"] else None}
+                       for item in items if item["id"] != drop], ensure_ascii=False)
+
+
+def test_parse_batch_response_marks_bad_items():
+    from intent_batcher import parse_batch_response
+
+    response = json.dumps([{"id": 0, "intent": "הצג משימות"}, {"id": 1, "intent": "לא קיים"},
+                           {"id": 2, "intent": None, "reply": "היי"}, {"id": 9, "intent": "שמור"}],
+                          ensure_ascii=False)
+    assert parse_batch_response(response, 4) == ["הצג משימות", None, None, None]  # free text is never passed on
+    assert parse_batch_response("לא JSON", 2) == [None, None]
+
+
+def _hold_first_call(monkeypatch, batch_reply, first_reply):
+    """
+    Fakes gpt_client.ask_gpt: the first message, asked alone because the batcher was idle, stays in
+    flight until the returned event is set, so the messages sent meanwhile form one batch.
+    """
+    import threading
+    import gpt_client as gc
+    from prompts import PARSE_QUESTION_BATCH_WITH_GPT_PROMPT
+
+    calls, started, release = [], threading.Event(), threading.Event()
+
+    def _fake_ask(system_prompt, user_input, *args, **kwargs):
+        calls.append(user_input)
+        if system_prompt == PARSE_QUESTION_BATCH_WITH_GPT_PROMPT:
+            return batch_reply(user_input)
+        started.set()
+        release.wait(5)
+        return first_reply
+
+    monkeypatch.setattr(gc, "ask_gpt", _fake_ask)
+    return calls, started, release
+
+
+def test_intent_batcher_threads_share_one_call(monkeypatch):
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from intent_batcher import IntentBatcher
+
+    calls, started, release = _hold_first_call(monkeypatch, _fake_batch_reply, "שמור")
+    batcher = IntentBatcher(window_seconds=0.2, max_batch=4)
+    questions = ["יש לי פגישה מחר", "מה שלומך", "פגישה עם דנה", "בוקר טוב"]
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        first = pool.submit(batcher.classify, "פגישה ראשונה")
+        assert started.wait(2)  # sent at once, without waiting for the window
+        results = pool.map(batcher.classify, questions)
+        time.sleep(0.05)
+        release.set()
+        results = list(results)
+    assert first.result() == "שמור"
+    assert results == ["שמור", None, "שמור", None]
+    assert len(calls) == 2
+    assert batcher.stats() == {"batches": 1, "batched_items": 2, "fallbacks": 2, "unavailable": 0, "single": 1}
+
+
+def test_intent_batcher_async_falls_back_per_item(assistant_instance, mock_gpt, monkeypatch):
+    import asyncio
+    import gpt_client as gc
+    from intent_batcher import IntentBatcher
+    from prompts import PARSE_QUESTION_BATCH_WITH_GPT_PROMPT
+
+    async def _fake_ask(system_prompt, user_input, *args, **kwargs):
+        if system_prompt != PARSE_QUESTION_BATCH_WITH_GPT_PROMPT:
+            await asyncio.sleep(0.01)  # the first message, asked alone while the others queue up
+            return "שמור"
+        return _fake_batch_reply(user_input, drop=0)
+
+    batcher = IntentBatcher(window_seconds=0.05, max_batch=8)
+    monkeypatch.setattr("assistant.get_intent_batcher", lambda: batcher)
+    monkeypatch.setattr(gc, "ask_gpt_async", _fake_ask)
+    mock_gpt["מה שלומך"] = "אני בסדר"  # the dropped item is asked on its own
+    mock_gpt["בוקר טוב"] = "בוקר אור"  # so is a message that is not a command
+
+    async def _run():
+        return await asyncio.gather(*(assistant_instance.parse_question_intent_with_gpt_async(q)
+                                      for q in ["פגישה מחר", "מה שלומך", "בוקר טוב"]))
+
+    assert asyncio.run(_run()) == ["שמור", "אני בסדר", "בוקר אור"]
+    assert batcher.stats()["fallbacks"] == 2 and batcher.stats()["single"] == 1
+
+
+def test_intent_batcher_fails_fast_when_gpt_is_unavailable(assistant_instance, mock_gpt, monkeypatch):
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from gpt_resilience import UNAVAILABLE_REPLY
+    from intent_batcher import IntentBatcher
+
+    calls, started, release = _hold_first_call(monkeypatch, lambda user_input: UNAVAILABLE_REPLY, UNAVAILABLE_REPLY)
+    batcher = IntentBatcher(window_seconds=0.2, max_batch=3)
+    monkeypatch.setattr("assistant.get_intent_batcher", lambda: batcher)
+    monkeypatch.setattr("assistant.ask_gpt", lambda *args, **kwargs: calls.append("single") or UNAVAILABLE_REPLY)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(assistant_instance.parse_question_intent_with_gpt, "שלום")
+        assert started.wait(2)
+        results = pool.map(assistant_instance.parse_question_intent_with_gpt, ["פגישה", "מה שלומך", "היי"])
+        time.sleep(0.05)
+        release.set()
+        results = list(results)
+    assert [first.result()] + results == [UNAVAILABLE_REPLY] * 4
+    assert len(calls) == 2  # the first message and one batch, no per-message calls behind the failed batch
+    assert batcher.stats()["unavailable"] == 3
+
+
+# ---------------------------------------------------------------------------
+#  Prompt layout and token accounting
+# ---------------------------------------------------------------------------
+
+
+def test_prompts_keep_volatile_data_at_the_end():
+    from prompts import (PARSE_DELETE_QUESTION_WITH_GPT_PROMPT, PARSE_INTENT_WITH_PAYLOAD_WITH_GPT_PROMPT,
+                         PARSE_TASK_WITH_GPT_PROMPT)
+
+    day1 = PARSE_TASK_WITH_GPT_PROMPT.format(today="2025-04-22")
+    day2 = PARSE_TASK_WITH_GPT_PROMPT.format(today="2025-04-23")
+    assert day1.index("2025-04-22") > len(day1) - 40 and day1[:-20] == day2[:-20]
+    combined = PARSE_INTENT_WITH_PAYLOAD_WITH_GPT_PROMPT
+    assert combined.index("{today}") > combined.index("אל תוסיף שום טקסט")
+    assert PARSE_DELETE_QUESTION_WITH_GPT_PROMPT.rstrip().endswith("{task_list}")
+
+
+def test_usage_is_recorded_per_call_site(fake_openai, monkeypatch):
+    import gpt_client as gc
+    from gpt_usage import UsageTracker
+
+    monkeypatch.setattr(gc, "usage", UsageTracker())
+    cached_usage = {"prompt_tokens": 1200, "completion_tokens": 10, "total_tokens": 1210,
+                    "prompt_tokens_details": {"cached_tokens": 1024}}
+    fake_openai.enqueue({"content": "שמור", "usage": cached_usage},
+                        {"content": "[]", "usage": {"prompt_tokens": 300, "completion_tokens": 5, "total_tokens": 305}})
+    gc.ask_gpt("s", "u", call_site="intent")
+    "".join(gc.ask_gpt_stream("s", "u", call_site="save"))
+
+    intent = gc.usage.stats("intent")
+    assert intent["calls"] == 1 and intent["cached_tokens"] == 1024
+    assert intent["cached_ratio"] == pytest.approx(1024 / 1200)
+    save = gc.usage.stats()["save"]
+    assert (save["prompt_tokens"], save["completion_tokens"], save["cached_tokens"]) == (300, 5, 0)
+    assert fake_openai.requests[1]["stream_options"] == {"include_usage": True}
+
+
+# ---------------------------------------------------------------------------
+#  Metrics
+# ---------------------------------------------------------------------------
+
+
+def test_metrics_route_is_off_by_default(flask_client):
+    assert flask_client.get("/metrics").status_code == 404
+
+
+def test_metrics_route_exposes_stage_and_gpt_timings(tmp_env, fake_openai, monkeypatch):
+    import gpt_client as gc
+    import metrics
+    import whatsapp_server as ws
+    from assistant import PersonalAssistant
+
+    dummy = MagicMock(spec=PersonalAssistant)
+    dummy.process_user_input.return_value = "pong"
+    monkeypatch.setattr(ws, "PersonalAssistant", MagicMock(load_state=MagicMock(return_value=dummy)))
+    monkeypatch.setattr(metrics.registry, "enabled", True)
+    flask_client = ws.app.test_client()
+    before = metrics.stage_seconds.count(stage="webhook")
+    flask_client.post("/whatsapp", data={"Body": "שלום", "From": "whatsapp:+972555"})
+    gc.ask_gpt("s", "u", call_site="intent")
+
+    rv = flask_client.get("/metrics")
+    assert rv.status_code == 200 and rv.mimetype == "text/plain"
+    assert metrics.stage_seconds.count(stage="webhook") == before + 1
+    assert 'assistant_stage_seconds_count{stage="webhook"}' in rv.text
+    assert 'assistant_gpt_request_seconds_bucket{call_site="intent",le="+Inf"}' in rv.text
+    assert 'assistant_gpt_requests_total{call_site="intent",outcome="ok"}' in rv.text
+    assert 'assistant_gpt_tokens_total{call_site="intent",kind="prompt"}' in rv.text
+    for line in ("assistant_sessions_resident_sessions ", "assistant_intent_classifier_hit_rate ",
+                 'assistant_gpt_resilience_breaker_state{value="closed"} 1'):
+        assert line in rv.text
+
+
+def test_stats_lines_render_component_stats_as_gauges():
+    from metrics import stats_lines
+
+    lines = stats_lines("intent_batcher", {"batches": 2, "hits_by_intent": {"שמור": 3}, "state": "open",
+                                           "latency_p95": None})
+    assert lines == ["# TYPE assistant_intent_batcher_batches gauge", "assistant_intent_batcher_batches 2",
+                     "# TYPE assistant_intent_batcher_hits_by_intent gauge",
+                     'assistant_intent_batcher_hits_by_intent{key="שמור"} 3',
+                     "# TYPE assistant_intent_batcher_state gauge", 'assistant_intent_batcher_state{value="open"} 1']
+    assert stats_lines("gpt_cache", None) == []
+
+
+def test_histogram_buckets_are_cumulative():
+    from metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram("h", "test", ("stage",), buckets=(0.1, 1))
+    for seconds in (0.05, 0.5, 5):
+        histogram.observe(seconds, stage="x")
+    lines = registry.render().splitlines()
+    assert 'h_bucket{stage="x",le="0.1"} 1' in lines
+    assert 'h_bucket{stage="x",le="1"} 2' in lines
+    assert 'h_bucket{stage="x",le="+Inf"} 3' in lines
+    assert MetricsRegistry(enabled=False).timer(histogram) is MetricsRegistry(enabled=False).timer(histogram)
+
+
+# ---------------------------------------------------------------------------
+#  Load-test harness
+# ---------------------------------------------------------------------------
+
+
+def test_load_harness_small_run(tmp_env, fake_openai, monkeypatch):
+    import benchmark_load
+    import metrics
+
+    monkeypatch.setattr(metrics.registry, "enabled", True)
+    fake_openai.responder = benchmark_load.make_responder(benchmark_load.LatencyModel("fixed:0"))
+    report = benchmark_load.run_load(users=12, messages_per_user=3, concurrency=4, phone_prefix="+97259")
+
+    assert report["messages"] == 36 and report["errors"] == 0
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["p95"] <= report["latency_ms"]["p99"]
+    assert report["stages_ms"]["webhook"]["count"] == 36
+    assert report["gpt_ms"]  # the message mix needs GPT for some messages
+
+
+def test_load_harness_flags_regressions():
+    from benchmark_load import LatencyModel, compare_to_baseline, fake_llm_reply
+
+    baseline = {"latency_ms": {"p95": 100, "p99": 200}, "messages_per_sec": 50, "errors": 0,
+                "gpt_requests_per_message": 0.7, "calibration_ms": 50}
+    same = {"latency_ms": {"p95": 110, "p99": 210}, "messages_per_sec": 45, "errors": 0,
+            "gpt_requests_per_message": 0.7, "calibration_ms": 50}
+    slower = {"latency_ms": {"p95": 140, "p99": 210}, "messages_per_sec": 30, "errors": 1,
+              "gpt_requests_per_message": 1.0, "calibration_ms": 50}
+    assert compare_to_baseline(same, baseline, tolerance=0.25, check_timing=True) == []
+    assert len(compare_to_baseline(slower, baseline, tolerance=0.25)) == 2  # timings are opt-in
+    assert len(compare_to_baseline(slower, baseline, tolerance=0.25, check_timing=True)) == 4
+    # the same timings on a machine twice as slow are within the calibrated baseline
+    slow_machine = dict(same, latency_ms={"p95": 220, "p99": 420}, messages_per_sec=25, calibration_ms=100)
+    assert compare_to_baseline(slow_machine, baseline, tolerance=0.25, check_timing=True) == []
+
+    assert json.loads(fake_llm_reply("אתה מקבל טקסט של משימות", "תזכיר לי לקנות חלב ולהתקשר לאמא")) == [
+        {"description": "לקנות חלב", "time": None}, {"description": "להתקשר לאמא", "time": None}]
+    with pytest.raises(ValueError):
+        LatencyModel("gamma:1")
+
+
+# ---------------------------------------------------------------------------
+#  Shared conversation state (multi-worker)
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def fake_redis():
+    from fake_redis_server import FakeRedisServer
+
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+def test_pending_confirmation_survives_export_and_restore(assistant_instance):
+    from assistant import PersonalAssistant
+
+    assistant_instance._todo_list.extend([{"description": "x"}, {"description": "y"}])
+    assistant_instance.save_state()
+    assert "[כן/לא]" in assistant_instance.process_user_input("מחק את כל המשימות")
+    state = json.loads(json.dumps(assistant_instance.export_state()))
+
+    other = PersonalAssistant.load_state(assistant_instance._name)
+    other.restore_state(state)
+    assert "נמחקה" in other.process_user_input("כן")
+    assert not other._todo_list and other.export_state()["awaiting_confirmation"] is None
+
+
+def test_confirmation_answered_on_another_worker(assistant_instance, fake_redis):
+    from assistant import PersonalAssistant
+    from conversation_state import RedisStateStore, RespClient
+    from session_store import SharedSessionManager
+
+    name = assistant_instance._name
+    assistant_instance._todo_list.append({"description": "x"})
+    assistant_instance.save_state()
+    # Two workers, each with its own connection to the shared store
+    workers = [SharedSessionManager(PersonalAssistant.load_state, RedisStateStore(RespClient.from_url(fake_redis.url)))
+               for _ in range(2)]
+
+    with workers[0].session(name) as assistant:
+        assert "[כן/לא]" in assistant.process_user_input("מחק את כל המשימות")
+    with workers[1].session(name) as assistant:
+        assert "נמחקה" in assistant.process_user_input("כן")
+    assert not workers[0].get(name)._todo_list
+    assert workers[0].get(name)._awaiting_confirmation is None
+
+
+def test_resp_client_resends_only_commands_that_were_not_written():
+    import socket
+    import threading
+    import time
+    from conversation_state import RespClient
+
+    listener = socket.create_server(("127.0.0.1", 0))
+    listener.settimeout(1)
+    received = []
+
+    def _serve(connections):
+        for replies in connections:  # the replies of each connection, None closes it without one
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                return
+            for reply in replies:
+                received.append(conn.recv(1024))
+                if reply is None:
+                    break
+                conn.sendall(reply)
+            conn.close()
+
+    server = threading.Thread(target=_serve, args=([[b"+OK\r\n"], [b"+OK\r\n", None], [b"+OK\r\n"]],),
+                              daemon=True)
+    server.start()
+    client = RespClient(*listener.getsockname()[:2])
+    assert client.execute("SET", "a", "1") == "OK"
+    time.sleep(0.05)  # the server has closed the idle connection
+    assert client.execute("SET", "a", "2") == "OK"  # reconnects before sending
+    with pytest.raises(ConnectionError):
+        client.execute("SET", "lease", "t", "NX")  # sent, then the connection broke: may have been applied
+    server.join(2)
+    listener.close()
+    assert len(received) == 3  # the lease command was not sent again on a new connection
+
+
+def test_redis_state_store_round_trip_and_lock(fake_redis):
+    import threading
+    from conversation_state import RedisStateStore, RespClient, StateLockTimeout
+
+    store = RedisStateStore(RespClient.from_url(fake_redis.url), ttl_seconds=60)
+    assert store.get("a") is None
+    store.set("a", {"summary": "שלום", "awaiting_confirmation": ["reset_all", []]})
+    assert store.get("a")["summary"] == "שלום"
+    store.delete("a")
+    assert store.get("a") is None
+
+    other = RedisStateStore(RespClient.from_url(fake_redis.url))
+    held, release = threading.Event(), threading.Event()
+
+    def _hold():
+        with other.lock("a"):
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=_hold)
+    thread.start()
+    held.wait(5)
+    with pytest.raises(StateLockTimeout):
+        with store.lock("a", timeout=0.1):
+            pass
+    with store.lock("b", timeout=0.1):  # other users are not blocked
+        pass
+    release.set()
+    thread.join()
+    with store.lock("a", timeout=1):
+        pass
+
+
+def test_redis_lock_lease_is_renewed_and_released_only_by_its_holder(fake_redis):
+    import threading
+    import time
+    from conversation_state import LOCK_KEY, RedisStateStore, RespClient, StateLockTimeout
+
+    store = RedisStateStore(RespClient.from_url(fake_redis.url), lock_ttl_seconds=0.2)
+    other = RedisStateStore(RespClient.from_url(fake_redis.url), lock_ttl_seconds=0.2)
+    held = threading.Event()
+
+    def _slow_message():
+        with store.lock("a"):
+            held.set()
+            time.sleep(0.8)  # four leases long
+
+    thread = threading.Thread(target=_slow_message)
+    thread.start()
+    held.wait(5)
+    with pytest.raises(StateLockTimeout):
+        with other.lock("a", timeout=0.5):
+            pass
+    thread.join()
+    with other.lock("a", timeout=0.5):
+        pass
+
+    key = LOCK_KEY.format(name="b")
+    assert store.try_lease(key, "mine", 5)
+    other.release_lease(key, "theirs")
+    assert not other.renew_lease(key, "theirs", 5)
+    assert not other.try_lease(key, "theirs", 5)
+    store.release_lease(key, "mine")
+    assert other.try_lease(key, "theirs", 5)
+
+
+def test_in_memory_state_store_drops_unused_locks():
+    from concurrent.futures import ThreadPoolExecutor
+    from conversation_state import InMemoryStateStore
+
+    store = InMemoryStateStore()
+
+    def _message(name):
+        with store.lock(name):
+            return name
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert len(list(pool.map(_message, [f"user{i % 20}" for i in range(200)]))) == 200
+    assert store._locks == {}
+
+
+# ---------------------------------------------------------------------------
+#  Reminder scheduler
+# ---------------------------------------------------------------------------
+
+
+def test_reminder_scheduler_sends_due_tasks_in_order():
+    from datetime import datetime, timedelta
+    from message_sender import FakeMessageSender
+    from reminder_scheduler import ReminderScheduler
+
+    now = datetime(2030, 1, 1, 8, 0)
+    sender = FakeMessageSender()
+    scheduler = ReminderScheduler(sender, lead=timedelta(minutes=10), clock=lambda: now)
+    assert scheduler.schedule(":+9725", {"description": "פגישה", "time": "01/01/2030 10:00"})
+    assert scheduler.schedule(":+9726", {"description": "רופא", "time": "01/01/2030 09:00"})
+    assert not scheduler.schedule(":+9725", {"description": "עבר", "time": "01/01/2030 07:00"})
+    assert not scheduler.schedule(":+9725", {"description": "מחר", "time": "מחר"})
+    scheduler.schedule(":+9725", {"description": "לבטל", "time": "01/01/2030 09:30"})
+    scheduler.cancel(":+9725", {"description": "לבטל", "time": "01/01/2030 09:30"})
+
+    assert scheduler.run_due(datetime(2030, 1, 1, 8, 49)) == 0
+    assert scheduler.next_due() == datetime(2030, 1, 1, 8, 50)
+    assert scheduler.run_due(datetime(2030, 1, 1, 9, 55)) == 2
+    assert sender.sent == [("whatsapp:+9726", "⏰ תזכורת: רופא (01/01/2030 09:00)"),
+                           ("whatsapp:+9725", "⏰ תזכורת: פגישה (01/01/2030 10:00)")]
+    assert len(scheduler) == 0 and scheduler.next_due() is None
+
+
+def test_reminder_scheduler_many_users_and_cancel_user():
+    from datetime import datetime, timedelta
+    from message_sender import FakeMessageSender
+    from reminder_scheduler import ReminderScheduler
+
+    start = datetime(2030, 1, 1)
+    sender = FakeMessageSender()
+    scheduler = ReminderScheduler(sender, clock=lambda: start)
+    batches = [[(f"u{user}", {"description": f"t{i}", "time": (start + timedelta(minutes=user + i)).strftime("%d/%m/%Y %H:%M")})
+                for i in range(5)] for user in range(2000)]
+    assert scheduler.load(batches) == 10_000
+    for user in range(1200):
+        scheduler.cancel_user(f"u{user}")
+    assert len(scheduler) == 4000 and len(scheduler._heap) < 10_000  # compacted
+    assert scheduler.run_due(start + timedelta(minutes=1203)) == 4 + 3 + 2 + 1
+    assert sender.sent[0] == ("whatsapp:u1200", "⏰ תזכורת: t0 (01/01/2030 20:00)")
+
+
+def test_reminders_follow_saves_and_deletes(assistant_instance, mock_gpt, monkeypatch, tmp_path):
+    from types import SimpleNamespace
+    import reminder_scheduler
+    from message_sender import FakeMessageSender
+    from storage_backends import iter_stored_tasks
+
+    scheduler = reminder_scheduler.ReminderScheduler(FakeMessageSender())
+    monkeypatch.setattr(reminder_scheduler, "_reminder_scheduler", scheduler)
+    tasks = [{"description": "לקנות חלב", "time": "01/01/2099 10:00"}, {"description": "בלי זמן", "time": None}]
+    assistant_instance.save_question("שמור", tasks=tasks)
+    assert len(scheduler) == 1
+    assistant_instance.delete_task(1, "לקנות חלב", "מחק 1")
+    assert len(scheduler) == 0
+
+    assistant_instance.save_question("שמור", tasks=tasks[:1])
+    settings = SimpleNamespace(storage_backend="json", data_dir=tmp_path, todo_template="todo_list_{name}.json")
+    stored = [item for batch in iter_stored_tasks(settings) for item in batch]
+    assert stored == [(assistant_instance._name, tasks[1]), (assistant_instance._name, tasks[0])]
+    assistant_instance.clear_all_tasks()
+    assert len(scheduler) == 0
+
+
+def test_reminder_scheduler_skips_tasks_deleted_by_another_worker():
+    from datetime import datetime
+    from message_sender import FakeMessageSender
+    from reminder_scheduler import ReminderScheduler
+
+    stored = {"u": [{"description": "נשאר", "time": "01/01/2030 09:00"},
+                    {"description": "נמחק", "time": "01/01/2030 09:00"}]}
+    sender = FakeMessageSender()
+    scheduler = ReminderScheduler(
+        sender, clock=lambda: datetime(2030, 1, 1, 8, 0),
+        source=lambda: [[(user, task) for user, tasks in stored.items() for task in tasks]],
+        still_stored=lambda user, key: any((t["description"], t["time"]) == key for t in stored[user]),
+    )
+    assert scheduler.resync() == 2
+    del stored["u"][1]  # deleted through another process, this scheduler was never told
+    assert scheduler.run_due(datetime(2030, 1, 1, 9, 0)) == 1
+    assert sender.sent == [("whatsapp:u", "⏰ תזכורת: נשאר (01/01/2030 09:00)")]
+
+    stored["u"].append({"description": "חדש", "time": "01/01/2030 10:00"})  # saved by another process
+    assert scheduler.resync() == 2 and scheduler.next_due() == datetime(2030, 1, 1, 9, 0)
+
+
+def test_only_the_leader_sends_reminders(fake_redis):
+    import time
+    from datetime import datetime
+    from conversation_state import RedisStateStore, RespClient
+    from message_sender import FakeMessageSender
+    from reminder_scheduler import LeaderLease, ReminderScheduler
+
+    due = [[("u", {"description": "פגישה", "time": "01/01/2030 09:00"})]]
+    workers = []
+    for _ in range(2):
+        store = RedisStateStore(RespClient.from_url(fake_redis.url))
+        workers.append(ReminderScheduler(FakeMessageSender(), clock=lambda: datetime(2030, 1, 1, 9, 0),
+                                         source=lambda: due, leader=LeaderLease(store, seconds=0.3)))
+    for worker in workers:
+        worker.start()
+    time.sleep(0.3)
+    sent = [len(worker._sender.sent) for worker in workers]
+    assert sorted(sent) == [0, 1]
+
+    leader, follower = (workers[0], workers[1]) if sent[0] else (workers[1], workers[0])
+    leader.stop()  # releases the lease, the other worker takes over and loads the stored tasks
+    deadline = time.monotonic() + 3
+    while not follower._sender.sent and time.monotonic() < deadline:
+        time.sleep(0.02)
+    follower.stop()
+    assert len(follower._sender.sent) == 1 and len(leader._sender.sent) == 1
+
+
+def test_followers_forward_reminder_changes_to_the_leader(fake_redis):
+    import time
+    from datetime import datetime
+    from conversation_state import RedisStateStore, RespClient
+    from message_sender import FakeMessageSender
+    from reminder_scheduler import LeaderLease, ReminderScheduler
+
+    now = datetime(2030, 1, 1, 8, 0)
+    leader = ReminderScheduler(FakeMessageSender(), clock=lambda: now, source=lambda: [],
+                               leader=LeaderLease(RedisStateStore(RespClient.from_url(fake_redis.url)), seconds=0.3))
+    follower = ReminderScheduler(FakeMessageSender(), clock=lambda: now,
+                                 leader=LeaderLease(RedisStateStore(RespClient.from_url(fake_redis.url)), seconds=0.3))
+    leader.start()
+    deadline = time.monotonic() + 3
+    while not leader._leading and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert follower.schedule("u", {"description": "נשאר", "time": "01/01/2030 09:00"})
+    follower.schedule("u", {"description": "נמחק", "time": "01/01/2030 09:00"})
+    follower.cancel("u", {"description": "נמחק", "time": "01/01/2030 09:00"})
+    assert len(follower) == 0
+    while len(leader) != 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    leader.stop()
+    assert leader._pending == {"u": {("נשאר", "01/01/2030 09:00"): datetime(2030, 1, 1, 9, 0)}}
+
+
+def test_servers_do_not_start_reminders_on_import():
+    import async_whatsapp_server
+    import whatsapp_server
+
+    assert not hasattr(whatsapp_server, "reminders") and not hasattr(async_whatsapp_server, "reminders")
+    assert async_whatsapp_server._start_reminders in async_whatsapp_server.create_app().on_startup
+
+
+# ---------------------------------------------------------------------------
+#  Paged task listing
+# ---------------------------------------------------------------------------
+
+
+def test_show_tasks_pages_with_next(assistant_instance, monkeypatch):
+    monkeypatch.setattr(assistant_instance._settings, "task_page_size", 2)
+    assistant_instance._todo_list.extend([{"description": f"משימה {i}", "time": None} for i in range(1, 6)])
+
+    first = assistant_instance.process_user_input("הצג משימות")
+    assert first.startswith("1. משימה 1\n2. משימה 2\n") and "מתוך 5" in first
+    assert assistant_instance.process_user_input("עוד").startswith("3. משימה 3\n4. משימה 4\n")
+    assert assistant_instance.export_state()["listing"]["offset"] == 4
+    assert assistant_instance.process_user_input("עוד") == "5. משימה 5\n"
+    assert assistant_instance._listing is None
+
+
+def test_show_tasks_page_respects_char_limit_and_date_range(assistant_instance, monkeypatch):
+    from datetime import date
+    from task_listing import TaskListing, parse_date_range
+
+    assistant_instance._todo_list.extend([
+        {"description": "א" * 500, "time": None},
+        {"description": "פגישה", "time": "02/05/2025 10:00"},
+        {"description": "רופא", "time": "01/05/2025 09:00"},
+        {"description": "אחר כך", "time": "20/05/2025 09:00"},
+    ])
+    text, more = TaskListing().render_page(assistant_instance._todo_list, max_chars=600)
+    assert more and len(text) <= 600 and "מוצגות 1-1 מתוך 4" in text
+
+    date_range = parse_date_range("משימות מ-01/05 עד 10/05", today=date(2025, 4, 20))
+    text, more = TaskListing(date_range).render_page(assistant_instance._todo_list)
+    assert text == "3. רופא (01/05/2025 09:00)\n2. פגישה (02/05/2025 10:00)\n" and not more
+    assert parse_date_range("הצג משימות מחר", today=date(2025, 4, 20))[0].date() == date(2025, 4, 21)
+    assert parse_date_range("הצג משימות") is None
+    assert parse_date_range("משימות למחרתיים", today=date(2025, 4, 20))[0].date() == date(2025, 4, 22)
+    assert parse_date_range("משימות של מחר?", today=date(2025, 4, 20))[1].date() == date(2025, 4, 21)
+    assert parse_date_range("משימות במחרוזת") is None
+
+
+def test_show_tasks_truncates_a_task_longer_than_a_page():
+    from task_listing import TaskListing
+    from task_store import TaskStore
+
+    tasks = TaskStore([{"description": "א" * 3000, "time": None}, {"description": "קצר", "time": None}])
+    text, more = TaskListing().render_page(tasks, max_chars=600)
+    assert more and len(text) <= 600 and text.startswith("1. אא") and "…\n" in text
+
+
+# ---------------------------------------------------------------------------
+#  Webhook idempotency (MessageSid)
+# ---------------------------------------------------------------------------
+
+
+def test_retried_webhook_is_not_processed_twice(flask_client, monkeypatch):
+    import whatsapp_server as ws
+    from idempotency import MemoryIdempotencyStore
+
+    store = MemoryIdempotencyStore()
+    monkeypatch.setattr(ws, "get_idempotency_store", lambda: store)
+    calls = []
+    monkeypatch.setattr(ws, "process_message", lambda number, text: calls.append(text) or f"reply {len(calls)}")
+    data = {"Body": "שמור לקנות חלב", "From": "whatsapp:+972555", "MessageSid": "SM1"}
+
+    first = flask_client.post("/whatsapp", data=data)
+    retry = flask_client.post("/whatsapp", data=data)
+    other = flask_client.post("/whatsapp", data=dict(data, MessageSid="SM2"))
+    assert calls == ["שמור לקנות חלב"] * 2
+    assert "reply 1" in first.text and "reply 1" in retry.text and "reply 2" in other.text
+    assert store.duplicates == 1
+
+
+def test_memory_idempotency_store_window_bound_and_failures():
+    from idempotency import MemoryIdempotencyStore
+
+    now = [0.0]
+    store = MemoryIdempotencyStore(max_entries=2, ttl_seconds=60, wait_seconds=0, clock=lambda: now[0])
+    assert store.run_once("a", lambda: "A") == "A"
+    assert store.run_once("a", lambda: "again") == "A"
+    assert store.claim("b") == (True, None)
+    assert store.run_once("b", lambda: "B") is None  # first delivery still running
+    with pytest.raises(RuntimeError):
+        store.run_once("c", lambda: (_ for _ in ()).throw(RuntimeError()))
+    assert store.run_once("c", lambda: "C") == "C"  # a failed delivery is processed on retry
+    assert len(store) == 2 and store.lookup("a") is None  # bounded, oldest dropped
+    now[0] = 120
+    assert store.run_once("c", lambda: "C2") == "C2"  # outside the window
+
+
+def test_sqlite_idempotency_store_is_shared(tmp_path):
+    from idempotency import SQLiteIdempotencyStore
+
+    now = [1000.0]
+    path = str(tmp_path / "deliveries.sqlite3")
+    first, second = (SQLiteIdempotencyStore(path, ttl_seconds=60, wait_seconds=0, clock=lambda: now[0])
+                     for _ in range(2))
+    assert first.run_once("SM1", lambda: "reply") == "reply"
+    assert second.run_once("SM1", lambda: "again") == "reply"
+    assert second.claim("SM2") == (True, None) and first.claim("SM2") == (False, None)
+    second.release("SM2")
+    assert first.run_once("SM2", lambda: "two") == "two"
+    now[0] += 61
+    assert second.run_once("SM1", lambda: "later") == "later"
@@ -1,38 +1,118 @@
+import atexit
 import logging
 import os
+import queue
 from flask import Flask, request, Response
 from twilio.twiml.messaging_response import MessagingResponse
 from assistant import PersonalAssistant
+from background_worker import WebhookWorkerPool
+from config import settings
+from idempotency import get_idempotency_store
+from message_sender import build_message_sender
+from metrics import add_stats_collector, registry as metrics, render_metrics, stage_timer, webhook_requests
+from reminder_scheduler import start_configured_reminders
+from session_store import build_session_manager
+from storege import flush_pending_writes
 
 app = Flask(__name__)
 
 
-user_sessions = {}
+user_sessions = build_session_manager(settings, loader=lambda name: PersonalAssistant.load_state(name=name))
+atexit.register(flush_pending_writes)  # atexit runs in reverse order: sessions first, then pending writes
+atexit.register(user_sessions.flush_all)
+add_stats_collector("sessions", user_sessions.metrics)
+worker_pool: WebhookWorkerPool | None = None
+
+
+def process_message(from_number: str, incoming_msg: str) -> str:
+    """
+    Runs a message through the user's assistant and returns the reply text.
+    Messages of the same user are serialized, different users run in parallel on the server threads.
+    """
+    with user_sessions.session(from_number) as assistant:
+        return assistant.process_user_input(incoming_msg)
+
+
+def get_worker_pool() -> WebhookWorkerPool:
+    """Creates the background worker pool on first use."""
+    global worker_pool
+    if worker_pool is None:
+        sender = build_message_sender(settings)
+        if sender is None:
+            raise RuntimeError("Background processing needs TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN and TWILIO_WHATSAPP_FROM")
+        worker_pool = WebhookWorkerPool(process_message, sender, workers=settings.webhook_workers)
+        atexit.register(worker_pool.stop, 5)
+    return worker_pool
+
+
+def _submit(reply_to: str, from_number: str, incoming_msg: str) -> str:
+    get_worker_pool().submit(reply_to, from_number, incoming_msg)
+    return ""  # the reply itself is sent by the worker
+
+
+@app.before_request
+def _start_reminders():
+    """Reminders start with the first request a worker serves, not on import (a no-op afterwards)."""
+    start_configured_reminders()
+
 
 @app.route("/", methods=["GET"])
 def root():
     return "🟢 OK", 200
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape target, 404 unless settings.metrics_enabled."""
+    text = render_metrics()
+    if text is None:
+        return Response(status=404)
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/whatsapp", methods=["GET", "POST"])
 def whatsapp_webhook():
-    incoming_msg = request.values.get("Body", "").strip()
-    from_number = request.values.get("From", "").replace("whatsapp", "")
-    print(f"📩 הודעה מ-{from_number}: {incoming_msg}")
+    metrics.inc(webhook_requests, server="flask")
+    with stage_timer("webhook"):
+        return _handle_webhook()
 
-    if from_number not in user_sessions:
-        user_sessions[from_number] = PersonalAssistant.load_state(name=from_number)
 
-    assistant = user_sessions[from_number]
+def _handle_webhook():
+    incoming_msg = request.values.get("Body", "").strip()
+    reply_to = request.values.get("From", "")
+    from_number = reply_to.replace("whatsapp", "")
+    logging.info(f"📩 הודעה מ-{from_number}: {incoming_msg}")
+
+    # Twilio retries slow webhooks with the same MessageSid, a retry must not save the tasks again
+    message_sid = request.values.get("MessageSid")
+    deliveries = get_idempotency_store()
 
-    response_text = assistant.process_user_message(incoming_msg)
     twiml = MessagingResponse()
+    if settings.webhook_background_processing:
+        # Ack Twilio immediately, the reply is sent through the Messages API by a worker
+        try:
+            if deliveries is not None:
+                deliveries.run_once(message_sid, lambda: _submit(reply_to, from_number, incoming_msg))
+            else:
+                _submit(reply_to, from_number, incoming_msg)
+        except queue.Full:
+            logging.error("❌ תור העבודה מלא – Twilio ינסה שוב")
+            return Response(status=503)
+        return Response(str(twiml), mimetype="application/xml")
+
+    if deliveries is not None:
+        response_text = deliveries.run_once(message_sid, lambda: process_message(from_number, incoming_msg))
+    else:
+        response_text = process_message(from_number, incoming_msg)
+    if response_text is None:
+        # The first delivery is still running, this retry is acknowledged without a second reply
+        logging.info(f"🔁 הודעה {message_sid} עדיין בעיבוד")
+        return Response(str(twiml), mimetype="application/xml")
     twiml.message(response_text)
-    print(response_text)
     logging.info(response_text)
     return Response(str(twiml), mimetype="application/xml")
 
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 4000))
-    app.run(debug=True, host="0.0.0.0", port=port)
\ No newline at end of file
+    app.run(debug=True, host="0.0.0.0", port=port, threaded=True)